@@ -11,219 +11,344 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import functools
+from enum import Enum
+
 import gi
-from SoundClip import util
-from SoundClip.util import now
+from SoundClip import discovery, fades, mediainfo, mixer, pipeline, scheduler, util
 
 gi.require_version('Gst', '1.0')
 
 import logging
 logger = logging.getLogger('SoundClip')
 
-from gi.repository import GLib, GObject, Gst, GstPbutils
+from gi.repository import GObject, Gst
 
+# Every cue plays through a pipeline of its own, see `SoundClip.pipeline`
+PIPELINE_ENGINE = 'pipeline'
+# Every cue plays through a branch of a single mixing pipeline, see `SoundClip.mixer`
+MIXER_ENGINE = 'mixer'
 
-def fade_curve_linear(initial_vol, target_vol, start, duration, t, user_args):
-    # Linear fade curve (Y = (M * (X - X_1))/Y_1)
-    return (((target_vol - initial_vol) / duration) * (t - start)) + initial_vol, t < (start + duration)
+# Milliseconds between the moment a group of cues is started, and the moment they start playing together. Has to be
+# longer than the latency of the mixer (see `mixer.MIX_LATENCY`)
+GROUP_START_LEAD = 50
 
-# TODO: Cubic and Bezier Fade Curves
+# Milliseconds a group of cues waits for its members to preroll before it starts. A pipeline that takes longer keeps
+# prerolling in the background, and starts playing once it is done
+PREROLL_TIMEOUT = 500
 
+# Milliseconds to wait after a group of cues started playing before their skew is measured
+SKEW_MEASURE_DELAY = 200
 
-class PlaybackController(GObject.Object):
+
+class PlaybackState(Enum):
+    STOPPED = 0
+    PLAYING = 1
+    PAUSED = 2
+
+
+def available_engines():
     """
-    Playback Controller for Audio Cues. Serves as a bridge between the cue and gstreamer.
+    :return: The names of the audio engines that can be used
+    """
+    return [PIPELINE_ENGINE] + ([MIXER_ENGINE] if mixer.is_available() else [])
 
-    # TODO: One pipeline for the whole program? Multiple volume sliders show up in gnome...
-    # TODO: Optional ReplayGain instead of forced
 
-    uridecodebin -> audioconvert -> rgvolume -> volume -> autoaudiosink
+def get_engine(name):
     """
+    :param name: The name of an audio engine. The pipeline engine is used if the name is empty or unknown, or the
+                 engine can't be used
+    :return: The pipeline pool or mixer playback controllers check their pipelines out of
+    """
+    if name == MIXER_ENGINE:
+        if mixer.is_available():
+            return mixer.get_mixer()
+        logger.warning("The mixer audio engine is not available, falling back to the pipeline engine")
+    elif name and name != PIPELINE_ENGINE:
+        logger.warning("Unknown audio engine {0}, falling back to the pipeline engine".format(name))
+    return pipeline.get_pool()
 
-    async_discoverer = None
-    discoverer = None
 
-    @staticmethod
-    def __setup_discoverer():
-        if PlaybackController.discoverer is None:
-            PlaybackController.discoverer = GstPbutils.Discoverer()
-        if PlaybackController.async_discoverer is None:
-            PlaybackController.async_discoverer = GstPbutils.Discoverer()
-            PlaybackController.async_discoverer.connect('starting', lambda *x: logger.debug("Async Discoverer starting"))
-            PlaybackController.async_discoverer.connect('finished', lambda *x: logger.debug("Async Discoverer Finished"))
-            PlaybackController.async_discoverer.start()
+class PlaybackController(GObject.Object):
+    """
+    Playback Controller for Audio Cues. Serves as a bridge between the cue and gstreamer.
+
+    The controller only holds a pipeline while its cue is armed or playing. It checks one out of its audio engine (the
+    shared pipeline pool, see `SoundClip.pipeline`, or the mixer, see `SoundClip.mixer`) when it is prerolled, played
+    or seeked, and returns it when playback stops or ends. Fades run on the pipeline, see `SoundClip.fades`.
+
+    The state of playback is read from the state the pipeline keeps from its bus, so it can be checked as often as
+    needed without waiting on the pipeline. Changes are announced through `playback-state-changed`.
+
+    # TODO: Optional ReplayGain instead of forced
+    """
 
     @staticmethod
     def is_file_supported(uri):
-        PlaybackController.__setup_discoverer()
-
-        try:
-            file = PlaybackController.discoverer.discover_uri("file://" + uri)
-            return len(file.get_audio_streams()) > 0
-        except GLib.Error as ex:
-            logger.warning("Cannot play audio file: {0}".format(ex.message))
-            return False
+        """
+        :param uri: The path of a media file
+        :return: Whether the file has an audio stream that can be played. Only discovers files that are not in the
+                 media information cache (see `SoundClip.mediainfo`)
+        """
+        return mediainfo.is_supported(uri)
 
     __gsignals__ = {
         'duration-discovered': (GObject.SIGNAL_RUN_FIRST, None, (int,)),
-        'playback-state-changed': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, )),
-        'tick': (GObject.SIGNAL_RUN_FIRST, None, ())
+        'playback-state-changed': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, ))
     }
 
-    def __init__(self, source, target_volume=1.0, postpone_duration_discovery=False, **properties):
+    def __init__(self, source, target_volume=1.0, postpone_duration_discovery=False, engine=None, **properties):
         super().__init__(**properties)
 
         logger.debug("Initializing to source {0}".format(source))
         self.__source = source
 
-        self.__fading = False
-        self.__fade_func = fade_curve_linear
-        self.__fade_func_args = {}
-        self.__fade_start_time = 0
-        self.__fade_duration = 0
-        self.__fade_start_vol = 0
-        self.__fade_target_volume = max(min(target_volume, 10.0), 0.0)
-        self.__fade_complete_func = None
-
-        self.__pipeline = Gst.Pipeline()
-
-        self.__bus = self.__pipeline.get_bus()
-        self.__bus.add_signal_watch()
-        self.__bus.connect('message::eos', self.on_eos)
-        self.__bus.connect('message::error', self.on_error)
-
-        self.__dec = Gst.ElementFactory.make('uridecodebin', None)
-        self.__dec.set_property('uri', self.__source)
-        self.__dec.connect('pad-added', self.__on_decoded_pad)
-        self.__dec.connect('drained', lambda *x: GLib.idle_add(self.on_drained))
-        self.__conv = Gst.ElementFactory.make('audioconvert', None)
-        self.__conv_sink = self.__conv.get_static_pad('sink')
-        self.__rgvol = Gst.ElementFactory.make('rgvolume', None)
-        self.__vol = Gst.ElementFactory.make('volume', None)
-        self.__sink = Gst.ElementFactory.make('autoaudiosink', None)
-
-        self.__pipeline.add(self.__dec)
-        self.__pipeline.add(self.__conv)
-        self.__pipeline.add(self.__rgvol)
-        self.__pipeline.add(self.__vol)
-        self.__pipeline.add(self.__sink)
-
-        self.__conv.link(self.__rgvol)
-        self.__rgvol.link(self.__vol)
-        self.__vol.link(self.__sink)
-
-        if PlaybackController.async_discoverer is None:
-            PlaybackController.__setup_discoverer()
-
-        if not postpone_duration_discovery:
-            dur = int(PlaybackController.discoverer.discover_uri(source).get_duration() / Gst.MSECOND)
-            logger.debug("Discovered length {0}".format(util.timefmt(dur)))
-            self.__duration = dur
-        else:
-            logger.debug("Postponing duration discovery")
-            self.__did = PlaybackController.async_discoverer.connect('discovered', self.__discoverer_async_callback)
-            PlaybackController.async_discoverer.discover_uri_async(source)
-            self.__duration = 0
+        # The volume and pan to apply when a pipeline is checked out
+        self.__volume = max(min(target_volume, 10.0), 0.0)
+        self.__pan = 0.0
+        self.__engine = engine if engine is not None else pipeline.get_pool()
+        self.__pipeline = None
+        self.__pipeline_engine = None
+        # Called once the pipeline that is being prerolled is ready to play
+        self.__preroll_callbacks = []
+        # The state last announced through `playback-state-changed`
+        self.__state = PlaybackState.STOPPED
 
-        # Schedule a tick on 50ms interval
         self.__active = True
-        GLib.timeout_add(50, self.tick)
-        self.__last_update_time = 0
+        self.__discover(postpone_duration_discovery)
 
     def __del__(self):
-        PlaybackController.async_discoverer.disconnect(self.__did)
-        self.__pipeline.set_state(Gst.State.NULL)
+        self.release()
+
+    def release(self):
+        """
+        Returns the pipeline. The controller can not be used after it has been released
+        """
+        if not self.__active:
+            return
+
+        logger.debug("Releasing playback controller for {0}".format(self.__source))
         self.__active = False
+        discovery.cancel(self.__source, self.__on_media_info)
+        self.__return_pipeline()
+
+    def change_source(self, source, postpone_duration_discovery=False):
+        """
+        Points the controller at another file. Playback is stopped, and the pipeline is returned
+        """
+        logger.debug("Changing source from {0} to {1}".format(self.__source, source))
+        discovery.cancel(self.__source, self.__on_media_info)
+        self.__return_pipeline()
+        self.__source = source
+        self.__discover(postpone_duration_discovery)
+
+    @property
+    def source(self):
+        return self.__source
+
+    def set_engine(self, engine):
+        """
+        Switches the controller to another audio engine (see `get_engine`). A cue that is playing keeps playing on the
+        engine it was started on until it stops
+        """
+        self.__engine = engine
+        if self.__pipeline is not None and not self.__pipeline.busy and self.__pipeline_engine is not engine:
+            self.__return_pipeline()
+
+    def __discover(self, postpone):
+        # Durations come from the media information cache, files are only discovered when they are new or changed
+        if not postpone:
+            info = mediainfo.discover(self.__source)
+            self.__duration = info.duration if info is not None else 0
+            logger.debug("Discovered length {0}".format(util.timefmt(self.__duration)))
+        else:
+            logger.debug("Postponing duration discovery")
+            self.__duration = 0
+            discovery.submit(self.__source, self.__on_media_info)
 
-    def __discoverer_async_callback(self, discoverer, info, error):
-        if info.get_uri() == self.__source:
-            if error:
-                logger.error("Error during discovery: {0}".format(error))
-            else:
-                dur = int(info.get_duration() / Gst.MSECOND)
-                logger.debug("Discovered length {0} for {1}".format(util.timefmt(dur), self.__source))
-                self.__duration = dur
-                self.emit('duration-discovered', dur)
-
-    def __on_decoded_pad(self, element, pad):
-        name = pad.query_caps(None).to_string()
-        if name.startswith("audio/") and not self.__conv_sink.is_linked():
-            logger.debug("Linking Pad: {0}".format(name))
-            pad.link(self.__conv_sink)
+    def prioritize_discovery(self, priority=discovery.PRIORITY_HIGH):
+        """
+        Moves the source of this controller up the discovery queue, if its duration is still being discovered
+        """
+        discovery.prioritize(self.__source, priority)
+
+    def __on_media_info(self, info):
+        if not self.__active:
+            return
+        if info is None or info.error is not None:
+            logger.error("Error during discovery of {0}: {1}".format(
+                self.__source, info.error if info is not None else "File not found"
+            ))
+        else:
+            logger.debug("Discovered length {0} for {1}".format(util.timefmt(info.duration), self.__source))
+            self.__duration = info.duration
+            self.emit('duration-discovered', info.duration)
+
+    def __checkout_pipeline(self):
+        if self.__pipeline is None:
+            self.__pipeline = self.__engine.checkout(self, self.__source)
+            self.__pipeline_engine = self.__engine
+            self.__pipeline.volume = self.__volume
+            self.__pipeline.pan = self.__pan
+        return self.__pipeline
+
+    def __return_pipeline(self):
+        self.__preroll_callbacks = []
+        if self.__pipeline is not None:
+            self.__volume = self.__pipeline.volume
+            p, self.__pipeline = self.__pipeline, None
+            self.__pipeline_engine.checkin(p)
+            self.__update_state()
+
+    def on_pipeline_reclaimed(self):
+        """
+        Called by the pipeline pool when it takes back the pipeline of this controller, which is not playing
+        """
+        logger.debug("Playback pipeline of {0} was reclaimed".format(self.__source))
+        self.__preroll_callbacks = []
+        self.__volume = self.__pipeline.volume
+        self.__pipeline = None
+        self.__update_state()
 
     def seek(self, ms):
         logger.debug("Playback Controller seek to {0}".format(ms))
-        self.__pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT, ms * 1000000)
+        if self.__pipeline is None:
+            # A pipeline can only be seeked once it is prerolled
+            self.preroll(lambda: self.__pipeline.seek(ms) if self.__pipeline is not None else None)
+        else:
+            self.__pipeline.seek(ms)
 
     def reset(self):
         logger.debug("Playback Controller Reset")
-        self.seek(0)
-        self.__pipeline.set_state(Gst.State.READY)
+        self.__return_pipeline()
 
-    def preroll(self):
+    def preroll(self, callback=None):
+        """
+        Gets the pipeline ready to play. Never blocks: the pipeline prerolls in the background
+
+        :param callback: Called without arguments on the main loop once the pipeline is ready to play, or has failed
+                         to preroll. Called straight away if it is ready already
+        """
         logger.debug("Playback Controller preroll")
-        self.__pipeline.set_state(Gst.State.PAUSED)
-        self.__pipeline.get_state(Gst.CLOCK_TIME_NONE)
-        self.__duration = self.__duration if self.__duration > 0 else \
-            int(self.__pipeline.query_duration(Gst.Format.TIME)[1] / Gst.MSECOND)
+        p = self.__checkout_pipeline()
+        if not self.prerolled and not self.is_pipeline_in_state(Gst.State.PAUSED):
+            p.set_state(Gst.State.PAUSED)
+        if callable(callback):
+            self.__preroll_callbacks.append(callback)
+        self.__update_state()
+        if self.prerolled:
+            self.__on_prerolled()
 
-    def play(self, volume=1.0, fade=0):
+    @property
+    def prerolled(self):
+        """
+        :return: Whether the pipeline is paused and ready to play, from the state the pipeline keeps. Never blocks
+        """
+        return self.__pipeline is not None and self.__pipeline.prerolled
+
+    def __on_prerolled(self):
+        if self.__duration <= 0 and self.prerolled:
+            self.__duration = self.__pipeline.query_duration()
+        callbacks, self.__preroll_callbacks = self.__preroll_callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def play(self, volume=1.0, fade=0, at=None):
+        """
+        :param at: The time on the shared clock (see `pipeline.get_clock`) to start playing at, in nanoseconds. Playback
+                   starts as soon as possible by default
+        """
         logger.debug("Playback Controller play ({0})".format("Fade={0}".format(fade) if fade > 0 else "Not Fading"))
 
+        p = self.__checkout_pipeline()
+        p.busy = True
+        self.__pipeline_engine.touch(p)
+
         if fade > 0:
-            self.__vol.set_property('volume', 0.0)
+            self.set_volume(0.0)
             self.fade_to(volume, fade)
         else:
-            self.__vol.set_property('volume', volume)
-            self.__fade_target_volume = volume
-            self.__fading = False
+            self.set_volume(volume)
+
+        if at is None:
+            p.set_state(Gst.State.PLAYING)
+        else:
+            p.play_at(at)
+        self.__update_state()
 
-        self.__pipeline.set_state(Gst.State.PLAYING)
+    def get_start_time(self):
+        """
+        :return: The time on the shared clock (see `pipeline.get_clock`) playback started at, if it was started at a set
+                 time and has started, otherwise `None`
+        """
+        return self.__pipeline.start_time if self.__pipeline is not None else None
 
-    def pause(self, fade=0):
+    def pause(self, fade=0, shape=fades.LINEAR):
         logger.debug("Playback Controller Pause")
+        if self.__pipeline is None:
+            return
         if fade > 0:
-            self.fade_to(0.0, fade, lambda *x: self.__pipeline.set_state(Gst.State.PAUSED))
+            self.fade_to(0.0, fade, self.__pause, shape)
         else:
+            self.__pause()
+
+    def __pause(self):
+        if self.__pipeline is not None:
             self.__pipeline.set_state(Gst.State.PAUSED)
+            self.__update_state()
 
-    def stop(self, fade=0):
+    def stop(self, fade=0, shape=fades.LINEAR):
         logger.debug("Playback Controller Stop Initiated (fade={0})".format(fade))
-        self.fade_to(0.0, fade, self.__stop) if fade > 0 else self.__stop()
-
-    def fade_to(self, target_volume, duration, callback=None):
-        if duration <= 0:
-            logger.warning("Asked to fade but fade duration was zero!")
+        self.fade_to(0.0, fade, self.__stop, shape) if fade > 0 else self.__stop()
+
+    def fade_to(self, target_volume, duration, callback=None, shape=fades.LINEAR):
+        """
+        Fades the volume to `target_volume` over the next `duration` milliseconds of playback
+
+        :param callback: Called once the volume is reached
+        :param shape: The shape of the fade, one of `fades.SHAPES`
+        """
+        target_volume = max(min(target_volume, 10.0), 0.0)
+        if duration <= 0 or self.__pipeline is None:
+            if duration <= 0:
+                logger.warning("Asked to fade but fade duration was zero!")
             self.set_volume(target_volume)
             if callable(callback):
                 callback()
             return
 
-        self.__fade_start_time = -1
-        self.__fade_duration = duration
-        self.__fade_start_vol = self.volume
-        self.__fade_target_volume = target_volume
-        self.__fade_complete_func = callback
-
-        logger.debug("Asked to fade from {0:.2f} to {1:.2f} over {2}ms".format(
-            self.__fade_start_vol, target_volume, duration
+        logger.debug("Asked to fade ({0}) from {1:.2f} to {2:.2f} over {3}ms".format(
+            shape, self.volume, target_volume, duration
         ))
-        self.__fading = True
+        self.__pipeline.fade(target_volume, duration, shape, callback)
 
     @property
     def volume(self):
-        return self.__vol.get_property('volume')
+        return self.__pipeline.volume if self.__pipeline is not None else self.__volume
+
+    @property
+    def fading(self):
+        return self.__pipeline is not None and self.__pipeline.fading
 
-    def set_volume(self, target, fade=0):
+    def set_volume(self, target, fade=0, shape=fades.LINEAR):
         if fade > 0:
-            self.fade_to(target, fade, None)
+            self.fade_to(target, fade, None, shape)
         else:
-            self.__vol.set_property('volume', target)
+            self.__volume = target
+            if self.__pipeline is not None:
+                self.__pipeline.volume = target
+
+    @property
+    def pan(self):
+        return self.__pan
+
+    def set_pan(self, pan):
+        self.__pan = max(min(pan, 1.0), -1.0)
+        if self.__pipeline is not None:
+            self.__pipeline.pan = self.__pan
 
     def __stop(self):
         logger.debug("Playback stopped")
-        self.__fading = False
-        self.__pipeline.set_state(Gst.State.NULL)
         self.reset()
 
     def on_eos(self, bus, message):
@@ -237,25 +362,48 @@ class PlaybackController(GObject.Object):
 
     def on_error(self, bus, message):
         logger.error("GStreamer playback error: {0}".format(message.parse_error()))
+        self.__update_state()
+        # The pipeline won't preroll anymore, whoever is waiting for it shouldn't wait any longer
+        self.__on_prerolled()
+
+    def on_state_changed(self):
+        """
+        Called by the pipeline once it has finished changing state, or a mixer branch once it is prerolled
+        """
+        self.__update_state()
+        if self.prerolled:
+            self.__on_prerolled()
 
     def get_position(self):
-        return int(self.__pipeline.query_position(Gst.Format.TIME)[1] / Gst.MSECOND)
+        return self.__pipeline.query_position() if self.__pipeline is not None else 0
 
     def get_duration(self):
         return self.__duration
 
-    def __pipeline_state(self, timeout=Gst.CLOCK_TIME_NONE):
-        return self.__pipeline.get_state(timeout)
+    def is_pipeline_in_state(self, state):
+        """
+        :return: Whether the pipeline is in `state`, or changing to it. Never blocks
+        """
+        if self.__pipeline is None:
+            return state == Gst.State.NULL
 
-    def is_pipeline_in_state(self, state, default_on_fail=False):
-        ok, pipeline_state, pending = self.__pipeline_state()
+        current, pending = self.__pipeline.state
+        return (pending if pending != Gst.State.VOID_PENDING else current) == state
 
-        if ok == Gst.StateChangeReturn.ASYNC:
-            return pending == state
-        elif ok == Gst.StateChangeReturn.SUCCESS:
-            return pipeline_state == state
-        else:
-            return default_on_fail
+    @property
+    def state(self):
+        """
+        :return: The `PlaybackState` of the controller
+        """
+        return PlaybackState.PLAYING if self.playing else PlaybackState.PAUSED if self.paused else \
+            PlaybackState.STOPPED
+
+    def __update_state(self):
+        state = self.state
+        if state != self.__state:
+            self.__state = state
+            if self.__active:
+                self.emit('playback-state-changed', state)
 
     @property
     def playing(self):
@@ -268,43 +416,164 @@ class PlaybackController(GObject.Object):
     @property
     def stopped(self):
         return not self.playing and not self.paused
+GObject.type_register(PlaybackController)
+
+
+class GroupStart(GObject.Object):
+    """
+    Starts several playback controllers together, sample-aligned
+
+    Started one after the other, every pipeline would start playing whenever its own state change completes, tens of
+    milliseconds apart. Instead, every member is prerolled first, then a moment `lead` milliseconds ahead is picked on
+    the clock every pipeline runs on (see `pipeline.get_clock`), or the moment given to `start`, and every member is
+    scheduled to start at that moment. Members that are already playing are left alone. Callbacks added with
+    `add_callback`, for cues that don't play audio, are run on the main loop at that moment, and the `started` signal
+    is emitted with it as soon as it is known.
+
+    Once they have started, the difference between the earliest and latest start of the members, their skew, is
+    measured and reported through the `measured` signal, in milliseconds. Prerolling never blocks the main loop: the
+    group is told by every member once it is ready (see `PlaybackController.preroll`), and picks its start time once
+    all of them are, or `PREROLL_TIMEOUT` milliseconds after `start`, whichever comes first. Members that did not
+    preroll in time start late, and show up in the skew.
+
+    :param lead: Milliseconds between `start` and the moment the members start playing
+    """
 
-    def tick(self):
-        if self.playing or self.paused:
-            if self.__fading:
-                # Adjust volume according to fade curve
-                if self.__fade_start_time == -1:
-                    self.__fade_start_time = now()
-
-                current_time = now()
-
-                v, cont = self.__fade_func(self.__fade_start_vol, self.__fade_target_volume,
-                                           int(self.__fade_start_time), int(self.__fade_duration),
-                                           current_time, self.__fade_func_args) \
-                    if callable(self.__fade_func) else self.__fade_target_volume
-
-                logger.debug("Fade Curve returned target volume {0}. Continuing: {1}".format(v, cont))
-
-                # Clamp result
-                if self.__fade_start_vol < self.__fade_target_volume <= v:
-                    logger.debug("CLAMPING: Higher than target volume")
-                    v = self.__fade_target_volume
-                    self.__fading = False
-                elif self.__fade_start_vol > self.__fade_target_volume >= v:
-                    logger.debug("CLAMPING: Lower than target volume")
-                    v = self.__fade_target_volume
-                    self.__fading = False
-                elif not cont:
-                    logger.debug("CLAMPING: Fade Function asked to stop")
-                    v = self.__fade_target_volume
-                    self.__fading = False
-
-                # Apply Volume Change
-                self.__vol.set_property('volume', v)
-
-                # If we're done fading, run callback
-                if not self.__fading and callable(self.__fade_complete_func):
-                    self.__fade_complete_func()
-            self.emit('tick')
-        self.__last_update_time = now()
-        return self.__active
\ No newline at end of file
+    __gsignals__ = {
+        'started': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_UINT64,)),
+        'measured': (GObject.SIGNAL_RUN_FIRST, None, (float,))
+    }
+
+    def __init__(self, lead=GROUP_START_LEAD, **properties):
+        super().__init__(**properties)
+
+        self.__lead = lead
+        self.__members = []
+        self.__callbacks = []
+        self.__started = []
+        self.__start_time = None
+        self.__skew = None
+        # Set once `start` was called, the time it was asked to start at, and the members it is still waiting for
+        self.__starting = False
+        self.__at = None
+        self.__waiting = []
+        self.__deadline = None
+
+    def __len__(self):
+        return len(self.__members)
+
+    @property
+    def start_time(self):
+        """
+        :return: The time on the shared clock the members were scheduled to start at, once the group was started
+        """
+        return self.__start_time
+
+    @property
+    def skew(self):
+        """
+        :return: The measured skew of the group in milliseconds, once it was measured
+        """
+        return self.__skew
+
+    @property
+    def waiting(self):
+        """
+        :return: The members the group is still waiting for to preroll, once it was started
+        """
+        return list(self.__waiting)
+
+    def add(self, controller, volume=1.0, fade=0):
+        """
+        Adds a playback controller to the group, to be played like `PlaybackController.play` once the group is started
+        """
+        if self.__starting:
+            raise ValueError("Cannot add to a group of cues that was already started")
+        self.__members.append((controller, volume, fade))
+
+    def add_callback(self, callback):
+        """
+        Runs `callback` on the main loop once the members of the group start playing
+        """
+        if self.__starting:
+            raise ValueError("Cannot add to a group of cues that was already started")
+        self.__callbacks.append(callback)
+
+    def start(self, at=None):
+        """
+        Prerolls every member, and schedules them to start playing together once they are ready. Returns straight away
+
+        :param at: The time on the shared clock to start at, in nanoseconds. Defaults to `lead` milliseconds after the
+                   members are ready. A group that is ready too late to make it starts `lead` milliseconds from then
+                   instead
+        """
+        if self.__starting or not (self.__members or self.__callbacks):
+            return
+        self.__starting = True
+        self.__at = at
+
+        self.__members = [(c, volume, fade) for c, volume, fade in self.__members if not c.playing]
+        self.__waiting = [c for c, volume, fade in self.__members]
+        if self.__waiting:
+            self.__deadline = scheduler.call_later(PREROLL_TIMEOUT, self.__on_deadline)
+        for c in list(self.__waiting):
+            c.preroll(functools.partial(self.__on_prerolled, c))
+        if not self.__waiting:
+            self.__go()
+
+    def __on_prerolled(self, c):
+        if c in self.__waiting:
+            self.__waiting.remove(c)
+            if not self.__waiting:
+                self.__go()
+
+    def __on_deadline(self):
+        self.__deadline = None
+        if self.__waiting:
+            logger.debug("{0} of {1} cues did not preroll within {2}ms".format(
+                len(self.__waiting), len(self.__members), PREROLL_TIMEOUT
+            ))
+        self.__go()
+
+    def __go(self):
+        if self.__start_time is not None:
+            return
+        if self.__deadline is not None:
+            self.__deadline.cancel()
+            self.__deadline = None
+        self.__waiting = []
+
+        at = self.__at
+        clock = pipeline.get_clock()
+        now = clock.get_time()
+        if at is not None and at < now + mixer.MIX_LATENCY * Gst.MSECOND:
+            logger.warning("Starting a group of cues {0:.3f}ms late".format((now - at) / Gst.MSECOND + self.__lead))
+            at = None
+        self.__start_time = now + self.__lead * Gst.MSECOND if at is None else at
+        self.emit('started', self.__start_time)
+
+        for callback in self.__callbacks:
+            scheduler.call_later((self.__start_time - clock.get_time()) / Gst.MSECOND, callback)
+        for c, volume, fade in self.__members:
+            c.play(volume, fade, at=self.__start_time)
+            self.__started.append(c)
+
+        logger.debug("Starting {0} cues together in {1:.3f}ms".format(
+            len(self.__started) + len(self.__callbacks), (self.__start_time - clock.get_time()) / Gst.MSECOND
+        ))
+        if self.__started:
+            scheduler.call_later((self.__start_time - clock.get_time()) / Gst.MSECOND + SKEW_MEASURE_DELAY,
+                                 self.__measure)
+
+    def __measure(self):
+        starts = [t for t in (c.get_start_time() for c in self.__started) if t is not None]
+        if not starts:
+            return
+
+        self.__skew = (max(starts) - min(starts)) / Gst.MSECOND
+        late = (max(starts) - self.__start_time) / Gst.MSECOND
+        logger.info("Started {0} of {1} cues together, {2:.3f}ms apart, last one {3:.3f}ms late".format(
+            len(starts), len(self.__started), self.__skew, late
+        ))
+        self.emit('measured', self.__skew)
+GObject.type_register(GroupStart)
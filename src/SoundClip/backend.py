@@ -0,0 +1,759 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Storage backends for the SoundClip object store
+
+`SoundClip.storage` takes care of hashing, encoding, caching and verifying objects. Backends only store the encoded
+bytes of every object under its key, the current project.json, and the append-only logs that go along with the
+objects (the history index, see `SoundClip.history`, the edit journal, see `SoundClip.journal`, and the objects that
+passed checksum verification, see `storage.VerifiedSet`):
+
+- `LooseBackend` (loose): one file per object under .soundclip/objects, plus an optional packfile, and one file per
+  log under .soundclip. The default
+- `SQLiteBackend` (sqlite): a single .soundclip/objects.db, logs included. Every save is one sqlite transaction, so one
+  sync
+- `MemoryBackend` (memory): nothing is written to disk, logs included. For tests and benchmarks
+
+The backend of a project on disk is detected from the files in its .soundclip directory, see `detect`.
+"""
+
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from SoundClip import pack
+from SoundClip.exception import SCException
+
+
+class BackendException(SCException):
+    pass
+
+
+PROJECT_NAME = 'project.json'
+DATABASE_NAME = 'objects.db'
+
+# The logs kept by every backend
+HISTORY_LOG = 'history'
+JOURNAL_LOG = 'journal'
+VERIFIED_LOG = 'verified'
+LOGS = (HISTORY_LOG, JOURNAL_LOG, VERIFIED_LOG)
+
+
+def sync(files=(), dirs=()):
+    """
+    Makes the specified files and directory entries durable, and nothing else: only these files and directories are
+    fsynced, not the whole file system the project lives on.
+
+    :param files: Paths of files that were written
+    :param dirs: Paths of directories entries were added to or renamed within
+    """
+    for path in files:
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+    for path in dirs:
+        pack.fsync_dir(path)
+
+
+class Batch(object):
+    """
+    A set of objects (and optionally a new project.json) that a backend stores all at once when committed
+    """
+
+    def put(self, key, data):
+        raise NotImplementedError()
+
+    def set_project(self, data):
+        raise NotImplementedError()
+
+    def commit(self):
+        raise NotImplementedError()
+
+    def abort(self):
+        raise NotImplementedError()
+
+
+class Backend(object):
+    """
+    Base class for storage backends. Backends must be safe to read from several threads at once, while a single batch
+    is being written.
+
+    :param root: The project root directory
+    """
+
+    name = None
+
+    def __init__(self, root):
+        self.root = root
+
+    def exists(self, key):
+        raise NotImplementedError()
+
+    def read(self, key):
+        """
+        :return: The encoded object and a stamp that changes whenever the object is written again, or `(None, None)`
+                 if the object doesn't exist
+        """
+        raise NotImplementedError()
+
+    def keys(self):
+        """
+        :return: An iterator of the key of every object in the backend
+        """
+        raise NotImplementedError()
+
+    def object_time(self, key):
+        """
+        :return: The time the object was written as a unix timestamp (or a time after that), or `None` if it doesn't
+                 exist
+        """
+        raise NotImplementedError()
+
+    def read_project(self):
+        """
+        :return: The content of project.json, or `None` if no project was stored yet
+        """
+        raise NotImplementedError()
+
+    def batch(self):
+        raise NotImplementedError()
+
+    def remove(self, keys):
+        """
+        Deletes objects that are no longer referenced. Backends may defer removing some of them until `compact`
+
+        :return: The number of objects that were removed
+        """
+        raise NotImplementedError()
+
+    def compact(self, keep, fold=True):
+        """
+        Reclaims the space of objects that are not in `keep`
+
+        :param keep: The keys of the objects that are still referenced
+        :param fold: Whether to also reorganize the objects that are kept, if the backend supports it
+        :return: The number of objects dropped, and the number of objects reorganized
+        """
+        return 0, 0
+
+    def repack(self, check=None):
+        return 0
+
+    def read_log(self, name):
+        """
+        :param name: The name of the log, one of `LOGS`
+        :return: The lines of the log, each ending with a newline except for a last line cut short by a crash, or an
+                 empty list if the log doesn't exist
+        """
+        raise NotImplementedError()
+
+    def append_log(self, name, lines):
+        """
+        Durably appends lines to a log, creating it if it doesn't exist
+
+        :param lines: The lines to append, each ending with a newline
+        """
+        raise NotImplementedError()
+
+    def write_log(self, name, lines):
+        """
+        Atomically replaces the content of a log
+        """
+        raise NotImplementedError()
+
+    def remove_log(self, name):
+        raise NotImplementedError()
+
+    def cleanup(self, check=None):
+        """
+        Removes whatever was left behind by saves that never finished
+
+        :param check: Called as `check(key, raw)` for objects a backend might be able to recover instead. Objects it
+                      returns `False` for are removed
+        """
+        pass
+
+    def close(self):
+        pass
+
+
+class LooseBatch(Batch):
+    """
+    Objects are written to temporary files under .soundclip/tmp as they are added. `commit` makes the batch durable with
+    a single sync of its own files and of .soundclip/tmp, renames every object into place, and finally atomically
+    replaces project.json and syncs .soundclip, which is the commit point.
+
+    The renames of the objects are not synced on their own: a rename lost to a crash leaves the object's complete
+    temporary file behind, which `LooseBackend.cleanup` moves into place the next time the project is loaded.
+    """
+
+    def __init__(self, backend):
+        self.__backend = backend
+        self.__root = backend.root
+        self.__objects = os.path.join(self.__root, '.soundclip', 'objects')
+        self.__tmp = backend.temp_path()
+        self.__pending = {}
+        self.__project = None
+
+        if not os.path.exists(self.__tmp):
+            os.makedirs(self.__tmp)
+
+    def __write_temp(self, prefix, data):
+        fd, path = tempfile.mkstemp(prefix=prefix, suffix='.tmp', dir=self.__tmp)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        return path
+
+    def put(self, key, data):
+        self.__pending[key] = self.__write_temp(key, data)
+
+    def set_project(self, data):
+        self.__project = data
+
+    def commit(self):
+        project_tmp = None
+        if self.__project is not None:
+            project_tmp = self.__write_temp('project', self.__project)
+
+        files = list(self.__pending.values()) + ([project_tmp] if project_tmp else [])
+        if not files:
+            return
+
+        # One sync for the whole batch, before anything is renamed. Temporary files are named after their key, so an
+        # object whose rename doesn't survive a crash can still be found in .soundclip/tmp
+        sync(files=files, dirs=[self.__tmp])
+
+        for key, path in self.__pending.items():
+            d = os.path.join(self.__objects, key[0:2])
+            if not os.path.exists(d):
+                os.makedirs(d)
+            logger.debug("Writing {0}".format(os.path.join(d, key[2:40])))
+            os.replace(path, os.path.join(d, key[2:40]))
+
+        if project_tmp is not None:
+            os.replace(project_tmp, os.path.join(self.__root, '.soundclip', PROJECT_NAME))
+            pack.fsync_dir(os.path.join(self.__root, '.soundclip'))
+
+    def abort(self):
+        for path in self.__pending.values():
+            if os.path.exists(path):
+                os.remove(path)
+        self.__pending.clear()
+
+
+class LooseBackend(Backend):
+    """
+    One file per object under .soundclip/objects, keyed like git by the sha1 of the object: the first two characters
+    of the hash are the sub directory, the remaining 38 the name of the file. Objects can be folded into a packfile
+    with `repack` (see `SoundClip.pack`), and are always looked up in the pack first.
+    """
+
+    name = 'loose'
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.__pack = None
+        self.__lock = threading.Lock()
+
+    def __object_path(self, key):
+        return os.path.join(self.root, '.soundclip', 'objects', key[0:2], key[2:40])
+
+    def temp_path(self):
+        return os.path.join(self.root, '.soundclip', 'tmp')
+
+    def get_pack(self):
+        """
+        :return: The (lazily opened) packfile of the project
+        """
+        with self.__lock:
+            if self.__pack is None:
+                self.__pack = pack.PackFile(self.root)
+            return self.__pack
+
+    def close_pack(self):
+        with self.__lock:
+            if self.__pack is not None:
+                self.__pack.close()
+                self.__pack = None
+
+    def loose_objects(self):
+        """
+        :return: An iterator of `(key, path)` for every loose object in the object store
+        """
+        objects = os.path.join(self.root, '.soundclip', 'objects')
+        if not os.path.isdir(objects):
+            return
+
+        for prefix in sorted(os.listdir(objects)):
+            d = os.path.join(objects, prefix)
+            if len(prefix) != 2 or not os.path.isdir(d):
+                continue
+            for name in sorted(os.listdir(d)):
+                if len(name) == 38:
+                    yield prefix + name, os.path.join(d, name)
+
+    def exists(self, key):
+        return key in self.get_pack() or os.path.exists(self.__object_path(key))
+
+    def read(self, key):
+        p = self.get_pack()
+        raw = p.get(key)
+        if raw is not None:
+            return raw, p.stamp(key)
+
+        path = self.__object_path(key)
+        if not os.path.exists(path):
+            return None, None
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            return f.read(), "loose:{0}:{1}:{2}".format(st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def keys(self):
+        loose = set()
+        for key, path in self.loose_objects():
+            loose.add(key)
+            yield key
+        for key in self.get_pack().keys():
+            if key not in loose:
+                yield key
+
+    def object_time(self, key):
+        # Packed objects report the time of the last change to the packfile
+        path = self.__object_path(key)
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+        if key in self.get_pack():
+            return os.path.getmtime(os.path.join(pack.pack_path(self.root), pack.PACK_NAME))
+        return None
+
+    def read_project(self):
+        path = os.path.join(self.root, '.soundclip', PROJECT_NAME)
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rt") as f:
+            return f.read()
+
+    def batch(self):
+        return LooseBatch(self)
+
+    def __log_path(self, name):
+        return os.path.join(self.root, '.soundclip', name)
+
+    def read_log(self, name):
+        path = self.__log_path(name)
+        if not os.path.isfile(path):
+            return []
+        with open(path, 'rt') as f:
+            return f.readlines()
+
+    def append_log(self, name, lines):
+        path = self.__log_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'at') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def write_log(self, name, lines):
+        path = self.__log_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wt') as f:
+            f.writelines(lines)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+    def remove_log(self, name):
+        path = self.__log_path(name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def remove(self, keys):
+        # Packed objects can only be dropped by rewriting the pack, see `compact`
+        removed = 0
+        for key in keys:
+            path = self.__object_path(key)
+            if not os.path.exists(path):
+                continue
+            os.remove(path)
+            removed += 1
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+        return removed
+
+    def compact(self, keep, fold=True):
+        """
+        Rewrites the packfile without the objects that are not in `keep`. With `fold`, the loose objects in `keep`
+        are moved into the new pack as well.
+        """
+        existing = self.get_pack()
+        packed = set(existing.keys())
+        dropped = len([key for key in packed if key not in keep])
+        loose = [(key, path) for key, path in self.loose_objects() if key in keep] if fold else []
+
+        if dropped or loose:
+            objects = [(key, existing.get(key)) for key in sorted(packed) if key in keep]
+            for key, path in loose:
+                if key not in packed:
+                    with open(path, 'rb') as f:
+                        objects.append((key, f.read()))
+
+            self.close_pack()
+            pack.rewrite(self.root, objects)
+            self.remove(key for key, path in loose)
+
+        return dropped, len(loose)
+
+    def repack(self, check=None):
+        """
+        Folds all loose objects into the packfile. Loose objects are only removed once the pack and its index have been
+        written to disk.
+
+        :param check: Called as `check(key, raw)` for every loose object. Objects it returns `False` for are left where
+                      they are
+        :return: the number of objects that were added to the packfile
+        """
+        objects = []
+        paths = []
+        for key, path in self.loose_objects():
+            with open(path, "rb") as f:
+                raw = f.read()
+            if check is not None and not check(key, raw):
+                logger.warning("Not packing corrupt object {0}".format(key))
+                continue
+            # Objects are packed as they are, compressed objects stay compressed
+            objects.append((key, raw))
+            paths.append(path)
+
+        added = pack.append(self.root, objects, existing=self.get_pack())
+        self.close_pack()
+
+        for path in paths:
+            os.remove(path)
+            try:
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+        logger.info("Packed {0} loose objects for {1} ({2} new)".format(len(paths), self.root, added))
+        return added
+
+    def cleanup(self, check=None):
+        """
+        Finishes moving objects into place whose rename didn't survive a crash (see `LooseBatch`), and removes every
+        other temporary file. An object is only moved into place if `check` accepts it, since the temporary files of a
+        save that never reached its sync may be incomplete
+        """
+        path = self.temp_path()
+        if not os.path.isdir(path):
+            return
+
+        for name in os.listdir(path):
+            key = name[0:40]
+            if check is not None and len(key) == 40 and not self.exists(key):
+                with open(os.path.join(path, name), "rb") as f:
+                    raw = f.read()
+                if check(key, raw):
+                    logger.warning("Recovering object {0} from an interrupted save".format(key))
+                    d = os.path.dirname(self.__object_path(key))
+                    if not os.path.exists(d):
+                        os.makedirs(d)
+                    os.replace(os.path.join(path, name), self.__object_path(key))
+                    continue
+            logger.warning("Removing stale temporary file {0} from an interrupted save".format(name))
+            os.remove(os.path.join(path, name))
+
+    def close(self):
+        self.close_pack()
+
+
+class MemoryBatch(Batch):
+
+    def __init__(self, backend):
+        self.__backend = backend
+        self.__pending = {}
+        self.__project = None
+
+    def put(self, key, data):
+        self.__pending[key] = data
+
+    def set_project(self, data):
+        self.__project = data
+
+    def commit(self):
+        self.__backend.apply(self.__pending, self.__project)
+
+    def abort(self):
+        self.__pending.clear()
+
+
+class MemoryBackend(Backend):
+    """
+    Keeps every object in memory. Nothing survives the process
+    """
+
+    name = 'memory'
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.__objects = {}
+        self.__project = None
+        self.__logs = {}
+        self.__lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.__objects)
+
+    def exists(self, key):
+        return key in self.__objects
+
+    def read(self, key):
+        entry = self.__objects.get(key, None)
+        return (entry[0], 'memory') if entry is not None else (None, None)
+
+    def keys(self):
+        return iter(list(self.__objects.keys()))
+
+    def object_time(self, key):
+        entry = self.__objects.get(key, None)
+        return entry[1] if entry is not None else None
+
+    def read_project(self):
+        return self.__project.decode('utf-8') if self.__project is not None else None
+
+    def batch(self):
+        return MemoryBatch(self)
+
+    def apply(self, objects, project):
+        now = time.time()
+        with self.__lock:
+            for key, data in objects.items():
+                self.__objects.setdefault(key, (bytes(data), now))
+            if project is not None:
+                self.__project = bytes(project)
+
+    def remove(self, keys):
+        removed = 0
+        with self.__lock:
+            for key in keys:
+                if self.__objects.pop(key, None) is not None:
+                    removed += 1
+        return removed
+
+    def read_log(self, name):
+        with self.__lock:
+            return list(self.__logs.get(name, ()))
+
+    def append_log(self, name, lines):
+        with self.__lock:
+            self.__logs.setdefault(name, []).extend(lines)
+
+    def write_log(self, name, lines):
+        with self.__lock:
+            self.__logs[name] = list(lines)
+
+    def remove_log(self, name):
+        with self.__lock:
+            self.__logs.pop(name, None)
+
+
+class SQLiteBatch(Batch):
+
+    def __init__(self, backend):
+        self.__backend = backend
+        self.__pending = {}
+        self.__project = None
+
+    def put(self, key, data):
+        self.__pending[key] = data
+
+    def set_project(self, data):
+        self.__project = data
+
+    def commit(self):
+        self.__backend.apply(self.__pending, self.__project)
+
+    def abort(self):
+        self.__pending.clear()
+
+
+class SQLiteBackend(Backend):
+    """
+    Stores every object, project.json and the logs in a single sqlite database, .soundclip/objects.db. Each save is a
+    single transaction, so it costs a single sync of the write-ahead log, and objects are found through the primary key
+    index. Logs are stored a line per row, in the order they were appended. Reads use one connection per thread.
+    """
+
+    name = 'sqlite'
+
+    __SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS objects (key TEXT PRIMARY KEY, data BLOB NOT NULL, written REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS refs (name TEXT PRIMARY KEY, data BLOB NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS logs (name TEXT NOT NULL, line TEXT NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS logs_name ON logs (name)"
+    )
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.__path = os.path.join(root, '.soundclip', DATABASE_NAME)
+        self.__local = threading.local()
+        self.__connections = []
+        self.__lock = threading.Lock()
+
+        if not os.path.isdir(os.path.dirname(self.__path)):
+            os.makedirs(os.path.dirname(self.__path))
+
+        c = self.__connection()
+        with c:
+            for statement in SQLiteBackend.__SCHEMA:
+                c.execute(statement)
+
+    def __connection(self):
+        c = getattr(self.__local, 'connection', None)
+        if c is None:
+            c = sqlite3.connect(self.__path, timeout=30, check_same_thread=False)
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("PRAGMA synchronous=FULL")
+            self.__local.connection = c
+            with self.__lock:
+                self.__connections.append(c)
+        return c
+
+    def exists(self, key):
+        return self.__connection().execute("SELECT 1 FROM objects WHERE key = ?", (key, )).fetchone() is not None
+
+    def read(self, key):
+        row = self.__connection().execute("SELECT rowid, data FROM objects WHERE key = ?", (key, )).fetchone()
+        if row is None:
+            return None, None
+        return bytes(row[1]), "sqlite:{0}".format(row[0])
+
+    def keys(self):
+        return iter([row[0] for row in self.__connection().execute("SELECT key FROM objects")])
+
+    def object_time(self, key):
+        row = self.__connection().execute("SELECT written FROM objects WHERE key = ?", (key, )).fetchone()
+        return row[0] if row is not None else None
+
+    def read_project(self):
+        row = self.__connection().execute("SELECT data FROM refs WHERE name = 'project'").fetchone()
+        return bytes(row[0]).decode('utf-8') if row is not None else None
+
+    def batch(self):
+        return SQLiteBatch(self)
+
+    def apply(self, objects, project):
+        if not objects and project is None:
+            return
+        now = time.time()
+        c = self.__connection()
+        with c:
+            c.executemany("INSERT OR IGNORE INTO objects (key, data, written) VALUES (?, ?, ?)",
+                          ((key, sqlite3.Binary(data), now) for key, data in objects.items()))
+            if project is not None:
+                c.execute("INSERT OR REPLACE INTO refs (name, data) VALUES ('project', ?)", (sqlite3.Binary(project), ))
+
+    def remove(self, keys):
+        c = self.__connection()
+        with c:
+            return c.executemany("DELETE FROM objects WHERE key = ?", ((key, ) for key in keys)).rowcount
+
+    def read_log(self, name):
+        return [row[0] for row in self.__connection().execute("SELECT line FROM logs WHERE name = ? ORDER BY rowid",
+                                                              (name, ))]
+
+    def append_log(self, name, lines):
+        c = self.__connection()
+        with c:
+            c.executemany("INSERT INTO logs (name, line) VALUES (?, ?)", ((name, line) for line in lines))
+
+    def write_log(self, name, lines):
+        c = self.__connection()
+        with c:
+            c.execute("DELETE FROM logs WHERE name = ?", (name, ))
+            c.executemany("INSERT INTO logs (name, line) VALUES (?, ?)", ((name, line) for line in lines))
+
+    def remove_log(self, name):
+        c = self.__connection()
+        with c:
+            c.execute("DELETE FROM logs WHERE name = ?", (name, ))
+
+    def compact(self, keep, fold=True):
+        if fold:
+            self.__connection().execute("VACUUM")
+        return 0, 0
+
+    def close(self):
+        with self.__lock:
+            for c in self.__connections:
+                c.close()
+            self.__connections = []
+        self.__local = threading.local()
+
+
+__BACKENDS = {}
+
+
+def register(cls):
+    """
+    Makes a backend available by its name
+
+    :param cls: A `Backend` subclass
+    """
+    if not cls.name:
+        raise ValueError("Backends must have a name")
+    __BACKENDS[cls.name] = cls
+
+
+def available():
+    return sorted(__BACKENDS.keys())
+
+
+def create(name, root):
+    """
+    :param name: The name of a registered backend
+    :param root: The project root directory
+    :return: A new instance of the named backend for the specified project
+    """
+    if name not in __BACKENDS:
+        raise BackendException({"message": "Unknown storage backend {0}".format(name), "backend": name})
+    return __BACKENDS[name](root)
+
+
+def detect(root):
+    """
+    :param root: The project root directory
+    :return: The name of the backend the project on disk was stored with, or `None` if nothing was stored yet
+    """
+    d = os.path.join(root, '.soundclip')
+    if os.path.isfile(os.path.join(d, DATABASE_NAME)):
+        return SQLiteBackend.name
+    if os.path.isfile(os.path.join(d, PROJECT_NAME)) or os.path.isdir(os.path.join(d, 'objects')):
+        return LooseBackend.name
+    return None
+
+
+register(LooseBackend)
+register(MemoryBackend)
+register(SQLiteBackend)
@@ -0,0 +1,23 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Storage and load benchmarks for SoundClip
+
+Generates a synthetic show (see `generator`), backed by tiny silent media files and a playback controller that never
+touches GStreamer or an audio device (see `media`), and times loading and saving it (see `runner`). Results are written
+as JSON so runs on different commits can be compared:
+
+    python3 -m SoundClip.bench --stacks 4 --cues 1000 --revisions 10 -o before.json
+    python3 -m SoundClip.bench --stacks 4 --cues 1000 --revisions 10 -o after.json --baseline before.json
+"""
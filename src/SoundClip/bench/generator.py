@@ -0,0 +1,166 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Synthetic show generator for the SoundClip benchmarks
+
+Builds a project with a configurable number of cue stacks and cues, mostly audio cues with some control cues mixed in,
+and saves it a configurable number of times with a fraction of the cues edited in between, so the object store has a
+realistic revision history. Everything is derived from a seed, so the same spec always generates the same show.
+"""
+
+import os
+import random
+import time
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from SoundClip.bench.media import write_media
+from SoundClip.cue import CueStack, build_cue
+from SoundClip.project import Project
+
+MEDIA_DIR = 'media'
+
+
+class ShowSpec(object):
+    """
+    Describes a synthetic show
+
+    :param stacks: The number of cue stacks
+    :param cues: The number of cues in every cue stack
+    :param revisions: The number of times the show is saved
+    :param edit_fraction: The fraction of the cues edited between two saves
+    :param control_ratio: The fraction of the cues that are control cues
+    :param media_files: The number of distinct media files the audio cues play
+    :param seed: The seed of the random generator
+    """
+
+    def __init__(self, stacks=2, cues=500, revisions=5, edit_fraction=0.05, control_ratio=0.1, media_files=20,
+                 seed=0):
+        self.stacks = stacks
+        self.cues = cues
+        self.revisions = revisions
+        self.edit_fraction = edit_fraction
+        self.control_ratio = control_ratio
+        self.media_files = media_files
+        self.seed = seed
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def __repr__(self):
+        return "ShowSpec({0})".format(self.as_dict())
+
+
+def write_library(root, spec, rng):
+    """
+    Writes the media files of the show
+
+    :return: A dictionary of the paths of the media files, relative to the project root, to their durations
+    """
+    media = {}
+    for i in range(max(1, spec.media_files)):
+        path = os.path.join(MEDIA_DIR, "track{0:04d}.wav".format(i))
+        media[path] = rng.randint(5, 300) * 1000
+        write_media(os.path.join(root, path), media[path])
+    return media
+
+
+def make_cue(project, rng, media, number, control_ratio=0.0):
+    """
+    Creates a random cue the way it would have been loaded from the object store
+
+    :param project: The project the cue belongs to
+    :param rng: The random generator
+    :param media: The media files audio cues can play, and their durations (see `write_library`)
+    :param number: The cue number
+    :param control_ratio: The probability of creating a control cue (targeting the previous cue) instead of an audio cue
+    """
+    d = {
+        'name': "Cue {0:g}".format(number),
+        'description': "Synthetic cue {0:g}".format(number),
+        'notes': " ".join(rng.choice(("fade", "house", "preshow", "band", "sfx", "stand by", "go")) for i in range(8)),
+        'number': number,
+        'preWait': rng.choice((0, 0, 0, 500, 1000)),
+        'postWait': rng.choice((0, 0, 0, 250)),
+        'previousRevision': None
+    }
+    if number > 1 and rng.random() < control_ratio:
+        d.update({'type': 'control', 'targetVolume': rng.random(), 'fadeDuration': rng.randint(1, 10) * 500,
+                  'stopTargetOnVolumeReached': rng.random() < 0.5,
+                  'target': {'ref': None, 'type': 'relative', 'index': -1}})
+    else:
+        src = rng.choice(sorted(media.keys()))
+        d.update({'type': 'audio', 'src': src, 'pitch': 0.0, 'pan': rng.uniform(-1.0, 1.0),
+                  'gain': rng.uniform(-1.0, 0.0), 'fadeInTime': rng.choice((0, 0, 1000)),
+                  'fadeOutTime': rng.choice((0, 2000, 5000)), 'durationHint': media[src]})
+
+    cue = build_cue(project.root, None, d, project)
+    cue.mark_dirty()
+    return cue
+
+
+def edit(project, rng, fraction):
+    """
+    Edits a random fraction of the cues of a project, the way an operator would between two saves
+
+    :return: The number of cues that were edited
+    """
+    cues = [(stack, i) for stack in project.cue_stacks for i in range(len(stack))]
+    count = max(1, int(len(cues) * fraction)) if fraction > 0 else 0
+    for stack, i in rng.sample(cues, min(count, len(cues))):
+        cue = stack[i]
+        choice = rng.random()
+        if choice < 0.5:
+            cue.notes = "{0} (rev {1})".format(cue.notes.split(" (rev")[0], rng.randint(0, 1 << 30))
+        elif choice < 0.8:
+            cue.pre_wait = rng.randint(0, 20) * 100
+        else:
+            cue.name = "{0} *".format(cue.name.rstrip(" *"))
+    return count
+
+
+def generate(root, spec, backend="", codec="", journal=False):
+    """
+    Generates a show and saves it `spec.revisions` times
+
+    :param root: The directory to generate the project in
+    :param spec: A `ShowSpec`
+    :param backend: The storage backend to store the project with
+    :param codec: The object codec to store the project with
+    :param journal: Whether to journal edits (see `SoundClip.journal`)
+    :return: The project, and the time every save took in seconds
+    """
+    rng = random.Random(spec.seed)
+    media = write_library(root, spec, rng)
+
+    project = Project(name="Synthetic Show", creator="SoundClip Benchmarks", root=root, cue_stacks=[],
+                      storage_backend=backend, object_codec=codec, journal_edits=journal)
+
+    for s in range(spec.stacks):
+        stack = CueStack(project=project, name="Stack {0}".format(s + 1))
+        for i in range(spec.cues):
+            stack += make_cue(project, rng, media, i + 1, spec.control_ratio)
+        project.add_cuelist(stack)
+
+    saves = []
+    for r in range(max(1, spec.revisions)):
+        if r > 0:
+            edit(project, rng, spec.edit_fraction)
+        started = time.perf_counter()
+        project.store()
+        saves.append(time.perf_counter() - started)
+
+    logger.info("Generated {0} in {1:.3f}s".format(spec, sum(saves)))
+    return project, saves
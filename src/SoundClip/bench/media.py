@@ -0,0 +1,208 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fake media for running SoundClip without audio hardware
+
+Media files are real (silent) WAV files with a very low sample rate, so they are tiny but still have a duration. The
+`FakePlaybackController` stands in for `audio.PlaybackController`: it reads the duration from the file header and
+tracks playback state and volume, but never builds a GStreamer pipeline.
+"""
+
+import os
+import wave
+from contextlib import contextmanager
+from urllib.parse import unquote, urlparse
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, GObject
+
+from SoundClip.cue import AudioCue, PlaybackState
+
+# Frames per second of the generated media. One byte per frame keeps a three minute file under 20 KiB
+SAMPLE_RATE = 100
+
+
+def write_media(path, duration):
+    """
+    Writes a silent WAV file
+
+    :param path: The path to write to
+    :param duration: The duration of the file, in milliseconds
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    w = wave.open(path, 'wb')
+    try:
+        w.setnchannels(1)
+        w.setsampwidth(1)
+        w.setframerate(SAMPLE_RATE)
+        w.writeframes(b'\x80' * (duration * SAMPLE_RATE // 1000))
+    finally:
+        w.close()
+
+
+def media_duration(uri):
+    """
+    :param uri: A file:// uri or path of a media file written by `write_media`
+    :return: The duration of the file in milliseconds, or 0 if it can't be read
+    """
+    path = unquote(urlparse(uri).path) if uri.startswith('file://') else uri
+    try:
+        w = wave.open(path, 'rb')
+    except (OSError, EOFError, wave.Error):
+        return 0
+    try:
+        return int(w.getnframes() * 1000 / w.getframerate())
+    finally:
+        w.close()
+
+
+class FakePlaybackController(GObject.Object):
+    """
+    A playback controller that only pretends to play. See `audio.PlaybackController` for the interface
+    """
+
+    __gsignals__ = {
+        'duration-discovered': (GObject.SIGNAL_RUN_FIRST, None, (int,)),
+        'playback-state-changed': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, ))
+    }
+
+    @staticmethod
+    def is_file_supported(uri):
+        return media_duration(uri) > 0
+
+    def __init__(self, source, target_volume=1.0, postpone_duration_discovery=False, engine=None, **properties):
+        super().__init__(**properties)
+
+        self.__source = source
+        self.__volume = max(min(target_volume, 10.0), 0.0)
+        self.__state = PlaybackState.STOPPED
+        self.__duration = 0
+
+        if postpone_duration_discovery:
+            GLib.idle_add(self.__discover)
+        else:
+            self.__duration = media_duration(source)
+
+    def __discover(self):
+        self.__duration = media_duration(self.__source)
+        self.emit('duration-discovered', self.__duration)
+        return False
+
+    def release(self):
+        self.__state = PlaybackState.STOPPED
+
+    def prioritize_discovery(self, priority=0):
+        pass
+
+    def set_engine(self, engine):
+        pass
+
+    def set_pan(self, pan):
+        pass
+
+    def change_source(self, source, postpone_duration_discovery=False):
+        self.__source = source
+        self.__state = PlaybackState.STOPPED
+        self.__duration = 0
+        if postpone_duration_discovery:
+            GLib.idle_add(self.__discover)
+        else:
+            self.__duration = media_duration(source)
+
+    def seek(self, ms):
+        pass
+
+    def reset(self):
+        self.__state = PlaybackState.STOPPED
+
+    def preroll(self, callback=None):
+        if self.__duration <= 0:
+            self.__duration = media_duration(self.__source)
+        if callable(callback):
+            callback()
+
+    @property
+    def prerolled(self):
+        return True
+
+    def __set_state(self, state):
+        self.__state = state
+        self.emit('playback-state-changed', state)
+
+    def play(self, volume=1.0, fade=0, at=None):
+        self.__volume = volume
+        self.__set_state(PlaybackState.PLAYING)
+
+    def get_start_time(self):
+        return None
+
+    def pause(self, fade=0, shape=None):
+        self.__set_state(PlaybackState.PAUSED)
+
+    def stop(self, fade=0, shape=None):
+        self.__set_state(PlaybackState.STOPPED)
+
+    def fade_to(self, target_volume, duration, callback=None, shape=None):
+        self.__volume = target_volume
+        if callable(callback):
+            callback()
+
+    @property
+    def volume(self):
+        return self.__volume
+
+    @property
+    def fading(self):
+        return False
+
+    def set_volume(self, target, fade=0, shape=None):
+        self.__volume = target
+
+    def get_position(self):
+        return 0
+
+    def get_duration(self):
+        return self.__duration
+
+    @property
+    def state(self):
+        return self.__state
+
+    @property
+    def playing(self):
+        return self.__state is PlaybackState.PLAYING
+
+    @property
+    def paused(self):
+        return self.__state is PlaybackState.PAUSED
+
+    @property
+    def stopped(self):
+        return self.__state is PlaybackState.STOPPED
+GObject.type_register(FakePlaybackController)
+
+
+@contextmanager
+def fake_playback():
+    """
+    Plays audio cues created inside the block with a `FakePlaybackController`
+    """
+    previous = AudioCue.controller_type
+    AudioCue.controller_type = FakePlaybackController
+    try:
+        yield
+    finally:
+        AudioCue.controller_type = previous
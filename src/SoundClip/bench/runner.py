@@ -0,0 +1,305 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Runs the SoundClip storage benchmarks and reports the results as JSON
+
+Every timing is repeated and reported as its minimum, median and mean in seconds:
+
+generate            Every save made while generating the show, with a fraction of the cues edited in between
+full-save           The first save of a newly generated show, which writes every object
+incremental-save    Saving after editing `edits` cues
+cold-load           `Project.load` with nothing of the project held in memory (the operating system's page cache is
+                    not dropped). With the memory backend only the object cache is cleared
+warm-load           `Project.load` while the object cache still holds the project
+lazy-load           A cold `Project.load` that only reads the cue stack indices
+
+The object cache counters of a cold and a warm load, and the size of the project's `.soundclip` directory (or the
+objects held by the memory backend) are reported as well.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from SoundClip import __version__, backend, codec, history, storage
+from SoundClip.bench import generator
+from SoundClip.bench.media import fake_playback
+from SoundClip.project import Project
+
+RESULTS_VERSION = 1
+
+
+def summarize(times):
+    """
+    :param times: Durations in seconds
+    :return: The minimum, median and mean of the durations
+    """
+    return {
+        'runs': len(times),
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times)
+    }
+
+
+def footprint(root):
+    """
+    :param root: The project root directory
+    :return: The number of files and bytes the object store of the project takes up
+    """
+    b = storage.get_backend(root)
+    if b.name == backend.MemoryBackend.name:
+        keys = list(b.keys())
+        return {'files': 0, 'objects': len(keys), 'bytes': sum(len(b.read(key)[0]) for key in keys)}
+
+    files = 0
+    size = 0
+    for path, dirs, names in os.walk(os.path.join(root, '.soundclip')):
+        if os.path.basename(path) == 'logs':
+            dirs[:] = []
+            continue
+        for name in names:
+            files += 1
+            size += os.path.getsize(os.path.join(path, name))
+    return {'files': files, 'objects': len(list(b.keys())), 'bytes': size}
+
+
+def release(project):
+    """
+    Frees the cues of a project loaded by the benchmark without dropping its storage, so the next load can be warm
+    """
+    for stack in project.cue_stacks:
+        for cue in stack.loaded():
+            cue.release()
+    project.cue_map.clear()
+    project.close_logfile()
+    if project.journal is not None:
+        project.journal.close(discard=False)
+
+
+def forget(root):
+    """
+    Drops everything held in memory for a project, so the next load is cold
+    """
+    if storage.get_backend(root).name == backend.MemoryBackend.name:
+        storage.get_cache().clear(root)
+    else:
+        storage.forget(root)
+    history.forget(root)
+
+
+def timed_load(root, lazy=False):
+    started = time.perf_counter()
+    p = Project.load(root, lazy=lazy)
+    elapsed = time.perf_counter() - started
+    release(p)
+    return elapsed
+
+
+def git_revision():
+    """
+    :return: The commit the benchmarked code was checked out at, if it is in a git repository
+    """
+    try:
+        out = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.abspath(__file__)),
+                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.decode('utf-8').strip() or None if out.returncode == 0 else None
+
+
+def run(spec, workdir, backend_name="", codec_name="", repeat=5, edits=1, journal=False):
+    """
+    Generates a show and benchmarks it
+
+    :param spec: A `generator.ShowSpec`
+    :param workdir: An empty directory to generate projects in
+    :param backend_name: The storage backend to use
+    :param codec_name: The object codec to use
+    :param repeat: How often every measurement is repeated
+    :param edits: The number of cues edited before every incremental save
+    :param journal: Whether to journal edits (see `SoundClip.journal`)
+    :return: The results, as a dictionary
+    """
+    root = os.path.join(workdir, 'show')
+    os.makedirs(root)
+    if backend_name == backend.MemoryBackend.name:
+        storage.attach(root, backend.create(backend_name, root))
+
+    results = {}
+    with fake_playback():
+        project, saves = generator.generate(root, spec, backend=backend_name, codec=codec_name, journal=journal)
+        results['generate'] = summarize(saves)
+        release(project)
+
+        forget(root)
+        cold = [timed_load(root)]
+        results['cache-cold'] = storage.get_cache().stats(root).as_dict()
+        for i in range(repeat - 1):
+            forget(root)
+            cold.append(timed_load(root))
+        results['cold-load'] = summarize(cold)
+
+        before = storage.get_cache().stats(root)
+        results['warm-load'] = summarize([timed_load(root) for i in range(repeat)])
+        after = storage.get_cache().stats(root)
+        results['cache-warm'] = {k: v - before.as_dict()[k] if k in ('hits', 'misses', 'evictions') else v
+                                 for k, v in after.as_dict().items()}
+
+        lazy = []
+        for i in range(repeat):
+            forget(root)
+            lazy.append(timed_load(root, lazy=True))
+        results['lazy-load'] = summarize(lazy)
+
+        rng = random.Random(spec.seed + 1)
+        project = Project.load(root)
+        incremental = []
+        for i in range(repeat):
+            generator.edit(project, rng, edits / max(1, spec.stacks * spec.cues))
+            started = time.perf_counter()
+            project.store()
+            incremental.append(time.perf_counter() - started)
+        results['incremental-save'] = summarize(incremental)
+        release(project)
+
+        full = []
+        single = generator.ShowSpec(**dict(spec.as_dict(), revisions=1))
+        for i in range(repeat):
+            copy = os.path.join(workdir, 'copy{0}'.format(i))
+            os.makedirs(copy)
+            if backend_name == backend.MemoryBackend.name:
+                storage.attach(copy, backend.create(backend_name, copy))
+            p, saves = generator.generate(copy, single, backend=backend_name, codec=codec_name, journal=journal)
+            full.append(saves[0])
+            release(p)
+            storage.forget(copy)
+            history.forget(copy)
+        results['full-save'] = summarize(full)
+
+    results['footprint'] = footprint(root)
+    storage.forget(root)
+    history.forget(root)
+    return results
+
+
+
+def compare(results, baseline):
+    """
+    :param results: The results of a benchmark run (see `main`)
+    :param baseline: The results of an earlier run to compare to
+    :return: The ratio of every median time to the baseline's, keyed by measurement
+    """
+    ratios = {}
+    for name, r in results['results'].items():
+        b = baseline.get('results', {}).get(name, None)
+        if isinstance(r, dict) and 'median' in r and isinstance(b, dict) and b.get('median', 0) > 0:
+            ratios[name] = r['median'] / b['median']
+    return ratios
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python3 -m SoundClip.bench",
+                                     description="Benchmark loading and saving a synthetic SoundClip show")
+    parser.add_argument("--stacks", help="The number of cue stacks", type=int, default=2)
+    parser.add_argument("--cues", help="The number of cues in every cue stack", type=int, default=500)
+    parser.add_argument("--revisions", help="The number of times the show is saved while it is generated", type=int,
+                        default=5)
+    parser.add_argument("--edit-fraction", help="The fraction of the cues edited between two of those saves",
+                        type=float, default=0.05)
+    parser.add_argument("--control-ratio", help="The fraction of the cues that are control cues", type=float,
+                        default=0.1)
+    parser.add_argument("--media-files", help="The number of distinct media files", type=int, default=20)
+    parser.add_argument("--seed", help="The seed of the show generator", type=int, default=0)
+    parser.add_argument("--backend", help="The storage backend ({0})".format(", ".join(backend.available())),
+                        type=str, default=backend.LooseBackend.name)
+    parser.add_argument("--codec", help="The object codec ({0})".format(", ".join(codec.available())), type=str,
+                        default="")
+    parser.add_argument("--journal", help="Journal edits while generating and saving", action="store_true")
+    parser.add_argument("--repeat", help="How often every measurement is repeated", type=int, default=5)
+    parser.add_argument("--edits", help="The number of cues edited before every incremental save", type=int,
+                        default=1)
+    parser.add_argument("--workdir", help="The directory to generate projects in. Defaults to a temporary directory "
+                                          "that is removed afterwards", type=str, default=None)
+    parser.add_argument("-o", "--output", help="The file to write the results to, instead of stdout", type=str,
+                        default=None)
+    parser.add_argument("--baseline", help="Results of an earlier run to compare against", type=str, default=None)
+    parser.add_argument("-l", "--log", help="The logging level to print", type=str, default="WARNING")
+    args = parser.parse_args(argv)
+
+    level = getattr(logging, args.log.upper(), None)
+    if not isinstance(level, int):
+        raise ValueError('Invalid log level: %s' % args.log)
+    logging.basicConfig(level=level, stream=sys.stderr)
+    logger.setLevel(level)
+
+    if args.backend not in backend.available():
+        parser.error("Unknown storage backend {0}".format(args.backend))
+    if args.codec and args.codec not in codec.available():
+        parser.error("Unknown object codec {0}".format(args.codec))
+
+    spec = generator.ShowSpec(stacks=args.stacks, cues=args.cues, revisions=args.revisions,
+                              edit_fraction=args.edit_fraction, control_ratio=args.control_ratio,
+                              media_files=args.media_files, seed=args.seed)
+
+    workdir = args.workdir if args.workdir else tempfile.mkdtemp(prefix="soundclip-bench-")
+    try:
+        started = time.time()
+        results = run(spec, workdir, backend_name=args.backend, codec_name=args.codec, repeat=max(1, args.repeat),
+                      edits=args.edits, journal=args.journal)
+    finally:
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    out = {
+        'version': RESULTS_VERSION,
+        'soundclip': __version__,
+        'commit': git_revision(),
+        'time': started,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'spec': spec.as_dict(),
+        'backend': args.backend,
+        'codec': args.codec,
+        'journal': args.journal,
+        'repeat': max(1, args.repeat),
+        'edits': args.edits,
+        'results': results
+    }
+
+    if args.baseline:
+        with open(args.baseline, 'rt') as f:
+            baseline = json.load(f)
+        out['baseline'] = {'commit': baseline.get('commit', None), 'ratios': compare(out, baseline)}
+        for name, ratio in sorted(out['baseline']['ratios'].items()):
+            print("{0:<18} {1:6.2f}x".format(name, ratio), file=sys.stderr)
+
+    text = json.dumps(out, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'wt') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
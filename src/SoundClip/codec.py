@@ -0,0 +1,132 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Object encodings for the SoundClip object store
+
+Objects are stored either as plain json text, or compressed with a codec. Compressed objects start with a small header
+naming the codec, which can never be the start of a json document:
+
+\\0<codec name>\\0<encoded content>
+
+Object hashes are always computed over the canonical (plain json) content, so compressing an object does not change
+its key, and stores can mix plain and compressed objects freely.
+"""
+
+import zlib
+
+from SoundClip.exception import SCException
+
+
+class CodecException(SCException):
+    pass
+
+
+class Codec(object):
+    """
+    Base class for object codecs. Codecs are registered by name with `register`
+    """
+
+    name = None
+
+    def encode(self, data):
+        raise NotImplementedError()
+
+    def decode(self, data):
+        raise NotImplementedError()
+
+
+class ZlibCodec(Codec):
+
+    name = 'zlib'
+
+    def __init__(self, level=6):
+        self.__level = level
+
+    def encode(self, data):
+        return zlib.compress(data, self.__level)
+
+    def decode(self, data):
+        try:
+            return zlib.decompress(data)
+        except zlib.error as ex:
+            raise CodecException({"message": "Corrupt zlib stream: {0}".format(ex), "codec": self.name})
+
+
+__CODECS = {}
+
+_MARKER = b'\0'
+
+
+def register(codec):
+    """
+    Makes a codec available for writing and reading objects
+
+    :param codec: An instance of a `Codec` subclass
+    """
+    if not codec.name or '\0' in codec.name:
+        raise ValueError("Codecs must have a name")
+    __CODECS[codec.name] = codec
+
+
+def get(name):
+    """
+    :return: The codec registered under the specified name, or `None` if `name` is empty (plain json)
+    """
+    if not name:
+        return None
+    if name not in __CODECS:
+        raise CodecException({"message": "Unknown object codec {0}".format(name), "codec": name})
+    return __CODECS[name]
+
+
+def available():
+    return sorted(__CODECS.keys())
+
+
+def encode(content, name=None):
+    """
+    :param content: The canonical json text of an object
+    :param name: The codec to encode with, or `None` to store plain json
+    :return: The bytes to write to the object store
+    """
+    data = content.encode('utf-8')
+    c = get(name)
+    if c is None:
+        return data + b'\n'
+    return _MARKER + c.name.encode('ascii') + _MARKER + c.encode(data)
+
+
+def decode(raw):
+    """
+    :param raw: The bytes read from the object store
+    :return: The canonical json text of the object
+    """
+    try:
+        if not raw.startswith(_MARKER):
+            return raw.decode('utf-8').strip()
+
+        end = raw.find(_MARKER, 1)
+        if end < 0:
+            raise CodecException({"message": "Truncated object codec header"})
+
+        name = raw[1:end].decode('ascii')
+        if not name:
+            raise CodecException({"message": "Empty object codec header"})
+        c = get(name)
+        return c.decode(raw[end+1:]).decode('utf-8').strip()
+    except UnicodeDecodeError as ex:
+        raise CodecException({"message": "Object content is not valid text: {0}".format(ex)})
+
+
+register(ZlibCodec())
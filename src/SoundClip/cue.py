@@ -11,21 +11,24 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import functools
 import os
 import logging
 import shutil
-from SoundClip.audio import PlaybackController
+import weakref
+from SoundClip import audio, discovery, fades, pipeline, scheduler
+from SoundClip.audio import PlaybackController, PlaybackState
 from SoundClip.gui.widgets import TimePicker
-from SoundClip.util import Timer
+from SoundClip.scheduler import Timer
 
 logger = logging.getLogger('SoundClip')
 
 from enum import Enum
-from gi.repository import GLib, GObject, Gtk
+from gi.repository import GObject, Gst, Gtk
 
-from SoundClip import storage, util
+from SoundClip import cuetree, storage, util
 from SoundClip.exception import SCException
-from SoundClip.storage import read, write
+from SoundClip.storage import read
 
 
 class MalformedCueException(SCException):
@@ -44,13 +47,19 @@ class PlaybackActionType(Enum):
     FADE_OUT = 4
 
 
-class PlaybackState(Enum):
-    STOPPED = 0
-    PLAYING = 1
-    PAUSED = 2
+__PROGRESS_UPDATE_INTERVAL__ = 100
 
+# The number of cues, from the next one on, whose media is discovered before the rest of the cue stack
+DISCOVERY_LOOKAHEAD = 8
 
-__PROGRESS_UPDATE_INTERVAL__ = 100
+# What a cue does with the next cue in its cue stack (see `Cue.continue_mode`). Nothing, the operator sends it GO
+CONTINUE_NONE = 'none'
+# The next cue is sent GO once the post-wait of the cue has passed, counted from the start of its action
+AUTO_CONTINUE = 'auto-continue'
+# The next cue is sent GO when the action of the cue ends, moved by its follow offset
+AUTO_FOLLOW = 'auto-follow'
+
+CONTINUE_MODES = (CONTINUE_NONE, AUTO_CONTINUE, AUTO_FOLLOW)
 
 
 class Cue(GObject.GObject):
@@ -70,14 +79,25 @@ class Cue(GObject.GObject):
     number = GObject.Property(type=float)
     pre_wait = GObject.Property(type=GObject.TYPE_LONG)
     post_wait = GObject.Property(type=GObject.TYPE_LONG)
+    continue_mode = GObject.Property(type=str, default=CONTINUE_NONE)
+    # Milliseconds between the end of the action and an auto-follow. Negative offsets start the next cue early
+    follow_offset = GObject.Property(type=GObject.TYPE_LONG, default=0)
     current_hash = GObject.Property(type=str)
     last_hash = GObject.Property(type=str)
 
+    # Properties that describe where the cue is in the object store rather than the cue itself
+    __UNTRACKED_PROPERTIES__ = ('current-hash', 'last-hash')
+
     def __init__(self, project, name="Untitled Cue", description="", notes="", number=-1.0, pre_wait=0, post_wait=0):
         GObject.GObject.__init__(self)
 
         self._project = project
 
+        # New cues have never been stored
+        self.__dirty = True
+        self.__revision = 0
+        self.connect('notify', self.__on_notify)
+
         self.name = name
         self.description = description
         self.notes = notes
@@ -86,9 +106,74 @@ class Cue(GObject.GObject):
         self.__elapsed_pre_wait = 0
         self.post_wait = post_wait
 
+        # The time on the shared clock (see `pipeline.get_clock`) the current action started at
+        self.__action_time = None
+        self.__continue_task = None
+        # Whether the next cue was already sent GO since the cue was last started from the top
+        self.__continued = False
+        # Whether the cue auto-follows, but waits for its duration to be known (or for its action to end)
+        self.__follow_waiting = False
+
     def __len__(self):
         return self.duration
 
+    def __on_notify(self, obj, pspec):
+        if pspec.name not in Cue.__UNTRACKED_PROPERTIES__:
+            self.mark_dirty(pspec.name)
+
+    @property
+    def dirty(self):
+        return self.__dirty
+
+    def mark_dirty(self, prop=None):
+        """
+        Flags the cue as changed since it was last stored. Changes to GObject properties are tracked automatically,
+        custom cues must call this when any other state that ends up in `serialize` changes. The change is reported to
+        the project through its `cue-changed` signal (see `SoundClip.journal`).
+
+        :param prop: The name of the GObject property that changed, or `None` if it was any other state
+        """
+        self.__dirty = True
+        self.__revision += 1
+        if self._project is not None:
+            self._project.emit('cue-changed', self, prop)
+
+    def mark_clean(self):
+        self.__dirty = False
+
+    def needs_store(self):
+        """
+        :return: Whether the cue has to be serialized again, or its `current_hash` is still valid
+        """
+        return self.__dirty or not self.current_hash
+
+    def snapshot(self, memo):
+        """
+        Captures the state of the cue for storing. Clean cues are represented by their current hash, changed cues are
+        serialized into a `storage.PendingObject` that can be hashed and written off the main thread.
+
+        :param memo: A dictionary shared by everything captured for the same save, so a cue referenced from several
+                     places is only serialized once
+        :return: the current hash of the cue, or a pending object
+        """
+        if not self.needs_store():
+            return self.current_hash
+        if self not in memo:
+            memo[self] = storage.PendingObject(self, self.serialize({}, memo), self.current_hash, self.__revision)
+        return memo[self]
+
+    def on_stored(self, pending):
+        """
+        Called on the main thread once a snapshot of this cue has been written to the object store
+
+        :param pending: The `storage.PendingObject` returned by `snapshot`
+        """
+        self.current_hash, self.last_hash = pending.checksum, pending.last_hash
+
+        # The cue may have been edited again while it was being written
+        if pending.revision == self.__revision:
+            self.__dirty = False
+
     def go(self):
         logger.debug("(CUE) GO received for [{0:g}]{1}".format(self.number, self.name))
         if self.pre_wait <= 0:
@@ -109,14 +194,150 @@ class Cue(GObject.GObject):
 
             t.fire()
 
-    def action(self):
+    def go_with(self, group, skip_pre_wait=False):
+        """
+        Sends GO to the cue as part of a group of cues started together (see `go_together`). Cues that play audio join
+        the group, so they start sample-aligned with the rest of it; other cues are sent GO on the main loop when the
+        group starts
+
+        :param group: The `audio.GroupStart` of the group
+        :param skip_pre_wait: Whether to start the action of the cue straight away
+        """
+        if skip_pre_wait or self.pre_wait <= 0:
+            group.add_callback(lambda: self.action(group))
+        else:
+            group.add_callback(self.go)
+
+    def action(self, group=None):
+        """
+        Starts the action of the cue. Make sure you chain up to this super method when you override it, it schedules the
+        next cue if this one continues into it
+
+        :param group: The `audio.GroupStart` the cue is started with, see `go_with`. Starts straight away by default
+        """
         logger.debug("(CUE) Starting action for [{0:g}]{1}".format(self.number, self.name))
+        if self.state is PlaybackState.STOPPED:
+            self.__continued = False
+
+        if group is None:
+            self.__begin(pipeline.get_clock().get_time())
+        elif group.start_time is not None:
+            self.__begin(group.start_time)
+        else:
+            group.connect('started', lambda g, t: self.__begin(t))
+
+    def __begin(self, clock_time):
+        # Schedules the next cue on the shared clock, counting from the moment the action starts rather than from
+        # whenever the main loop got around to it, so chained cues don't drift
+        self.__action_time = clock_time
+        self.__cancel_continue()
+
+        if self.__continued or self._project is None:
+            return
+        if self.continue_mode == AUTO_CONTINUE:
+            self.__schedule_continue(clock_time, self.post_wait)
+        elif self.continue_mode == AUTO_FOLLOW:
+            self.__schedule_follow(clock_time)
+
+    def __schedule_follow(self, clock_time):
+        if self.duration <= 0:
+            # The duration is not known yet, the next cue is scheduled once it is (see `reschedule_follow`), or started
+            # when this one ends (see `ended`)
+            if self.__arm_next():
+                self.__follow_waiting = True
+            return
+        self.__schedule_continue(clock_time, max(0, self.duration - self.elapsed) + self.follow_offset)
+
+    def __schedule_continue(self, clock_time, delay):
+        if not self.__arm_next():
+            return
+        at = clock_time + max(0, delay) * Gst.MSECOND
+        # Woken up early, so the next cue can be started at exactly `at`
+        wake = (at - pipeline.get_clock().get_time()) / Gst.MSECOND - audio.GROUP_START_LEAD
+        self.__continue_task = scheduler.call_later(wake, self.__continue, at)
+
+    def __arm_next(self):
+        # Returns whether there is a next cue to continue into
+        stack = self._project.get_cue_list_for(self)
+        if stack is None or stack.index(self) + 1 >= len(stack):
+            return False
+        # Armed now, so it does not have to preroll when it is started. Arming only starts the preroll (see
+        # `audio.PlaybackController.preroll`), and the group the next cue is started with waits for it without blocking
+        scheduler.call_later(0, lambda: stack.arm(stack.index(self) + 1) if self in stack else None)
+        return True
+
+    def reschedule_follow(self):
+        """
+        Schedules the next cue again, for a cue that auto-follows and is running, from its current duration and
+        position. Cue types call this when their duration is discovered or changes after their action started
+        """
+        if self.continue_mode != AUTO_FOLLOW or self.__continued or self._project is None:
+            return
+        if self.__continue_task is None and not self.__follow_waiting:
+            return
+        self.__cancel_continue()
+        self.__schedule_follow(pipeline.get_clock().get_time())
+
+    def ended(self):
+        """
+        Called by cue types whose action ends on its own, like audio cues reaching the end of their file. Starts the
+        next cue of a cue that auto-follows, but whose duration was never known
+        """
+        if not self.__follow_waiting or self.__continued:
+            return
+        self.__follow_waiting = False
+        lead = audio.GROUP_START_LEAD + max(0, self.follow_offset)
+        self.__continue(pipeline.get_clock().get_time() + lead * Gst.MSECOND)
+
+    def __continue(self, at):
+        self.__continue_task = None
+        stack = self._project.get_cue_list_for(self)
+        i = stack.index(self) + 1 if stack is not None else -1
+        if i <= 0 or i >= len(stack):
+            return
+
+        c = stack[i]
+        logger.debug("[{0:g}]{1} continues into [{2:g}]{3}".format(self.number, self.name, c.number, c.name))
+        self.__continued = True
+        group = audio.GroupStart()
+        c.go_with(group)
+        group.start(at)
+
+    def __cancel_continue(self):
+        self.__follow_waiting = False
+        if self.__continue_task is not None:
+            self.__continue_task.cancel()
+            self.__continue_task = None
 
     def pause(self):
         logger.debug("PAUSE received for [{0:g}]{1}".format(self.number, self.name))
+        self.__cancel_continue()
 
     def stop(self, fade=0):
         logger.debug("STOP received for [{0:g}]{1}".format(self.number, self.name))
+        self.__cancel_continue()
+
+    def release(self):
+        """
+        Frees any resources (playback pipelines, timers, etc.) held by this cue. Called when the project that owns
+        the cue is closed. Make sure you chain up to this super method if you override it.
+        """
+        logger.debug("Releasing [{0:g}]{1}".format(self.number, self.name))
+        self.__cancel_continue()
+
+    def prioritize_discovery(self, priority=discovery.PRIORITY_HIGH):
+        """
+        Moves the media this cue plays up the discovery queue (see `SoundClip.discovery`), for cues that are about to
+        be played
+        """
+        pass
+
+    def arm(self):
+        """
+        Gets the cue ready to be played without delay, for the next cue in a cue stack. Audio cues preroll their
+        playback pipeline
+        """
+        pass
 
     @GObject.property
     def duration(self):
@@ -132,7 +353,10 @@ class Cue(GObject.GObject):
 
     @GObject.property
     def elapsed_postwait(self):
-        return 0
+        if self.__continue_task is None or self.continue_mode != AUTO_CONTINUE:
+            return 0
+        elapsed = int((pipeline.get_clock().get_time() - self.__action_time) / Gst.MSECOND)
+        return max(0, min(elapsed, self.post_wait))
 
     @GObject.property
     def state(self):
@@ -166,22 +390,27 @@ class Cue(GObject.GObject):
         self.number = float(util.pick(j, 'number', -1.0))
         self.pre_wait = int(util.pick(j, 'preWait', 0))
         self.post_wait = int(util.pick(j, 'postWait', 0))
+        self.continue_mode = util.pick(j, 'continueMode', CONTINUE_NONE)
+        if self.continue_mode not in CONTINUE_MODES:
+            logger.warning("Unknown continue mode {0} for [{1:g}]{2}".format(self.continue_mode, self.number,
+                                                                              self.name))
+            self.continue_mode = CONTINUE_NONE
+        self.follow_offset = int(util.pick(j, 'followOffset', 0))
 
         self.current_hash = key
         self.last_hash = util.pick(j, 'previousRevision', None)
 
         return self
 
-    def store(self, root, d):
+    def serialize(self, d, memo):
         """
-        Stores the cue in the object repository. If you are creating a custom sub class, make sure you chain up to this
-        super method as the last call in your cue's `store` method. This writes the common properties and saves the cue
-        to the object store
+        Serializes the cue into a dictionary for the object store. If you are creating a custom sub class, make sure
+        you chain up to this super method to write the common properties. This is called on the main thread, so it
+        should only copy state; hashing and writing happen later.
 
-        :param root: The project root path
         :param d: A dictionary of properties to serialize. Use this when chaining up to super methods
-        :return: the hash that this cue was written to the repository to. If the has returned matches the `current_hash`
-                    of this cue before storing it, the cue has not changed and no write has taken place for this object
+        :param memo: The memo passed to `snapshot`. Use it to snapshot any cues this cue references
+        :return: the serialized dictionary
         """
         d['name'] = self.name
         d['description'] = self.description
@@ -189,9 +418,25 @@ class Cue(GObject.GObject):
         d['number'] = self.number
         d['preWait'] = self.pre_wait
         d['postWait'] = self.post_wait
+        d['continueMode'] = self.continue_mode
+        d['followOffset'] = self.follow_offset
         d['previousRevision'] = self.last_hash
 
-        self.current_hash, self.last_hash = write(root, d, self.current_hash)
+        return d
+
+    def store(self, root):
+        """
+        Stores the cue in the object repository, if it changed since it was last loaded or stored
+
+        :param root: The project root path
+        :return: the hash that this cue was written to the repository to. If the has returned matches the `current_hash`
+                    of this cue before storing it, the cue has not changed and no write has taken place for this object
+        """
+        results = []
+        with storage.Transaction(root) as tx:
+            storage.resolve(tx, self.snapshot({}), results)
+        for pending in results:
+            pending.apply()
 
         return self.current_hash
 
@@ -355,6 +600,9 @@ class AudioCue(Cue):
     fade_in_time = GObject.Property(type=GObject.TYPE_LONG, default=0)
     fade_out_time = GObject.Property(type=GObject.TYPE_LONG, default=0)
 
+    # The type of the playback controllers audio cues are played with. Swapped out to run without audio hardware
+    controller_type = PlaybackController
+
     def __init__(self, project, name="Untitled Cue", description="", notes="", number=-1.0, pre_wait=0, post_wait=0,
                  audio_source_uri="", pitch=0, pan=0, gain=0, fade_in_time=0, fade_out_time=0,
                  postpone_duration_discovery=False):
@@ -370,10 +618,14 @@ class AudioCue(Cue):
         self.fade_out_time = fade_out_time
         self.__duration_hint = 0
         self.__ddid = None
+        self.__psid = None
+        self.__update_task = None
+        # The playback controller only holds a pipeline once the cue is armed or played, see `arm`
         if os.path.isfile(os.path.abspath(os.path.join(project.root, self.__src))):
-            self.__pbc = PlaybackController("file://" + os.path.abspath(os.path.join(project.root, self.__src)),
-                                            postpone_duration_discovery=postpone_duration_discovery)
-            self.__pbc.preroll()
+            self.__pbc = self.controller_type("file://" + os.path.abspath(os.path.join(project.root, self.__src)),
+                                              postpone_duration_discovery=postpone_duration_discovery,
+                                              engine=audio.get_engine(project.audio_engine))
+            self.__connect_controller()
         else:
             self.__pbc = None
 
@@ -397,17 +649,26 @@ class AudioCue(Cue):
 
     def change_source(self, src, postpone_duration_discovery=False):
         self.__src = src
+        self.mark_dirty()
         logger.debug("Audio source changed for {0} to {1}, changing playback controller".format(self.name, src))
-        if self.__pbc is not None and self.__pbc.playing:
-            self.__pbc.stop()
-        if self.__ddid is not None:
-            self.__pbc.disconnect(self.__ddid)
-        self.__pbc = PlaybackController("file://" + os.path.abspath(os.path.join(self._project.root, src)),
-                                        postpone_duration_discovery=postpone_duration_discovery)
+        uri = "file://" + os.path.abspath(os.path.join(self._project.root, src))
+        if self.__pbc is None:
+            self.__pbc = self.controller_type(uri, postpone_duration_discovery=postpone_duration_discovery,
+                                              engine=audio.get_engine(self._project.audio_engine))
+        else:
+            # The controller (and its pipeline, if it holds one) is pointed at the new file rather than rebuilt
+            if self.__pbc.playing:
+                self.stop()
+            self.__pbc.change_source(uri, postpone_duration_discovery=postpone_duration_discovery)
         if not postpone_duration_discovery:
             self.__duration_hint = self.__pbc.get_duration()
-        self.__ddid = self.__pbc.connect('duration-discovered', self.on_pbc_duration_discovered)
-        self.__pbc.preroll()
+        self.__connect_controller()
+
+    def __connect_controller(self):
+        if self.__ddid is None:
+            self.__ddid = self.__pbc.connect('duration-discovered', self.on_pbc_duration_discovered)
+        if self.__psid is None:
+            self.__psid = self.__pbc.connect('playback-state-changed', self.on_pbc_state_changed)
 
     @GObject.Property
     def duration(self):
@@ -419,15 +680,25 @@ class AudioCue(Cue):
 
     def on_pbc_duration_discovered(self, pbc, duration):
         eps = abs(duration-self.__duration_hint)
-        if duration != self.__duration_hint and eps > self._project.max_duration_discovery_difference:
+        if duration == self.__duration_hint:
+            return
+        if self.__duration_hint > 0:
+            if eps <= self._project.max_duration_discovery_difference:
+                return
             logger.warning(
                 "WARNING: Audio file may have changed on disk for {0}: Duration was {1}, got {2} (delta: {3}ms)".format(
                     self.__src, util.timefmt(self.__duration_hint), util.timefmt(duration),
                     abs(duration-self.__duration_hint)
                 )
             )
-            self.__duration_hint = duration
-            self.emit('update')
+        self.__duration_hint = duration
+        self.mark_dirty()
+        self.emit('update')
+        self.reschedule_follow()
+
+    def on_pbc_state_changed(self, pbc, state):
+        if state is PlaybackState.STOPPED:
+            self.ended()
 
     def get_editor(self):
         return AudioCue.Editor(self, self._project.root)
@@ -441,37 +712,80 @@ class AudioCue(Cue):
             self.fade_in_time = w.get_fade_in_time()
             self.fade_out_time = w.get_fade_out_time()
 
-            # We need to preroll the playback controller in order to get the length of the audio file
-            self.__pbc.preroll()
-            self.__pbc.stop()
+    def go_with(self, group, skip_pre_wait=False):
+        if self.pre_wait > 0 and not skip_pre_wait:
+            # The pre-wait is timed on the main loop, so the cue can't start with the group
+            super().go_with(group, skip_pre_wait)
+        else:
+            logger.debug("(CUE) GO received for [{0:g}]{1} as part of a group".format(self.number, self.name))
+            self.action(group)
 
-    def action(self):
-        super().action()
+    def action(self, group=None):
+        """
+        :param group: The `audio.GroupStart` to start playing with, see `go_with`. Plays straight away by default
+        """
+        super().action(group)
 
-        self.__pbc.play(fade=self.fade_in_time)
+        self.__pbc.set_pan(self.pan)
+        if group is not None:
+            group.add(self.__pbc, fade=self.fade_in_time)
+        else:
+            self.__pbc.play(fade=self.fade_in_time)
         self.emit('update')
-        GLib.timeout_add(__PROGRESS_UPDATE_INTERVAL__, self.__update_func)
+        if self.__update_task is not None:
+            self.__update_task.cancel()
+        self.__update_task = scheduler.call_every(__PROGRESS_UPDATE_INTERVAL__, self.__update_func)
 
         # TODO: Schedule Fade Out
         self.emit('update')
 
-    def fade_to(self, target_volume, duration, callback=None):
-        self.__pbc.fade_to(target_volume, duration, callback)
+    def fade_to(self, target_volume, duration, callback=None, shape=fades.LINEAR):
+        self.__pbc.fade_to(target_volume, duration, callback, shape)
 
     def pause(self, fade=0):
         super().pause()
         self.__pbc.pause(fade=fade)
         self.emit('update')
 
-    def stop(self, fade=0):
+    def stop(self, fade=0, shape=fades.LINEAR):
         super().stop(fade)
-        self.__pbc.stop(fade)
+        self.__pbc.stop(fade, shape)
         self.emit('update')
 
+    def release(self):
+        super().release()
+        if self.__update_task is not None:
+            self.__update_task.cancel()
+            self.__update_task = None
+        if self.__pbc is not None:
+            if self.__ddid is not None:
+                self.__pbc.disconnect(self.__ddid)
+                self.__ddid = None
+            if self.__psid is not None:
+                self.__pbc.disconnect(self.__psid)
+                self.__psid = None
+            self.__pbc.release()
+            self.__pbc = None
+
+    def prioritize_discovery(self, priority=discovery.PRIORITY_HIGH):
+        if self.__pbc is not None:
+            self.__pbc.prioritize_discovery(priority)
+
+    def arm(self):
+        if self.__pbc is not None and self.__pbc.stopped:
+            self.__pbc.set_pan(self.pan)
+            self.__pbc.preroll()
+
+    def set_audio_engine(self, engine):
+        """
+        Plays the cue through another audio engine (see `audio.get_engine`) from the next time it is armed or played
+        """
+        if self.__pbc is not None:
+            self.__pbc.set_engine(engine)
+
     @GObject.property
     def state(self):
-        return PlaybackState.PLAYING if self.__pbc.playing else \
-            PlaybackState.PAUSED if self.__pbc.paused else PlaybackState.STOPPED
+        return self.__pbc.state
 
     def validate(self):
         errors = {}
@@ -507,7 +821,7 @@ class AudioCue(Cue):
 
         return self
 
-    def store(self, root, d):
+    def serialize(self, d, memo):
         d['src'] = self.audio_source_uri
         d['pitch'] = self.pitch
         d['pan'] = self.pan
@@ -517,7 +831,7 @@ class AudioCue(Cue):
         d['durationHint'] = self.__duration_hint
         d['type'] = 'audio'
 
-        return super().store(root, d)
+        return super().serialize(d, memo)
 GObject.type_register(AudioCue)
 
 
@@ -560,6 +874,7 @@ class ControlCue(Cue):
     target_volume = GObject.property(type=float, minimum=0.0, maximum=10.0)
     fade_duration = GObject.property(type=GObject.TYPE_LONG)
     stop_target_on_volume_reached = GObject.property(type=bool, default=True)
+    fade_shape = GObject.property(type=str, default=fades.LINEAR)
 
     class Editor(Gtk.Grid):
 
@@ -623,9 +938,19 @@ class ControlCue(Cue):
             self.__fade_duration = TimePicker(initial_milliseconds=self.__cue.fade_duration if self.__cue else 0)
             self.attach(self.__fade_duration, 1, 3, 1, 1)
 
+            self.attach(Gtk.Label("Fade Shape:"), 0, 4, 1, 1)
+            self.__fade_shape = Gtk.ComboBoxText()
+            for shape in fades.SHAPES:
+                self.__fade_shape.append(shape, fades.SHAPE_LABELS[shape])
+            if not self.__fade_shape.set_active_id(self.__cue.fade_shape):
+                self.__fade_shape.set_active_id(fades.LINEAR)
+            self.__fade_shape.set_hexpand(True)
+            self.__fade_shape.set_halign(Gtk.Align.FILL)
+            self.attach(self.__fade_shape, 1, 4, 1, 1)
+
             self.__stop_on_target_volume = Gtk.CheckButton("Stop Target Cue on Complete")
             self.__stop_on_target_volume.set_active(self.__cue.stop_target_on_volume_reached)
-            self.attach(self.__stop_on_target_volume, 0, 4, 2, 1)
+            self.attach(self.__stop_on_target_volume, 0, 5, 2, 1)
 
         def on_list_selected(self, combo):
             itr = combo.get_active_iter()
@@ -640,8 +965,9 @@ class ControlCue(Cue):
             select = -1
             self.__cue_store = Gtk.ListStore(int, str)
             for i in range(0, len(stack)):
-                self.__cue_store.append([i, stack[i].name])
-                if not self.__cue_selector_initialized and stack[i] is self.__cue.target.resolve(self.__project):
+                # Cues that were not loaded yet can be listed by the metadata of their stub
+                self.__cue_store.append([i, stack.peek(i).name])
+                if not self.__cue_selector_initialized and stack.peek(i) is self.__cue.target.resolve(self.__project):
                     select = i
                     self.__cue_selector_initialized = True
             self.__target_combo.set_model(self.__cue_store)
@@ -655,11 +981,13 @@ class ControlCue(Cue):
                 'target': (self.__project[self.__stack_combo.get_active()])[self.__target_combo.get_active()],
                 'targetVolume': self.__target_vol.get_value(),
                 'duration': self.__fade_duration.get_total_milliseconds(),
+                'fadeShape': self.__fade_shape.get_active_id(),
                 'stopOnComplete': self.__stop_on_target_volume.get_active()
             }
 
     def __init__(self, project, target, target_volume, fade_duration, stop_target_on_volume_reached=True,
-                 name="Untitled Cue", description="", notes="", number=-1.0, pre_wait=0, post_wait=0):
+                 fade_shape=fades.LINEAR, name="Untitled Cue", description="", notes="", number=-1.0, pre_wait=0,
+                 post_wait=0):
         super().__init__(project, name=name, description=description, notes=notes, number=number, pre_wait=pre_wait,
                          post_wait=post_wait)
 
@@ -670,14 +998,28 @@ class ControlCue(Cue):
         self.target_volume = target_volume
         self.fade_duration = fade_duration
         self.stop_target_on_volume_reached = stop_target_on_volume_reached
+        self.fade_shape = fade_shape
 
         self.__elapsed = 0
         self.__state = PlaybackState.STOPPED
+        self.__target_hash = None
 
     @GObject.Property
     def duration(self):
         return self.fade_duration
 
+    def __resolve_target(self):
+        c = self.target.resolve(self._project) if self.target is not None else None
+        return c if isinstance(c, Cue) else None
+
+    def needs_store(self):
+        if super().needs_store():
+            return True
+
+        # The target is stored by reference, so this cue changes whenever its target does
+        c = self.__resolve_target()
+        return c is not None and (c.needs_store() or c.current_hash != self.__target_hash)
+
     @GObject.Property
     def elapsed(self):
         return self.__elapsed
@@ -688,12 +1030,14 @@ class ControlCue(Cue):
     def on_editor_closed(self, w, save=True):
         if save:
             data = w.results()
-            if data['type'] is 'absolute':
+            if data['type'] == 'absolute':
                 self.__target = CuePointer(self, target=data['target'])
             else:
                 self.__target = CuePointer(self, index=int(data['target']))
+            self.mark_dirty()
             self.target_volume = float(data['targetVolume'])
             self.fade_duration = int(data['duration'])
+            self.fade_shape = data['fadeShape']
             self.stop_target_on_volume_reached = data['stopOnComplete']
             self.emit('update')
 
@@ -705,15 +1049,19 @@ class ControlCue(Cue):
         super().go()
         self.__state = PlaybackState.PLAYING
 
-    def action(self):
-        super().action()
+    def action(self, group=None):
+        super().action(group)
+        self.__state = PlaybackState.PLAYING
 
         if self.target is not None:
             c = self.target.resolve(self._project)
             if self.stop_target_on_volume_reached:
-                c.stop(fade=self.fade_duration)
+                if isinstance(c, AudioCue):
+                    c.stop(fade=self.fade_duration, shape=self.fade_shape)
+                else:
+                    c.stop(fade=self.fade_duration)
             elif isinstance(c, AudioCue):
-                c.fade_to(target_volume=self.target_volume, duration=self.fade_duration)
+                c.fade_to(target_volume=self.target_volume, duration=self.fade_duration, shape=self.fade_shape)
 
         t = Timer(self.fade_duration, __PROGRESS_UPDATE_INTERVAL__)
 
@@ -734,10 +1082,19 @@ class ControlCue(Cue):
     def target(self):
         return self.__target
 
+    def set_target(self, target):
+        """
+        Points this cue at another cue, absolutely
+
+        :param target: The cue to control
+        """
+        self.__target = CuePointer(self, target=target)
+        self.mark_dirty()
+
     def validate(self):
         errors = {}
 
-        if self.__target.resolve(self._project) is None:
+        if self.__target is None or self.__target.resolve(self._project) is None:
             errors['No Target'] = "This cue has no target or the target it referenced no longer exists"
 
         return errors if errors else None
@@ -748,58 +1105,161 @@ class ControlCue(Cue):
         self.target_volume = float(util.pick(j, 'targetVolume', 0.0))
         self.fade_duration = int(util.pick(j, 'fadeDuration', 0))
         self.stop_target_on_volume_reached = bool(util.pick(j, 'stopTargetOnVolumeReached', True))
-        if j['target']['type'] is 'relative':
+        self.fade_shape = str(util.pick(j, 'fadeShape', fades.LINEAR))
+        if j['target']['type'] == 'relative':
             self.__target = CuePointer(cue=self, index=j['target']['index'])
+        elif j['target'].get('ref', None):
+            self.__target = CuePointer(cue=self, target=load_cue(root, j['target']['ref'], self._project, claim=False))
         else:
-            self.__target = CuePointer(cue=self, target=load_cue(
-                root, j['target']['ref'], self._project
-            ) if 'target' in j else None)
+            self.__target = None
+        self.__target_hash = j['target'].get('ref', None)
 
         return self
 
-    def store(self, root, d):
+    def serialize(self, d, memo):
         d['targetVolume'] = self.target_volume
         d['fadeDuration'] = self.fade_duration
         d['stopTargetOnVolumeReached'] = self.stop_target_on_volume_reached
+        d['fadeShape'] = self.fade_shape
+        c = self.__resolve_target()
         d['target'] = {
-            'ref': self.target.resolve(self._project).store(root, {}),
-            'type': 'relative' if self.target.is_relative else 'absolute',
-            'index': self.target.relative_index if self.target.is_relative else -1
+            'ref': c.snapshot(memo) if c is not None else None,
+            'type': 'relative' if self.target is not None and self.target.is_relative else 'absolute',
+            'index': self.target.relative_index if self.target is not None and self.target.is_relative else -1
         }
         d['type'] = 'control'
 
-        return super().store(root, d)
+        return super().serialize(d, memo)
+
+    def on_stored(self, pending):
+        super().on_stored(pending)
+        self.__target_hash = pending.resolved['target']['ref']
 GObject.type_register(ControlCue)
 
-__LOAD_STACK = []
-__CUE_CACHE = {}
+
+def go_together(cues, skip_pre_wait=False, lead=audio.GROUP_START_LEAD):
+    """
+    Sends GO to several cues at once, like a GO on a selection of cues. Audio cues without a pre-wait are prerolled and
+    start playing sample-aligned on a shared clock, rather than one after the other (see `audio.GroupStart`). The other
+    cues are sent GO on the main loop at the same moment
+
+    :param cues: The cues to start
+    :param skip_pre_wait: Whether to start the action of every cue straight away
+    :param lead: Milliseconds between the GO and the moment the audio cues start playing
+    :return: The `audio.GroupStart` of the audio cues, which reports their measured skew
+    """
+    group = audio.GroupStart(lead=lead)
+    for c in cues:
+        c.go_with(group, skip_pre_wait)
+    group.start()
+    return group
 
 
-def load_cue(root, key, project):
+class CueIdentityMap(object):
     """
-    Loads the cue identified by the specified hash from the object store and initializes the cue according to its type
+    Maps object hashes to the live cues that were loaded from them, for a single project.
 
-    :param root: The project's root folder
-    :param key: The hash identifier of the cue to load
-    :return: The cue identified by the specified hash
+    Content-identical cues share a hash, so a hash can map to several cues. Every slot in a cue stack *claims* its own
+    cue instance, while references to a cue (like the target of a control cue) resolve to an existing instance when
+    one has been loaded, so they end up pointing at the same object as the cue stack. Only weak references are held;
+    the cue stacks own their cues.
     """
 
-    if key in __LOAD_STACK:
-        raise CircularReferenceException({
-            'message': ("The Cue identified by id {0} has already been partially loaded but was referenced again. "
-                        "This is a circular reference").format(key),
-            'key': key
-        })
+    def __init__(self):
+        self.__cues = {}
+        self.__claimed = weakref.WeakSet()
 
-    __LOAD_STACK.append(key)
+    def __live(self, key):
+        refs = self.__cues.get(key, [])
+        live = [c for c in (r() for r in refs) if c is not None]
+        if len(live) != len(refs):
+            if live:
+                self.__cues[key] = [weakref.ref(c) for c in live]
+            else:
+                del self.__cues[key]
+        return live
 
-    if key in __CUE_CACHE:
-        logger.debug("Loading {0} from cue cache".format(key))
-        ret = __CUE_CACHE[key]
-        __LOAD_STACK.pop()
-        return ret
+    def __add(self, key, cue):
+        self.__cues.setdefault(key, []).append(weakref.ref(cue))
+
+    def __len__(self):
+        return sum(len(self.__live(key)) for key in list(self.__cues.keys()))
+
+    def __contains__(self, key):
+        return len(self.__live(key)) > 0
+
+    def adopt(self, key, cue):
+        """
+        Adds an existing cue to the map without claiming it, so the next cue stack slot loading the same hash reuses it
+
+        :param key: The hash the cue was loaded from or last stored as
+        :param cue: The cue
+        """
+        self.__add(key, cue)
+
+    def keys(self):
+        """
+        :return: The hashes that currently have live cues
+        """
+        return [key for key in list(self.__cues.keys()) if self.__live(key)]
+
+    def claim(self, key, factory):
+        """
+        Returns a cue for the specified hash that is not yet owned by another cue stack slot, creating one with
+        `factory` if needed
+
+        :param key: The hash the cue was loaded from
+        :param factory: A callable that loads a new instance of the cue
+        """
+        for cue in self.__live(key):
+            if cue not in self.__claimed:
+                self.__claimed.add(cue)
+                return cue
+
+        cue = factory()
+        self.__add(key, cue)
+        self.__claimed.add(cue)
+        return cue
+
+    def lookup(self, key, factory):
+        """
+        Returns the first live cue for the specified hash, creating an unclaimed one with `factory` if none has been
+        loaded yet. A cue stack slot loading the same hash later on will claim that instance.
+
+        :param key: The hash the cue was loaded from
+        :param factory: A callable that loads a new instance of the cue
+        """
+        live = self.__live(key)
+        if live:
+            return live[0]
+
+        cue = factory()
+        self.__add(key, cue)
+        return cue
+
+    def clear(self):
+        """
+        Releases every live cue in the map and forgets about them
+        """
+        for key in list(self.__cues.keys()):
+            for cue in self.__live(key):
+                cue.release()
+        self.__cues.clear()
+        self.__claimed = weakref.WeakSet()
 
-    j = storage.read(root, key)
+__LOAD_STACK = []
+
+
+def build_cue(root, key, j, project):
+    """
+    Initializes a new cue from its parsed json dictionary according to its type
+
+    :param root: The project's root folder
+    :param key: The hash the dictionary was read from
+    :param j: The parsed json dictionary
+    :param project: The project the cue belongs to
+    :return: The new cue
+    """
 
     # Just warn on unknown cues instead
     # if 'type' not in j:
@@ -820,21 +1280,101 @@ def load_cue(root, key, project):
         logger.warning("Unknown cue type or missing plugin for type {0}".format(t))
         ret = Cue(project=project).load(root, key, j)
 
-    __LOAD_STACK.pop()
-    __CUE_CACHE[key] = ret
+    # Nothing has changed since the cue was read from the object store
+    ret.mark_clean()
     return ret
 
 
+def load_cue(root, key, project, claim=True, objects=None):
+    """
+    Loads the cue identified by the specified hash from the object store and initializes the cue according to its type
+
+    :param root: The project's root folder
+    :param key: The hash identifier of the cue to load
+    :param project: The project the cue belongs to
+    :param claim: Whether the cue is being loaded into a cue stack slot (see `CueIdentityMap.claim`) or is just being
+                  referenced by another cue (see `CueIdentityMap.lookup`)
+    :param objects: Objects that have already been read from the object store (see `storage.prefetch`)
+    :return: The cue identified by the specified hash
+    """
+
+    if key in __LOAD_STACK:
+        raise CircularReferenceException({
+            'message': ("The Cue identified by id {0} has already been partially loaded but was referenced again. "
+                        "This is a circular reference").format(key),
+            'key': key
+        })
+
+    __LOAD_STACK.append(key)
+    try:
+        def factory():
+            j = objects[key] if objects is not None and key in objects else storage.read(root, key)
+            return build_cue(root, key, j, project)
+
+        cues = project.cue_map
+        return cues.claim(key, factory) if claim else cues.lookup(key, factory)
+    finally:
+        __LOAD_STACK.pop()
+
+
 class CueStackChangeType(Enum):
     INSERT = 0
     UPDATE = 1
     DELETE = 2
 
 
+def describe_cue(cue):
+    """
+    :return: The lightweight metadata stored alongside a cue's hash in its cue stack, enough to display the cue
+             without loading it
+    """
+    return {
+        'name': cue.name,
+        'description': cue.description,
+        'notes': cue.notes,
+        'number': cue.number,
+        'preWait': cue.pre_wait,
+        'postWait': cue.post_wait,
+        'duration': cue.duration
+    }
+
+
+class CueStub(object):
+    """
+    Stands in for a cue in a lazily loaded cue stack until the cue is actually needed. Only carries the metadata
+    from the cue stack's index, which is enough to display the cue in the cue list.
+    """
+
+    state = PlaybackState.STOPPED
+    elapsed_prewait = 0
+    elapsed = 0
+    elapsed_postwait = 0
+
+    def __init__(self, key, meta):
+        self.current_hash = key
+        self.meta = meta
+
+        self.name = util.pick(meta, 'name', "Untitled Cue")
+        self.description = util.pick(meta, 'description', "")
+        self.notes = util.pick(meta, 'notes', "")
+        self.number = float(util.pick(meta, 'number', -1.0))
+        self.pre_wait = int(util.pick(meta, 'preWait', 0))
+        self.post_wait = int(util.pick(meta, 'postWait', 0))
+        self.duration = int(util.pick(meta, 'duration', 0))
+
+    def needs_store(self):
+        return False
+
+    def snapshot(self, memo):
+        return self.current_hash
+
+
 class CueStack(GObject.GObject):
     __gsignals__ = {
         'changed': (GObject.SIGNAL_RUN_FIRST, None, (int, GObject.TYPE_PYOBJECT)),
-        'renamed': (GObject.SIGNAL_RUN_FIRST, None, (str, ))
+        'renamed': (GObject.SIGNAL_RUN_FIRST, None, (str, )),
+        'materialized': (GObject.SIGNAL_RUN_FIRST, None, (int, GObject.TYPE_PYOBJECT)),
+        'replaced': (GObject.SIGNAL_RUN_FIRST, None, (int, GObject.TYPE_PYOBJECT))
     }
 
     name = GObject.property(type=str)
@@ -853,28 +1393,74 @@ class CueStack(GObject.GObject):
         self.__cues = [] if cues is None else cues
 
         self.__update_listeners = {}
-        for cue in self.__cues:
-            i = self.__cues.index(cue)
-            self.__connect_callback(i, cue)
+        for i, cue in enumerate(self.__cues):
+            if not isinstance(cue, CueStub):
+                self.__connect_callback(i, cue)
+
+        # The cue hashes this stack was last loaded with or stored as. `None` until the stack is stored
+        self.__stored_hashes = None
+        # The chunks and nodes of the stored cue tree, see `SoundClip.cuetree`
+        self.__chunks = {}
+        self.__dirty = True
+        self.__revision = 0
+        self.connect('notify', self.__on_notify)
+        self.connect('changed', self.__on_changed)
 
     def __len__(self):
         return len(self.__cues)
 
     def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self.__cues)))]
+
+        c = self.__cues[key]
+        if isinstance(c, CueStub):
+            c = self.__materialize(key if key >= 0 else len(self.__cues) + key)
+        return c
+
+    def __materialize(self, i):
+        stub = self.__cues[i]
+        logger.debug("Materializing [{0:g}]{1}".format(stub.number, stub.name))
+
+        c = load_cue(self.__project.root, stub.current_hash, self.__project)
+        self.__cues[i] = c
+        self.__connect_callback(i, c)
+        self.emit('materialized', i, c)
+        return c
+
+    def peek(self, key):
+        """
+        Returns the cue at the specified index without loading it. In a lazily loaded stack this may be a `CueStub`,
+        which only supports reading the cue's metadata and playback progress.
+        """
         return self.__cues[key]
 
+    def loaded(self):
+        """
+        :return: Every cue in this stack that has been loaded. Cues that have not been loaded can't be playing
+        """
+        return [c for c in self.__cues if not isinstance(c, CueStub)]
+
     def __setitem__(self, key, value):
         if not isinstance(value, Cue):
             raise TypeError("Cannot add type {0} to CueList".format(type(value)))
 
-        l = len(self.__cues)
-        self.__cues[key] = value
+        i = key if key >= 0 else len(self.__cues) + key
+        previous = self.__cues[i]
+        self.__cues[i] = value
+        self.__mark_dirty()
+        if previous in self.__update_listeners:
+            self.__disconnect_callback(previous)
 
-        self.emit('changed', key, CueStackChangeType.UPDATE if 0 <= key < l else CueStackChangeType.INSERT)
-        self.__connect_callback(key, value)
+        # `changed` is emitted with UPDATE for every update of a cue, `replaced` tells replacements apart
+        self.emit('changed', i, CueStackChangeType.UPDATE)
+        self.__connect_callback(i, value)
+        self.emit('replaced', i, value)
 
     def __iter__(self):
-        return self.__cues.__iter__()
+        # Loads every cue of a lazily loaded stack, use `peek` where the cue's metadata is enough
+        for i in range(0, len(self.__cues)):
+            yield self[i]
 
     def __reversed__(self):
         return CueStack(name=self.name, cues=reversed(self.__cues), project=self.__project)
@@ -913,51 +1499,173 @@ class CueStack(GObject.GObject):
         cue.disconnect(self.__update_listeners[cue])
         del self.__update_listeners[cue]
 
+    def detach(self):
+        """
+        Stops listening to the stack's cues, for when the cues are handed over to another stack
+        """
+        for cue in list(self.__update_listeners.keys()):
+            self.__disconnect_callback(cue)
+
+    def __mark_dirty(self):
+        self.__dirty = True
+        self.__revision += 1
+
+    def __on_notify(self, obj, pspec):
+        if pspec.name not in ('current-hash', 'last-hash'):
+            self.__mark_dirty()
+
+    def __on_changed(self, obj, index, change):
+        # Updates are emitted for every cue update (including playback progress), the cue hashes are compared on store
+        if change is not CueStackChangeType.UPDATE:
+            self.__mark_dirty()
+
+    @property
+    def dirty(self):
+        return self.__dirty
+
+    def mark_clean(self, hashes, chunks=None):
+        """
+        Flags the stack as unchanged since it was last stored or loaded
+
+        :param hashes: The cue hashes the stack was stored or loaded with
+        :param chunks: The chunks and nodes of the cue tree the stack was loaded from
+        """
+        self.__stored_hashes = list(hashes)
+        if chunks is not None:
+            self.__chunks = chunks
+        self.__dirty = False
+
     def index(self, obj):
         return self.__cues.index(obj)
 
     def get_cue_relative_to(self, cue, rel):
         return self.__cues.index(cue) + rel
 
-    def add_cue_relative_to(self, existing, cue):
-        i = self.index(existing)+1
+    def insert(self, i, cue):
+        if not isinstance(cue, Cue):
+            raise TypeError("Cannot add type {0} to CueList".format(type(cue)))
+
         self.__cues.insert(i, cue)
         self.__connect_callback(i, cue)
         self.emit('changed', i, CueStackChangeType.INSERT)
 
-    def remove_cue(self, cue):
-        i = self.__cues.index(cue)
-        self.__cues.remove(cue)
-        self.__disconnect_callback(cue)
+    def pop(self, i):
+        """
+        Removes the cue at the specified index without loading it
+
+        :return: The removed cue, which may be a `CueStub`
+        """
+        cue = self.__cues.pop(i)
+        if cue in self.__update_listeners:
+            self.__disconnect_callback(cue)
         self.emit('changed', i, CueStackChangeType.DELETE)
+        return cue
+
+    def add_cue_relative_to(self, existing, cue):
+        self.insert(self.index(existing)+1, cue)
+
+    def remove_cue(self, cue):
+        self.pop(self.__cues.index(cue))
 
     @staticmethod
-    def load(root, key, project):
-        j = read(root, key)
+    def load(root, key, project, objects=None, lazy=False):
+        """
+        Loads a cue stack and all of its cues from the object store
+
+        :param root: The project's root folder
+        :param key: The hash of the cue stack
+        :param project: The project the cue stack belongs to
+        :param objects: Objects that have already been read from the object store (see `storage.prefetch`)
+        :param lazy: Only load the cues from the stack's index, the cues themselves are loaded when they are first
+                     accessed. Stacks stored without an index are always loaded eagerly
+        """
+        j = objects[key] if objects is not None and key in objects else read(root, key)
 
         name = util.pick(j, 'name', "Untitled Cue Stack")
         current_hash = key
         last_hash = util.pick(j, 'previousRevision', None)
+        chunks = None
+        if 'tree' in j:
+            keys, index, chunks = cuetree.load(root, j['tree'], objects)
+        else:
+            # Cue stacks stored before cue trees keep their cues in the stack object
+            keys = util.pick(j, 'cues', [])
+            index = util.pick(j, 'index', None)
+            if 'cues' not in j:
+                logger.error("Bad Cue Stack: No 'cues' object!")
+
         cues = []
-        if 'cues' in j:
-            for cue in j['cues']:
-                c = load_cue(root, cue, project)
+        if lazy and index is not None and len(index) == len(keys):
+            logger.debug("Lazily loading cue stack {0}".format(name))
+            cues = [CueStub(cue, meta) for cue, meta in zip(keys, index)]
+        else:
+            for cue in keys:
+                c = load_cue(root, cue, project, objects=objects)
                 logger.debug("Loaded {0}".format(repr(c)))
                 cues.append(c)
+
+        stack = CueStack(name=name, cues=cues, current_hash=current_hash, last_hash=last_hash, project=project)
+        if index is not None:
+            stack.mark_clean(keys, chunks)
         else:
-            logger.error("Bad Cue Stack: No 'cues' object!")
+            # Store the stack again with an index the next time the project is saved
+            logger.debug("Cue stack {0} has no index".format(name))
+        return stack
 
-        return CueStack(name=name, cues=cues, current_hash=current_hash, last_hash=last_hash, project=project)
+    def snapshot(self, memo):
+        """
+        Captures the stack and every cue that changed since it was last stored (see `Cue.snapshot`)
 
-    def store(self, root):
+        :param memo: A dictionary shared by everything captured for the same save
+        :return: the current hash of the stack if neither it nor any of its cues changed, otherwise a pending object
+        """
         cues = []
 
         for cue in self.__cues:
-            logger.debug("Storing {0}".format(cue.name))
-            cues.append(cue.store(root, {}))
+            if cue.needs_store():
+                logger.debug("Storing {0}".format(cue.name))
+            cues.append(cue.snapshot(memo))
+
+        if not self.__dirty and self.current_hash and cues == self.__stored_hashes:
+            logger.debug("Cue stack {0} is unchanged, skipping".format(self.name))
+            return self.current_hash
+
+        index = [c.meta if isinstance(c, CueStub) else describe_cue(c) for c in self.__cues]
+
+        return storage.PendingObject(self, {'name': self.name, 'cues': cues, 'index': index,
+                                            'previousRevision': self.last_hash}, self.current_hash, self.__revision,
+                                     prepare=functools.partial(CueStack.__build_tree, self.__chunks))
+
+    @staticmethod
+    def __build_tree(chunks, tx, d):
+        # Runs on the thread writing the snapshot, so it only works on the chunks the stack had when it was captured.
+        # Only the chunks that changed since then are written. The new chunks are only kept by `on_stored`, once the
+        # transaction has been committed: until then, they may not be in the object store
+        tree, chunks = cuetree.build(tx, d['cues'], d['index'], chunks)
+        return {'name': d['name'], 'tree': tree, 'count': len(d['cues']),
+                'previousRevision': d['previousRevision']}, chunks
+
+    def on_stored(self, pending):
+        self.current_hash, self.last_hash = pending.checksum, pending.last_hash
+        self.__stored_hashes = list(pending.resolved['cues'])
+        if pending.prepared is not None:
+            self.__chunks = pending.prepared
+        if pending.revision == self.__revision:
+            self.__dirty = False
+
+    def store(self, root):
+        """
+        Stores every cue that changed since it was last stored, then the stack itself if it (or any cue hash) changed
+
+        :param root: The project root path
+        :return: the hash of the stack in the object store
+        """
+        results = []
+        with storage.Transaction(root) as tx:
+            storage.resolve(tx, self.snapshot({}), results)
+        for pending in results:
+            pending.apply()
 
-        self.current_hash, self.last_hash = write(root, {'name': self.name, 'cues': cues,
-                                                         'previousRevision': self.last_hash}, self.current_hash)
         return self.current_hash
 
     def rename(self, name):
@@ -966,17 +1674,37 @@ class CueStack(GObject.GObject):
         logger.debug("CueList renamed to {0}".format(name))
 
     def try_seek_all(self, ms):
-        for cue in [c for c in self.__cues if c.state is not PlaybackState.STOPPED and isinstance(c, AudioCue)]:
+        for cue in [c for c in self.loaded() if c.state is not PlaybackState.STOPPED and isinstance(c, AudioCue)]:
             cue.seek(ms)
 
     def resume_all(self, fade=0):
-        for cue in [c for c in self.__cues if c.state is PlaybackState.PAUSED]:
+        for cue in [c for c in self.loaded() if c.state is PlaybackState.PAUSED]:
             cue.action()
 
     def pause_all(self, fade=0):
-        for cue in [c for c in self.__cues if c.state is PlaybackState.PLAYING and isinstance(c, AudioCue)]:
+        for cue in [c for c in self.loaded() if c.state is PlaybackState.PLAYING and isinstance(c, AudioCue)]:
             cue.pause()
 
+    def standby(self, index, lookahead=DISCOVERY_LOOKAHEAD):
+        """
+        Moves the media of the next cues to be played, starting at `index`, to the front of the discovery queue, in
+        the order they will be played. Cues that have not been loaded yet are skipped
+
+        :param index: The index of the next cue
+        :param lookahead: The number of cues to move up
+        """
+        for i in range(max(0, index), min(len(self.__cues), index + lookahead)):
+            c = self.__cues[i]
+            if not isinstance(c, CueStub):
+                c.prioritize_discovery(discovery.PRIORITY_HIGH + i - index)
+
+    def arm(self, index):
+        """
+        Arms the cue at `index` (see `Cue.arm`), loading it if it has not been loaded yet
+        """
+        if 0 <= index < len(self.__cues):
+            self[index].arm()
+
     def stop_all(self, fade=0):
-        for cue in self.__cues:
+        for cue in self.loaded():
             cue.stop(fade=fade)
\ No newline at end of file
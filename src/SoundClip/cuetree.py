@@ -0,0 +1,151 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Chunked trees of cue hashes for cue stack objects
+
+Instead of storing every cue hash in the cue stack object itself, the hashes (and the cue stack index) are split into
+content-defined chunks, which are in turn grouped into nodes until a single root remains:
+
+cue stack -> {"tree": <root>, "count": 5000, ...}
+root      -> {"type": "cueNode", "children": [<chunk>, <chunk>, ...], "counts": [31, 40, ...]}
+chunk     -> {"type": "cueChunk", "cues": [<cue>, ...], "index": [{...}, ...]}
+
+A chunk ends after any cue whose hash matches a fixed bit pattern, so chunk boundaries depend only on the cues around
+them. Editing, inserting or removing a cue changes the chunk it is in (and the nodes on the path to the root), while
+every other chunk keeps its hash and does not have to be written again.
+"""
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from SoundClip import storage
+
+# Average number of cues per chunk, and children per node. Must be a power of two
+CHUNK_TARGET = 32
+NODE_TARGET = 32
+
+# Hard limit on the size of a chunk or node, in case the hashes never match the boundary pattern
+CHUNK_MAX = 4 * CHUNK_TARGET
+NODE_MAX = 4 * NODE_TARGET
+
+CHUNK_TYPE = 'cueChunk'
+NODE_TYPE = 'cueNode'
+
+
+def _is_boundary(key, target):
+    return int(key[-8:], 16) & (target - 1) == 0
+
+
+def _split(items, key, target, maximum, minimum=1):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= maximum or (len(chunk) >= minimum and _is_boundary(key(item), target)):
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def build(tx, cues, index, chunks):
+    """
+    Writes the tree for the specified cues to a transaction. Chunks and nodes that are in `chunks` are not hashed or
+    written again.
+
+    :param tx: The `storage.Transaction` to write to
+    :param cues: The hashes of the cues in the stack
+    :param index: The index entry for every cue
+    :param chunks: The chunks and nodes of the previous version of the tree (see `load`)
+    :return: The hash of the root of the tree (or `None` for an empty stack), and the chunks and nodes of the new tree
+    """
+    used = {}
+
+    def write(key, d):
+        h = chunks.get(key, None)
+        if h is None:
+            h, last = tx.write(d, '')
+        used[key] = h
+        return h
+
+    level = []
+    for chunk in _split(list(zip(cues, index)), lambda item: item[0], CHUNK_TARGET, CHUNK_MAX):
+        keys = [c for c, meta in chunk]
+        h = write((CHUNK_TYPE, ) + tuple(keys), {'type': CHUNK_TYPE, 'cues': keys, 'index': [m for c, m in chunk]})
+        level.append((h, len(chunk)))
+
+    # Every node has at least two children, so each level is at most half the size of the one below it
+    while len(level) > 1:
+        parents = []
+        for node in _split(level, lambda item: item[0], NODE_TARGET, NODE_MAX, minimum=2):
+            keys = [h for h, count in node]
+            counts = [count for h, count in node]
+            h = write((NODE_TYPE, ) + tuple(keys), {'type': NODE_TYPE, 'children': keys, 'counts': counts})
+            parents.append((h, sum(counts)))
+        level = parents
+
+    logger.debug("Built cue tree with {0} chunks and nodes ({1} reused)".format(
+        len(used), len([k for k in used.keys() if k in chunks])
+    ))
+
+    return (level[0][0] if level else None), used
+
+
+def prefetch(root, trees, objects):
+    """
+    Reads every node and chunk of the specified trees in parallel, one level at a time
+
+    :param root: The project root directory
+    :param trees: The root hashes of the trees to read
+    :param objects: A dictionary of already read objects, updated with the nodes and chunks
+    """
+    level = [t for t in trees if t]
+    while level:
+        objects.update(storage.prefetch(root, [k for k in level if k not in objects]))
+        level = [c for k in level if objects[k].get('type', None) == NODE_TYPE for c in objects[k]['children']]
+
+
+def load(root, tree, objects=None):
+    """
+    Reads the cues of a tree, in order
+
+    :param root: The project root directory
+    :param tree: The hash of the root of the tree
+    :param objects: Objects that have already been read from the object store
+    :return: The cue hashes, their index entries, and the chunks and nodes of the tree (to pass to `build`)
+    """
+    cues = []
+    index = []
+    chunks = {}
+
+    def walk(key):
+        j = objects[key] if objects is not None and key in objects else storage.read(root, key)
+        t = j.get('type', None)
+        if t == CHUNK_TYPE:
+            cues.extend(j['cues'])
+            index.extend(j['index'])
+            chunks[(CHUNK_TYPE, ) + tuple(j['cues'])] = key
+        elif t == NODE_TYPE:
+            for child in j['children']:
+                walk(child)
+            chunks[(NODE_TYPE, ) + tuple(j['children'])] = key
+        else:
+            raise storage.IllegalObjectException({
+                "message": "Expected a cue tree node or chunk, got {0}".format(t),
+                "key": key
+            })
+
+    if tree:
+        walk(tree)
+    return cues, index, chunks
+
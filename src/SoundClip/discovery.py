@@ -0,0 +1,337 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background media discovery for SoundClip
+
+Files the media information cache (see `SoundClip.mediainfo`) does not know yet have to be discovered before their
+duration is known. Instead of every playback controller starting its own discovery and filtering the results of all
+the others, every request goes through a single `DiscoveryService`:
+
+- Requests are keyed by file, so any number of cues playing the same file share one discovery and one result
+- At most `concurrency` files are discovered at the same time, each by its own `GstPbutils.Discoverer`
+- Queued files are discovered by priority, then in the order they were requested, so the cues at the top of every cue
+  stack are discovered first and the cues the operator is about to play can jump the queue
+- Requests made during one main loop iteration, like those of every cue of a project being loaded, are dispatched
+  together on the next one, and so are the results of files that are already cached
+- The `progress` signal reports how many of the files requested since the service was last idle have been discovered
+
+The service belongs to the main loop: it must only be used from the main thread.
+"""
+
+import heapq
+import os
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, GObject, Gst, GstPbutils
+
+from SoundClip import mediainfo
+
+# Lower priorities are discovered first
+PRIORITY_HIGH = -100
+PRIORITY_DEFAULT = 0
+PRIORITY_LOW = 100
+
+DEFAULT_CONCURRENCY = 2
+
+# Seconds to wait for a single file to be discovered
+DEFAULT_TIMEOUT = 15
+
+__SERVICE = None
+
+
+class _Request(object):
+    """
+    A file waiting to be discovered, and everyone waiting for it
+    """
+
+    def __init__(self, path, st, priority, keep):
+        self.path = path
+        self.st = st
+        self.priority = priority
+        self.callbacks = []
+        # Requested without a callback (to fill the cache), so it is not dropped when every callback is cancelled
+        self.keep = keep
+        self.running = False
+
+
+class DiscoveryService(GObject.Object):
+    """
+    Discovers media files in the background and adds them to the media information cache
+
+    :param cache: The `mediainfo.MediaInfoCache` to look files up in and add them to. Defaults to the shared cache
+    :param concurrency: The number of files discovered at the same time
+    :param timeout: Seconds to wait for a single file to be discovered
+    """
+
+    __gsignals__ = {
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (int, int)),
+        'idle': (GObject.SIGNAL_RUN_FIRST, None, ())
+    }
+
+    concurrency = GObject.Property(type=int, minimum=1, maximum=64, default=DEFAULT_CONCURRENCY)
+
+    def __init__(self, cache=None, concurrency=DEFAULT_CONCURRENCY, timeout=DEFAULT_TIMEOUT, **properties):
+        super().__init__(**properties)
+
+        self.__cache = cache
+        self.concurrency = concurrency
+        self.__timeout = timeout
+
+        # Requests by absolute path, and a heap of (priority, sequence, path) to dispatch them from. Requests that
+        # were moved up or dropped leave stale heap entries behind, which are skipped when they are popped
+        self.__requests = {}
+        self.__queue = []
+        self.__seq = 0
+
+        self.__running = {}
+        self.__idle_discoverers = []
+        self.__ready = []
+        self.__dispatch_id = None
+
+        self.__done = 0
+        self.__total = 0
+
+        self.connect('notify::concurrency', lambda *x: self.__schedule())
+
+    @property
+    def cache(self):
+        return self.__cache if self.__cache is not None else mediainfo.get_cache()
+
+    @property
+    def pending(self):
+        """
+        :return: The number of files waiting to be discovered or being discovered
+        """
+        return len(self.__requests)
+
+    @property
+    def progress(self):
+        """
+        :return: The number of files discovered, and requested, since the service was last idle
+        """
+        return self.__done, self.__total
+
+    def submit(self, uri, callback=None, priority=PRIORITY_DEFAULT):
+        """
+        Requests the media information of a file. Cached information is reported on the next main loop iteration, new
+        or changed files are discovered in the background first.
+
+        :param uri: A file:// uri or path
+        :param callback: Called with the `mediainfo.MediaInfo`, or `None` if the file does not exist. Files requested
+                         without a callback are only added to the cache
+        :param priority: Where to queue the file if it has to be discovered. Lower priorities are discovered first
+        """
+        path = mediainfo.to_path(uri)
+        r = self.__requests.get(path, None)
+        if r is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                self.__report(callback, None)
+                return
+
+            m = self.cache.lookup(path, st)
+            if m is not None:
+                self.__report(callback, m)
+                return
+
+            r = _Request(path, st, priority, callback is None)
+            self.__requests[path] = r
+            self.__total += 1
+            self.__push(r)
+        elif priority < r.priority and not r.running:
+            r.priority = priority
+            self.__push(r)
+
+        if callback is not None:
+            r.callbacks.append(callback)
+        else:
+            r.keep = True
+        self.__schedule()
+
+    def submit_batch(self, uris, callback=None, priority=PRIORITY_DEFAULT):
+        """
+        Requests the media information of many files at once, like every file of a project. Files of the same priority
+        are discovered in the order they are given in. See `submit`
+        """
+        for uri in uris:
+            self.submit(uri, callback, priority)
+
+    def prioritize(self, uri, priority=PRIORITY_HIGH):
+        """
+        Moves a file that is still waiting to be discovered further up the queue. Files that are not waiting are left
+        alone
+
+        :param uri: A file:// uri or path
+        :param priority: The new priority of the file, if it is lower than its current one
+        """
+        r = self.__requests.get(mediainfo.to_path(uri), None)
+        if r is not None and not r.running and priority < r.priority:
+            r.priority = priority
+            self.__push(r)
+
+    def cancel(self, uri, callback):
+        """
+        Stops waiting for a file to call `callback`. Files nobody waits for any more are dropped from the queue, files
+        that are already being discovered are still added to the cache
+        """
+        path = mediainfo.to_path(uri)
+        self.__ready = [(c, m) for c, m in self.__ready if c != callback]
+
+        r = self.__requests.get(path, None)
+        if r is None:
+            return
+        if callback in r.callbacks:
+            r.callbacks.remove(callback)
+        if not r.callbacks and not r.keep and not r.running:
+            logger.debug("Dropping {0} from the discovery queue".format(path))
+            del self.__requests[path]
+            self.__total -= 1
+            self.__check_idle()
+
+    def __push(self, r):
+        self.__seq += 1
+        heapq.heappush(self.__queue, (r.priority, self.__seq, r.path))
+
+    def __report(self, callback, m):
+        if callback is not None:
+            self.__ready.append((callback, m))
+            self.__schedule()
+
+    def __schedule(self):
+        if self.__dispatch_id is None:
+            self.__dispatch_id = GLib.idle_add(self.__dispatch)
+
+    def __dispatch(self):
+        self.__dispatch_id = None
+
+        ready, self.__ready = self.__ready, []
+        for callback, m in ready:
+            callback(m)
+
+        while self.__queue and len(self.__running) < self.concurrency:
+            priority, seq, path = heapq.heappop(self.__queue)
+            r = self.__requests.get(path, None)
+            if r is None or r.running or r.priority != priority:
+                continue
+
+            # The file may have been discovered synchronously since it was queued
+            m = self.cache.lookup(path, r.st)
+            if m is not None:
+                self.__finish(r, m)
+            else:
+                self.__start(r)
+
+        self.__check_idle()
+        return False
+
+    def __start(self, r):
+        if self.__idle_discoverers:
+            discoverer = self.__idle_discoverers.pop()
+        else:
+            discoverer = GstPbutils.Discoverer.new(self.__timeout * Gst.SECOND)
+            discoverer.connect('discovered', self.__on_discovered)
+            discoverer.start()
+
+        logger.debug("Discovering {0} in the background".format(r.path))
+        r.running = True
+        self.__running[discoverer] = r
+        if not discoverer.discover_uri_async(mediainfo.to_uri(r.path)):
+            self.__on_discovered(discoverer, None, "Unable to start discovering {0}".format(r.path))
+
+    def __on_discovered(self, discoverer, info, error):
+        r = self.__running.pop(discoverer, None)
+        self.__idle_discoverers.append(discoverer)
+        if r is None:
+            return
+
+        if error is not None:
+            logger.error("Error during discovery of {0}: {1}".format(r.path, error))
+        m = mediainfo.from_discoverer(r.path, r.st, info if error is None else None, error)
+        self.cache.put(m)
+        self.__finish(r, m)
+        self.__schedule()
+
+    def __finish(self, r, m):
+        self.__requests.pop(r.path, None)
+        self.__done += 1
+        for callback in r.callbacks:
+            callback(m)
+        self.emit('progress', self.__done, self.__total)
+
+    def __check_idle(self):
+        if self.__requests or self.__running:
+            return
+
+        for discoverer in self.__idle_discoverers:
+            discoverer.stop()
+        self.__idle_discoverers = []
+
+        if self.__total > 0:
+            logger.debug("Discovered {0} of {1} files".format(self.__done, self.__total))
+            self.__done = self.__total = 0
+            self.emit('idle')
+GObject.type_register(DiscoveryService)
+
+
+def get_service():
+    """
+    :return: The discovery service shared by every project
+    """
+    global __SERVICE
+    if __SERVICE is None:
+        __SERVICE = DiscoveryService()
+    return __SERVICE
+
+
+def set_service(service):
+    """
+    Replaces the shared discovery service, for example with one that discovers more files at the same time
+    """
+    global __SERVICE
+    __SERVICE = service
+
+
+def submit(uri, callback=None, priority=PRIORITY_DEFAULT):
+    """
+    See `DiscoveryService.submit`
+    """
+    get_service().submit(uri, callback, priority)
+
+
+def submit_batch(uris, callback=None, priority=PRIORITY_DEFAULT):
+    """
+    See `DiscoveryService.submit_batch`
+    """
+    get_service().submit_batch(uris, callback, priority)
+
+
+def prioritize(uri, priority=PRIORITY_HIGH):
+    """
+    See `DiscoveryService.prioritize`
+    """
+    get_service().prioritize(uri, priority)
+
+
+def cancel(uri, callback):
+    """
+    See `DiscoveryService.cancel`
+    """
+    get_service().cancel(uri, callback)
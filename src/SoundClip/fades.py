@@ -0,0 +1,257 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Volume fades that run inside GStreamer
+
+A fade is not stepped from the main loop. It is handed to the `volume` element of a playback pipeline as a control
+source (see `GstController`), with its control points on the stream time of the file, and the element computes the
+volume of every sample it plays from them. Fades are as smooth as the audio itself, keep their timing when the main
+loop is busy, and don't run any python while they play.
+
+Linear fades need only two control points. The other shapes are sampled every `CURVE_RESOLUTION` milliseconds, and
+the element interpolates between the samples:
+
+- `LINEAR`: the volume changes at a constant rate
+- `EXPONENTIAL`: the volume changes at a constant rate in dB, over `EXPONENTIAL_RANGE` dB, which sounds even to the ear
+- `S_CURVE`: the volume starts and ends changing slowly, for fades that should not be noticed
+- `EQUAL_POWER`: a quarter sine, so two cues fading up and down over the same time cross at a constant loudness
+
+Fades down mirror fades up, so a cue faded out and in again with the same shape sounds the same both ways. A fade is
+complete once the first buffer past its end has left the volume element, so completion callbacks follow the running
+time of the pipeline rather than the wall clock: a fade on a paused cue only completes once the cue plays again.
+
+Fades start where the last buffer that left the volume element ended (see `Fader.position`), rather than at the
+position the sink reports: the sink lags behind the element by the latency downstream of it, and a fade starting
+there would have its first control points in the past.
+"""
+
+import math
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstController', '1.0')
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, Gst, GstController
+
+LINEAR = 'linear'
+EXPONENTIAL = 'exponential'
+S_CURVE = 's-curve'
+EQUAL_POWER = 'equal-power'
+
+# Milliseconds between two control points of a fade that is not linear
+CURVE_RESOLUTION = 10
+
+# The dB range of exponential fades. The volume fades over this range, and jumps to silence from its bottom
+EXPONENTIAL_RANGE = 40.0
+
+
+def _linear(x):
+    return x
+
+
+def _exponential(x):
+    top = 10.0 ** (EXPONENTIAL_RANGE / 20.0)
+    return (top ** x - 1.0) / (top - 1.0)
+
+
+def _s_curve(x):
+    return (1.0 - math.cos(math.pi * x)) / 2.0
+
+
+def _equal_power(x):
+    return math.sin(math.pi * x / 2.0)
+
+
+# The shape of every fade going up, from 0 at the start to 1 at the end
+_CURVES = {
+    LINEAR: _linear,
+    EXPONENTIAL: _exponential,
+    S_CURVE: _s_curve,
+    EQUAL_POWER: _equal_power
+}
+
+SHAPES = (LINEAR, EXPONENTIAL, S_CURVE, EQUAL_POWER)
+
+SHAPE_LABELS = {
+    LINEAR: "Linear",
+    EXPONENTIAL: "Exponential",
+    S_CURVE: "S-Curve",
+    EQUAL_POWER: "Equal Power"
+}
+
+
+def is_shape(name):
+    return name in _CURVES
+
+
+def shape_value(shape, start, target, x):
+    """
+    :param shape: The shape of the fade. Unknown shapes are faded linearly
+    :param start: The volume at the start of the fade
+    :param target: The volume at the end of the fade
+    :param x: How far along the fade is, from 0 to 1
+    :return: The volume at `x`
+    """
+    curve = _CURVES.get(shape, _linear)
+    x = max(min(x, 1.0), 0.0)
+    f = curve(x) if target >= start else 1.0 - curve(1.0 - x)
+    return start + (target - start) * f
+
+
+def control_points(shape, start, target, position, duration):
+    """
+    :param position: The stream time the fade starts at, in nanoseconds
+    :param duration: The length of the fade in nanoseconds
+    :return: The (stream time, volume) control points of the fade
+    """
+    steps = 1 if shape == LINEAR else max(1, int(math.ceil(duration / (CURVE_RESOLUTION * Gst.MSECOND))))
+    return [(position + int(duration * i / steps), shape_value(shape, start, target, i / steps))
+            for i in range(steps + 1)]
+
+
+class Fader(object):
+    """
+    Runs fades on a `volume` element. Only one fade runs at a time, starting another one cancels the current one
+
+    :param volume: The volume element
+    """
+
+    def __init__(self, volume):
+        self.__vol = volume
+        self.__pad = volume.get_static_pad('src')
+
+        # Guards the end of the fade and the probe that waits for it, which are also used from the streaming thread
+        self.__lock = threading.Lock()
+        # Bumped every time a fade is started or cancelled, so a fade that completes late is ignored
+        self.__generation = 0
+        self.__binding = None
+        self.__probe = None
+        self.__end = 0
+        self.__target = 0.0
+        self.__callback = None
+        # The stream time the last buffer that left the element ended at, in the current segment
+        self.__position = None
+        self.__pad.add_probe(Gst.PadProbeType.BUFFER | Gst.PadProbeType.EVENT_DOWNSTREAM | Gst.PadProbeType.EVENT_FLUSH,
+                             self.__on_data)
+
+    @property
+    def fading(self):
+        return self.__binding is not None
+
+    @property
+    def position(self):
+        """
+        :return: The stream time the next buffer leaving the volume element starts at, in nanoseconds: the earliest
+                 moment a fade can start at. `None` until a buffer of the current segment has left the element
+        """
+        with self.__lock:
+            return self.__position
+
+    def start(self, start, target, position, duration, shape=LINEAR, callback=None):
+        """
+        Fades the volume from `start` to `target`
+
+        :param position: The stream time the fade starts at, in nanoseconds
+        :param duration: The length of the fade in nanoseconds
+        :param shape: One of `SHAPES`
+        :param callback: Called on the main loop once the fade is complete
+        """
+        self.cancel()
+        if not is_shape(shape):
+            logger.warning("Unknown fade shape {0}, fading linearly".format(shape))
+            shape = LINEAR
+
+        cs = GstController.InterpolationControlSource()
+        cs.set_property('mode', GstController.InterpolationMode.LINEAR)
+        for t, v in control_points(shape, start, target, position, duration):
+            cs.set(t, v)
+        self.__binding = GstController.DirectControlBinding.new_absolute(self.__vol, 'volume', cs)
+        self.__vol.add_control_binding(self.__binding)
+
+        with self.__lock:
+            self.__end = position + duration
+            self.__target = target
+            self.__callback = callback
+            self.__probe = self.__pad.add_probe(Gst.PadProbeType.BUFFER, self.__on_buffer, self.__generation)
+
+    def cancel(self):
+        """
+        Stops the current fade at the volume it has reached, without calling its callback
+        """
+        with self.__lock:
+            self.__generation += 1
+            self.__callback = None
+        self.__release()
+
+    def __release(self):
+        with self.__lock:
+            probe, self.__probe = self.__probe, None
+        if probe is not None:
+            self.__pad.remove_probe(probe)
+        if self.__binding is not None:
+            # The last volume the binding set stays on the element
+            self.__vol.remove_control_binding(self.__binding)
+            self.__binding = None
+
+    @staticmethod
+    def __buffer_end(pad, buf):
+        # The stream time the buffer ends at, or `None` if it can't be told
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if buf.pts == Gst.CLOCK_TIME_NONE or event is None:
+            return None
+        duration = buf.duration if buf.duration != Gst.CLOCK_TIME_NONE else 0
+        return event.parse_segment().to_stream_time(Gst.Format.TIME, buf.pts + duration)
+
+    def __on_data(self, pad, info):
+        if info.type & Gst.PadProbeType.BUFFER:
+            end = Fader.__buffer_end(pad, info.get_buffer())
+            if end is not None:
+                with self.__lock:
+                    self.__position = end
+        elif info.get_event().type in (Gst.EventType.FLUSH_STOP, Gst.EventType.SEGMENT):
+            # A new segment, after a seek or a new file, starts over
+            with self.__lock:
+                self.__position = None
+        return Gst.PadProbeReturn.OK
+
+    def __on_buffer(self, pad, info, generation):
+        end = Fader.__buffer_end(pad, info.get_buffer())
+        if end is None:
+            return Gst.PadProbeReturn.OK
+
+        with self.__lock:
+            if generation != self.__generation:
+                # Left over from a fade that was cancelled
+                return Gst.PadProbeReturn.REMOVE
+            if end < self.__end:
+                return Gst.PadProbeReturn.OK
+            self.__probe = None
+        GLib.idle_add(self.__complete, generation)
+        return Gst.PadProbeReturn.REMOVE
+
+    def __complete(self, generation):
+        with self.__lock:
+            if generation != self.__generation:
+                return False
+            self.__generation += 1
+            callback, self.__callback = self.__callback, None
+        self.__release()
+        self.__vol.set_property('volume', self.__target)
+        if callable(callback):
+            callback()
+        return False
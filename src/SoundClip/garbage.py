@@ -0,0 +1,362 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Garbage collection for the SoundClip object store
+
+Every save chains new objects to their previous revisions, and nothing is ever deleted on its own. The garbage collector
+marks every object reachable from project.json (and from the checkpoint the edit journal applies to), following
+previous revisions (from the history index where it has them) only within a configurable number of revisions (or
+age), and then removes everything else: unreachable loose objects are deleted, and the packfile is rewritten without
+its unreachable objects (optionally folding the surviving loose objects into it as well). Other storage backends
+delete unreachable objects directly and reclaim their space when they are compacted. Project revisions are objects
+like any other, so older versions of the project are kept for just as long as the objects they reference. The history
+index and the verified log are rewritten to match.
+
+The collector works in small steps on the main loop, so it can run while the project is open. It never sweeps while
+the project is being saved, and starts over if its roots change underneath it: project.json, the journal checkpoint,
+or the stored cue stacks of the open project. Objects written after the collector started are always kept, and so are
+objects that a save referenced again without writing them (see `storage.track_reuse`).
+"""
+
+import json
+import re
+import time
+from collections import deque
+from enum import Enum
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, GObject
+
+from SoundClip import codec, history, journal, storage
+from SoundClip.exception import SCException
+from SoundClip.util import sha
+
+
+class GarbageCollectionException(SCException):
+    pass
+
+
+class GCPhase(Enum):
+    IDLE = 0
+    MARK = 1
+    SWEEP = 2
+    PACK = 3
+    DONE = 4
+
+
+# Number of previous revisions of every object to keep
+DEFAULT_HISTORY_DEPTH = 10
+
+# Number of objects handled per main loop iteration
+DEFAULT_BATCH_SIZE = 200
+
+__HASH = re.compile(r'^[0-9a-f]{40}$')
+
+
+def references(value):
+    """
+    :param value: A parsed object, or any value inside one
+    :return: Every object hash referenced by the value, except for its previous revision
+    """
+    if isinstance(value, dict):
+        for k, v in value.items():
+            if k != 'previousRevision':
+                yield from references(v)
+    elif isinstance(value, list):
+        for v in value:
+            yield from references(v)
+    elif isinstance(value, str) and __HASH.match(value):
+        yield value
+
+
+class GarbageCollector(GObject.GObject):
+    """
+    Removes objects that are no longer reachable from a project
+
+    :param root: The project root directory
+    :param project: The open `Project` for this root, if any. Its live cues and cue stacks are kept even if they are not
+                    referenced by project.json, and the collector waits for its saves to finish
+    :param history_depth: The number of previous revisions of every reachable object to keep
+    :param max_age: Previous revisions younger than this many seconds are kept regardless of `history_depth`
+    :param pack: Whether to fold the surviving loose objects into the packfile
+    :param batch_size: The number of objects handled per step
+    """
+
+    __gsignals__ = {
+        'progress': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, int, int)),
+        'finished': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT))
+    }
+
+    def __init__(self, root, project=None, history_depth=DEFAULT_HISTORY_DEPTH, max_age=None, pack=True,
+                 batch_size=DEFAULT_BATCH_SIZE):
+        GObject.GObject.__init__(self)
+
+        self.__root = root
+        self.__project = project
+        self.__history_depth = history_depth
+        self.__max_age = max_age
+        self.__pack = pack
+        self.__batch_size = max(1, batch_size)
+
+        self.__phase = GCPhase.IDLE
+        self.__source = None
+        self.__reset()
+
+    def __reset(self):
+        self.__started = None
+        self.__project_hash = None
+        self.__roots = None
+        self.__history = None
+        self.__queue = deque()
+        self.__marked = {}
+        self.__candidates = []
+        self.__swept = 0
+        self.__stats = {'marked': 0, 'pruned': 0, 'packed': 0, 'dropped': 0, 'restarts': 0}
+
+    @property
+    def phase(self):
+        return self.__phase
+
+    @property
+    def running(self):
+        return self.__phase not in (GCPhase.IDLE, GCPhase.DONE)
+
+    @property
+    def stats(self):
+        return dict(self.__stats)
+
+    def start(self):
+        """
+        Starts collecting garbage in the background, one step per main loop iteration. The `finished` signal is emitted
+        when the collection is complete.
+        """
+        if self.running:
+            return
+        self.__begin()
+        self.__source = GLib.idle_add(self.__idle)
+
+    def cancel(self):
+        if self.__source is not None:
+            GLib.source_remove(self.__source)
+            self.__source = None
+        if self.running:
+            logger.info("Garbage collection of {0} cancelled".format(self.__root))
+            self.__phase = GCPhase.IDLE
+            storage.untrack_reuse(self.__root)
+
+    def run(self):
+        """
+        Collects garbage synchronously
+
+        :return: The collection statistics
+        """
+        self.__begin()
+        while self.step():
+            pass
+        return self.stats
+
+    def __idle(self):
+        try:
+            more = self.step()
+        except Exception as ex:
+            logger.error("Garbage collection of {0} failed: {1}".format(self.__root, ex))
+            self.__phase = GCPhase.DONE
+            storage.untrack_reuse(self.__root)
+            self.__source = None
+            self.emit('finished', self.stats, ex)
+            return False
+
+        if not more:
+            self.__source = None
+            self.emit('finished', self.stats, None)
+        return more
+
+    def step(self):
+        """
+        Does the next batch of work
+
+        :return: Whether there is more work to do
+        """
+        if self.__phase == GCPhase.MARK:
+            self.__mark()
+        elif self.__phase == GCPhase.SWEEP:
+            self.__sweep()
+        elif self.__phase == GCPhase.PACK:
+            self.__compact()
+        return self.running
+
+    def __read_project(self):
+        content = storage.read_project(self.__root)
+        if not content:
+            raise GarbageCollectionException({
+                "message": "There is no project at {0}, refusing to collect garbage".format(self.__root),
+                "root": self.__root
+            })
+        content = content.strip()
+        return sha(content), json.loads(content)
+
+    def __current_roots(self):
+        # Everything the roots of the collection are taken from, except for the live cues of the open project, which
+        # are written (or reused) by the save that references them
+        h, j = self.__read_project()
+        stacks = tuple(s.current_hash for s in self.__project.cue_stacks) if self.__project is not None else ()
+        return h, j, journal.base(self.__root), stacks
+
+    def __roots_changed(self):
+        h, j, checkpoint, stacks = self.__current_roots()
+        return (h, checkpoint, stacks) != self.__roots
+
+    def __busy(self):
+        return self.__project is not None and self.__project.saving
+
+    def __begin(self):
+        self.__reset()
+        self.__started = time.time()
+        self.__history = history.get(self.__root)
+        storage.track_reuse(self.__root)
+        self.__project_hash, j, checkpoint, stacks = self.__current_roots()
+        self.__roots = (self.__project_hash, checkpoint, stacks)
+
+        # project.json is stored as a project revision object, except in projects saved before revisions existed
+        if storage.exists(self.__root, self.__project_hash):
+            roots = [self.__project_hash]
+        else:
+            roots = list(references(j))
+
+        # The journal of a project that was not saved since it crashed is replayed on top of its last checkpoint
+        if checkpoint:
+            roots.append(checkpoint)
+        roots.extend(h for h in stacks if h)
+        if self.__project is not None:
+            roots.extend(self.__project.cue_map.keys())
+
+        self.__queue.extend((key, 0) for key in roots)
+        self.__phase = GCPhase.MARK
+        logger.info("Collecting garbage in {0} (keeping {1} revisions)".format(self.__root, self.__history_depth))
+
+    def __restart(self):
+        restarts = self.__stats['restarts'] + 1
+        logger.info("The project was saved during garbage collection, starting over")
+        self.__begin()
+        self.__stats['restarts'] = restarts
+
+    def __keep_revision(self, key, depth):
+        if depth <= self.__history_depth:
+            return True
+        if self.__max_age is None:
+            return False
+        t = storage.object_time(self.__root, key)
+        return t is not None and t >= self.__started - self.__max_age
+
+    def __load(self, key):
+        raw = storage.read_raw(self.__root, key)
+        if raw is None:
+            return None
+        try:
+            content = codec.decode(raw)
+        except codec.CodecException as ex:
+            logger.warning("Object {0} could not be decoded, keeping it: {1}".format(key, ex))
+            return {}
+        if not content or sha(content) != key:
+            logger.warning("Object {0} is corrupt, keeping it".format(key))
+            return {}
+        return json.loads(content)
+
+    def __mark(self):
+        for i in range(self.__batch_size):
+            if not self.__queue:
+                break
+
+            key, depth = self.__queue.popleft()
+            if key in self.__marked and self.__marked[key] <= depth:
+                continue
+
+            j = self.__load(key)
+            if j is None:
+                continue
+            self.__marked[key] = depth
+
+            self.__queue.extend((ref, depth) for ref in references(j))
+
+            # The history index has the revision every object actually replaced, the stored link lags behind after a
+            # load (see `SoundClip.history`)
+            previous = self.__history.parent(key) if key in self.__history else j.get('previousRevision', None)
+            if previous and self.__keep_revision(previous, depth + 1):
+                self.__queue.append((previous, depth + 1))
+
+        self.emit('progress', self.__phase, len(self.__marked), len(self.__marked) + len(self.__queue))
+
+        if not self.__queue:
+            self.__stats['marked'] = len(self.__marked)
+            self.__candidates = [key for key in storage.keys(self.__root) if key not in self.__marked]
+            logger.debug("Marked {0} reachable objects, {1} objects are garbage".format(
+                len(self.__marked), len(self.__candidates)
+            ))
+            self.__phase = GCPhase.SWEEP
+
+    def __sweep(self):
+        if self.__busy():
+            return
+        if self.__roots_changed():
+            self.__restart()
+            return
+
+        batch, self.__candidates = self.__candidates[:self.__batch_size], self.__candidates[self.__batch_size:]
+        reused = storage.reused(self.__root)
+        garbage = []
+        for key in batch:
+            if key in reused:
+                continue
+            t = storage.object_time(self.__root, key)
+            if t is not None and t < self.__started:
+                garbage.append(key)
+        self.__stats['pruned'] += storage.remove(self.__root, garbage)
+        self.__swept += len(batch)
+
+        self.emit('progress', self.__phase, self.__swept, self.__swept + len(self.__candidates))
+
+        if not self.__candidates:
+            self.__phase = GCPhase.PACK
+
+    def __compact(self):
+        if self.__busy():
+            return
+        if self.__roots_changed():
+            self.__restart()
+            return
+
+        # Objects written since the collection started are not in the mark set, but they are never packed either
+        keep = set(self.__marked.keys()) | storage.reused(self.__root)
+        dropped, folded = storage.compact(self.__root, keep, fold=self.__pack)
+        storage.untrack_reuse(self.__root)
+        remaining = set(storage.keys(self.__root))
+        history.get(self.__root).compact(remaining)
+        storage.get_verified(self.__root).compact(remaining)
+
+        self.__stats['dropped'] = dropped
+        self.__stats['packed'] = folded
+        self.__phase = GCPhase.DONE
+
+        logger.info("Garbage collection of {0} finished: {1}".format(self.__root, self.__stats))
+
+
+def collect(root, project=None, history_depth=DEFAULT_HISTORY_DEPTH, max_age=None, pack=True):
+    """
+    Collects garbage in the specified project synchronously. See `GarbageCollector`
+
+    :return: The collection statistics
+    """
+    return GarbageCollector(root, project=project, history_depth=history_depth, max_age=max_age, pack=pack).run()
@@ -36,6 +36,7 @@ class SCCueListContainer(Gtk.Notebook):
 
         self.__project = None
         self.__cbid = None
+        self.__rbid = None
 
     def update_show_tabs(self):
         self.set_show_tabs(True if self.get_n_pages() > 1 else False)
@@ -44,9 +45,11 @@ class SCCueListContainer(Gtk.Notebook):
         if self.__project is not None and self.__cbid is not None:
             logger.debug("Disconnecting callbacks from previous project")
             self.__project.disconnect(self.__cbid)
+            self.__project.disconnect(self.__rbid)
 
         self.__project = p
         self.__cbid = self.__project.connect('stack-changed', self.on_stacks_changed)
+        self.__rbid = self.__project.connect('reverted', lambda obj, revision: self.on_project_changed(obj))
 
         for i in range(0, self.get_n_pages()):
             self.remove_page(-1)
@@ -17,7 +17,7 @@ logger = logging.getLogger('SoundClip')
 from gi.repository import Gtk, Gdk, cairo
 
 from SoundClip import util
-from SoundClip.cue import PlaybackState, CueStackChangeType
+from SoundClip.cue import PlaybackState, CueStackChangeType, go_together
 from SoundClip.gui.dialog import SCCueDialog
 
 
@@ -92,17 +92,19 @@ class SCCueListModel(Gtk.TreeStore):
         return 0 if cue.post_wait <= 0 else 100 * (cue.elapsed_postwait / cue.post_wait)
 
     def do_get_value(self, itr, column):
+        # Peek so drawing the list does not load cues in a lazily loaded stack
+        cue = self.__cue_list.peek(itr.user_data)
         return {
-            0: self.__cue_list[itr.user_data].name,
-            1: self.__cue_list[itr.user_data].description,
-            2: self.__cue_list[itr.user_data].notes,
-            3: '{0:g}'.format(self.__cue_list[itr.user_data].number),
-            4: self.__get_elapsed_pre_progress(self.__cue_list[itr.user_data]),
-            5: self.__get_elapsed_pre_text(self.__cue_list[itr.user_data]),
-            6: self.__get_elapsed_progress(self.__cue_list[itr.user_data]),
-            7: self.__get_elapsed_text(self.__cue_list[itr.user_data]),
-            8: self.__get_elapsed_post_progress(self.__cue_list[itr.user_data]),
-            9: self.__get_elapsed_post_text(self.__cue_list[itr.user_data]),
+            0: cue.name,
+            1: cue.description,
+            2: cue.notes,
+            3: '{0:g}'.format(cue.number),
+            4: self.__get_elapsed_pre_progress(cue),
+            5: self.__get_elapsed_pre_text(cue),
+            6: self.__get_elapsed_progress(cue),
+            7: self.__get_elapsed_text(cue),
+            8: self.__get_elapsed_post_progress(cue),
+            9: self.__get_elapsed_post_text(cue),
         }.get(column, None)
 
     def do_set_value(self, itr, column):
@@ -327,6 +329,7 @@ class SCCueList(Gtk.ScrolledWindow):
         self.__tree_view.append_column(self.__postw_col)
 
         self.__tree_view.set_grid_lines(Gtk.TreeViewGridLines.BOTH)
+        self.__tree_view.get_selection().set_mode(Gtk.SelectionMode.MULTIPLE)
         self.__tree_view.connect('key-release-event', self.on_key)
         self.__tree_view.connect('button-press-event', self.on_click)
         self.__tree_view.connect('cursor-changed', self.on_selection_changed)
@@ -344,6 +347,10 @@ class SCCueList(Gtk.ScrolledWindow):
             return None
         return self.__model.get_cue_at(pathlist[0])
 
+    def get_selected_cues(self):
+        (model, pathlist) = self.__tree_view.get_selection().get_selected_rows()
+        return [c for c in (self.__model.get_cue_at(path) for path in pathlist) if c is not None]
+
     def get_title_widget(self):
         return self.__title_widget
 
@@ -353,12 +360,17 @@ class SCCueList(Gtk.ScrolledWindow):
 
     def select_next(self):
         (model, pathlist) = self.__tree_view.get_selection().get_selected_rows()
-        self.__tree_view.set_cursor(Gtk.TreePath(pathlist[0].get_indices()[0]+1), None, False)
+        self.__tree_view.set_cursor(Gtk.TreePath(pathlist[-1].get_indices()[0]+1), None, False)
 
     def on_selection_changed(self, view):
         cue = self.get_selected()
         self.__main_window.update_notes(cue)
 
+        (model, pathlist) = self.__tree_view.get_selection().get_selected_rows()
+        if pathlist:
+            self.__cue_list.standby(pathlist[0].get_indices()[0])
+            self.__cue_list.arm(pathlist[0].get_indices()[0])
+
     def on_rename(self, obj, name):
         self.__title_widget.set_text(name)
 
@@ -383,6 +395,13 @@ class SCCueList(Gtk.ScrolledWindow):
 
     def on_key(self, view, event):
         if event.keyval is Gdk.KEY_space:
+            cues = self.get_selected_cues()
+            if len(cues) > 1:
+                # Cues fired together start together
+                go_together(cues, skip_pre_wait=bool(event.state & Gdk.ModifierType.SHIFT_MASK))
+                self.select_next()
+                return False
+
             c = self.get_selected()
             logger.debug("Type of selected cue is {0}".format(str(type(c))))
 
@@ -15,6 +15,8 @@ import logging
 logger = logging.getLogger('SoundClip')
 
 import SoundClip
+from SoundClip import audio
+from SoundClip.cue import AUTO_CONTINUE, AUTO_FOLLOW, CONTINUE_NONE
 from SoundClip.gui.widgets import TimePicker
 from SoundClip.util import get_gtk_version
 from gi.repository import Gtk, Gdk, Gst
@@ -142,6 +144,20 @@ class SCProjectPropertiesDialog(Gtk.Dialog):
         self.__duration_delta.set_halign(Gtk.Align.FILL)
         grid.attach(self.__duration_delta, 1, 6, 1, 1)
 
+        engine_label = Gtk.Label("Audio Engine")
+        engine_label.set_halign(Gtk.Align.END)
+        engine_label.set_tooltip_text(
+            "Play every cue through a pipeline of its own, or mix every cue into a single output"
+        )
+        grid.attach(engine_label, 0, 7, 1, 1)
+        self.__engine = Gtk.ComboBoxText()
+        for name in audio.available_engines():
+            self.__engine.append(name, name.capitalize())
+        self.__engine.set_active_id(self.__main_window.project.audio_engine or audio.PIPELINE_ENGINE)
+        self.__engine.set_hexpand(True)
+        self.__engine.set_halign(Gtk.Align.FILL)
+        grid.attach(self.__engine, 1, 7, 1, 1)
+
         # TODO: Previous Revisions
 
         self.get_content_area().pack_start(grid, True, True, 0)
@@ -175,6 +191,9 @@ class SCProjectPropertiesDialog(Gtk.Dialog):
             self.__main_window.project.panic_fade_time = self.__panic_fade_time.get_total_milliseconds()
             self.__main_window.project.panic_hard_stop_time = self.__panic_delta.get_total_milliseconds()
             self.__main_window.project.max_duration_discovery_difference = self.__duration_delta.get_total_milliseconds()
+            engine = self.__engine.get_active_id()
+            if engine is not None and engine != (self.__main_window.project.audio_engine or audio.PIPELINE_ENGINE):
+                self.__main_window.project.audio_engine = engine
             if self.__main_window.project.root != self.__root.get_text():
                 self.__main_window.project.change_root(self.__root.get_text())
                 self.__main_window.project.store()
@@ -254,6 +273,28 @@ class SCCueDialog(Gtk.Dialog):
         self.__postwait.set_halign(Gtk.Align.FILL)
         grid.attach(self.__postwait, 1, 5, 1, 1)
 
+        continue_label = Gtk.Label("Continue")
+        continue_label.set_halign(Gtk.Align.END)
+        grid.attach(continue_label, 0, 6, 1, 1)
+        self.__continue_mode = Gtk.ComboBoxText()
+        self.__continue_mode.append(CONTINUE_NONE, "Wait for GO")
+        self.__continue_mode.append(AUTO_CONTINUE, "Auto-Continue after the Post-Wait")
+        self.__continue_mode.append(AUTO_FOLLOW, "Auto-Follow when the Cue Ends")
+        if not self.__continue_mode.set_active_id(self.__cue.continue_mode):
+            self.__continue_mode.set_active_id(CONTINUE_NONE)
+        self.__continue_mode.set_hexpand(True)
+        self.__continue_mode.set_halign(Gtk.Align.FILL)
+        grid.attach(self.__continue_mode, 1, 6, 1, 1)
+
+        follow_label = Gtk.Label("Follow Offset (ms)")
+        follow_label.set_halign(Gtk.Align.END)
+        grid.attach(follow_label, 0, 7, 1, 1)
+        self.__follow_offset = Gtk.SpinButton.new_with_range(min=-3600000, max=3600000, step=10)
+        self.__follow_offset.set_value(self.__cue.follow_offset)
+        self.__follow_offset.set_hexpand(True)
+        self.__follow_offset.set_halign(Gtk.Align.FILL)
+        grid.attach(self.__follow_offset, 1, 7, 1, 1)
+
         if self.__editor:
             wrapper = Gtk.ScrolledWindow()
             wrapper.add(self.__editor)
@@ -262,7 +303,7 @@ class SCCueDialog(Gtk.Dialog):
             wrapper.set_vexpand(True)
             wrapper.set_valign(Gtk.Align.FILL)
             wrapper.set_policy(Gtk.PolicyType.NEVER, Gtk.PolicyType.AUTOMATIC)
-            grid.attach(wrapper, 0, 6, 2, 1)
+            grid.attach(wrapper, 0, 8, 2, 1)
 
         self.get_content_area().pack_start(grid, True, True, 0)
         self.set_modal(True)
@@ -293,6 +334,8 @@ class SCCueDialog(Gtk.Dialog):
             )
             self.__cue.pre_wait = self.__prewait.get_total_milliseconds()
             self.__cue.post_wait = self.__postwait.get_total_milliseconds()
+            self.__cue.continue_mode = self.__continue_mode.get_active_id() or CONTINUE_NONE
+            self.__cue.follow_offset = self.__follow_offset.get_value_as_int()
             self.__cue.number = self.__id.get_value()
 
             self.__cue.on_editor_closed(self.__editor, save=True)
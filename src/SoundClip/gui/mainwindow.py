@@ -66,11 +66,19 @@ class SCMainWindow(Gtk.Window):
         if self.__project is not None:
             self.__project.close()
         self.__project = p
+        self.__project.connect('checksum-mismatch', self.on_checksum_mismatch)
 
         self.__cue_lists.on_project_changed(self.__project)
 
         self.update_title()
 
+    def on_checksum_mismatch(self, project, ex):
+        d = Gtk.MessageDialog(self, 0, Gtk.MessageType.WARNING, Gtk.ButtonsType.OK, "Project Storage Is Damaged")
+        d.format_secondary_text("An object in {0} failed verification, some cues may not be what was saved:\n{1}"
+                                .format(project.root, ex))
+        d.run()
+        d.destroy()
+
     def update_title(self):
         if not self.__project.root:
             self.title_bar.set_title("SoundClip " + __version__)
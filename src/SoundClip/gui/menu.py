@@ -20,6 +20,7 @@ logger = logging.getLogger('SoundClip')
 from gi.repository import Gtk, Gio, GObject
 
 from SoundClip.cue import Cue, CueStack, AudioCue, ControlCue
+from SoundClip.garbage import GarbageCollector
 from SoundClip.gui.dialog import SCCueDialog, SCProjectPropertiesDialog, SCAboutDialog, SCRenameCueListDialog
 from SoundClip.project import Project
 
@@ -86,7 +87,7 @@ class SCHeaderBar(Gtk.HeaderBar):
         self.__panic_button.set_tooltip_text("PANIC: Stop all automations and cues")
         self.__panic_button.connect("clicked", self.on_panic)
         self.pack_end(self.__panic_button)
-        self.__last_panic_time = 0
+        self.__last_panic_time = float('-inf')
 
     def on_workspace_lock_toggle(self, obj, lock):
         self.__add_cue_button.set_sensitive(not lock)
@@ -158,20 +159,35 @@ class SCHeaderBar(Gtk.HeaderBar):
 
             dialog.destroy()
 
-        self.__main_window.project.store()
-        self.__main_window.update_title()
+        if not self.__main_window.project.root:
+            return
+
+        self.__save_as_button.set_sensitive(False)
+        self.__main_window.project.store_async(self.on_save_finished)
         self.__main_window.refocus_cuelist()
 
+    def on_save_finished(self, project, stacks, error):
+        self.__save_as_button.set_sensitive(True)
+        self.__main_window.update_title()
+
+        if error is not None:
+            d = Gtk.MessageDialog(self.__main_window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
+                                  "Unable to save project")
+            d.format_secondary_text(str(error))
+            d.run()
+            d.destroy()
+
     def on_panic(self, button):
         """
         Callback for the Panic Button. Stops all running cues and automation tasks
         """
         p = self.__main_window.project
         ft = p.panic_fade_time
-        delta = now()-self.__last_panic_time
+        t = now()
+        delta = t-self.__last_panic_time
         logger.warning("PANIC! Stopping all cues and automation over {0} ms. It has been {1}ms since the last panic".format(ft, delta))
-        self.__main_window.send_stop_all(fade=ft if delta > 1000 else 0)
-        self.__last_panic_time = delta
+        self.__main_window.send_stop_all(fade=ft if delta > p.panic_hard_stop_time else 0)
+        self.__last_panic_time = t
         self.__main_window.refocus_cuelist()
 
 
@@ -201,6 +217,12 @@ class SCSettingsMenuModel(Gio.Menu):
         self.append("Renumber Cues", "hb.renumber")
         self.__action_group.insert(renumber_action)
 
+        cleanup_action = Gio.SimpleAction.new("cleanup", None)
+        cleanup_action.connect("activate", self.on_cleanup)
+        self.append("Clean Up Project Storage", "hb.cleanup")
+        self.__action_group.insert(cleanup_action)
+        self.__collector = None
+
         properties_action = Gio.SimpleAction.new("properties", None)
         properties_action.connect("activate", self.on_properties)
         self.append("Project Properties", "hb.properties")
@@ -233,6 +255,24 @@ class SCSettingsMenuModel(Gio.Menu):
 
         d.destroy()
 
+    def on_cleanup(self, model, user_data):
+        self.emit('action', 'cleanup')
+        project = self.__main_window.project
+        if not project.root or (self.__collector is not None and self.__collector.running):
+            return
+
+        self.__collector = GarbageCollector(project.root, project=project)
+        self.__collector.connect('finished', self.on_cleanup_finished)
+        self.__collector.start()
+
+    def on_cleanup_finished(self, collector, stats, error):
+        if error is not None:
+            d = Gtk.MessageDialog(self.__main_window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.OK,
+                                  "Unable to clean up project storage")
+            d.format_secondary_text(str(error))
+            d.run()
+            d.destroy()
+
     def on_about(self, model, user_data):
         self.emit('action', 'about')
         d = SCAboutDialog(self.__main_window)
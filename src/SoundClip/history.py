@@ -0,0 +1,208 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Revision history index for the SoundClip object store
+
+Every object links to its previous revision through `previousRevision`, so walking the history of an object means
+reading (and verifying) one object per revision. The history index keeps those links, and the time every version of
+the project was saved, in a single append-only log kept by the project's storage backend (see
+`backend.Backend.read_log`). With the loose backend, that is a file:
+
+.soundclip/
+└── history
+
+The sqlite backend keeps it in its database, and the memory backend in memory. Every line is one of:
+
+o <object> <previous revision>
+r <project revision> <previous project revision> <unix timestamp>
+
+Lines are appended after every save. The index records the object every new object replaced, which is exact even where
+the `previousRevision` stored in the object itself lags a revision behind (the first save of a cue after a load links
+to the revision before the one that was loaded). Lines cut short by a crash are ignored, and objects missing from the
+index fall back to their stored `previousRevision`.
+"""
+
+import threading
+import time
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from SoundClip import backend, storage
+
+HISTORY_NAME = backend.HISTORY_LOG
+
+__INDEXES = {}
+__LOCK = threading.Lock()
+
+
+class HistoryIndex(object):
+    """
+    The history of every object in a project's object store
+
+    :param root: The project root directory
+    """
+
+    def __init__(self, root):
+        self.__root = root
+        self.__parents = {}
+        self.__revisions = []
+        self.__lock = threading.RLock()
+
+        self.__load()
+
+    def __load(self):
+        lines = storage.get_backend(self.__root).read_log(HISTORY_NAME)
+        if not lines:
+            return
+
+        for line in lines:
+            self.__parse(line)
+
+        self.__revisions.sort()
+        logger.debug("Loaded history index for {0}: {1} objects, {2} project revisions".format(
+            self.__root, len(self.__parents), len(self.__revisions)
+        ))
+
+    def __parse(self, line):
+        if not line.endswith('\n'):
+            return
+        parts = line.split()
+        try:
+            if parts[0] == 'o' and len(parts) in (2, 3):
+                self.__parents[parts[1]] = parts[2] if len(parts) == 3 else ''
+            elif parts[0] == 'r' and len(parts) == 4:
+                self.__parents[parts[1]] = parts[2] if parts[2] != '-' else ''
+                self.__revisions.append((float(parts[3]), parts[1]))
+        except (IndexError, ValueError):
+            logger.warning("Ignoring malformed history line {0}".format(line.strip()))
+
+    def __len__(self):
+        return len(self.__parents)
+
+    def __contains__(self, key):
+        return key in self.__parents
+
+    def record(self, objects, revision=None, timestamp=None):
+        """
+        Appends newly written objects to the index
+
+        :param objects: A dictionary of object hash to the hash of its previous revision
+        :param revision: The hash of the project revision that was saved, if any
+        :param timestamp: The time the revision was saved. Defaults to now
+        """
+        lines = []
+        with self.__lock:
+            for key, parent in objects.items():
+                if key == revision:
+                    continue
+                self.__parents[key] = parent or ''
+                lines.append("o {0} {1}\n".format(key, parent or '').replace(' \n', '\n'))
+
+            if revision is not None:
+                timestamp = time.time() if timestamp is None else timestamp
+                parent = objects.get(revision, self.__parents.get(revision, ''))
+                self.__parents[revision] = parent or ''
+                self.__revisions.append((timestamp, revision))
+                self.__revisions.sort()
+                lines.append("r {0} {1} {2!r}\n".format(revision, parent or '-', timestamp))
+
+            if not lines:
+                return
+
+            storage.get_backend(self.__root).append_log(HISTORY_NAME, lines)
+
+    def parent(self, key):
+        """
+        :param key: The hash of an object
+        :return: The hash of the previous revision of the object, or `None` if it has none
+        """
+        with self.__lock:
+            if key in self.__parents:
+                return self.__parents[key] or None
+
+        logger.debug("{0} is not in the history index, reading it".format(key))
+        parent = storage.read(self.__root, key).get('previousRevision', None) or ''
+        with self.__lock:
+            self.__parents[key] = parent
+        return parent or None
+
+    def log(self, key, limit=None):
+        """
+        :param key: The hash of an object
+        :param limit: The maximum number of revisions to return
+        :return: The hashes of the object and its previous revisions, newest first. Stops at the first revision that is
+                 no longer in the object store
+        """
+        while key and (limit is None or limit > 0):
+            yield key
+            try:
+                key = self.parent(key)
+            except FileNotFoundError:
+                return
+            if limit is not None:
+                limit -= 1
+
+    def revisions(self):
+        """
+        :return: Every saved project revision as `(timestamp, hash)`, oldest first
+        """
+        with self.__lock:
+            return list(self.__revisions)
+
+    def revision_at(self, timestamp):
+        """
+        :param timestamp: A unix timestamp
+        :return: The hash of the last project revision saved at or before the specified time, or `None`
+        """
+        with self.__lock:
+            found = None
+            for t, key in self.__revisions:
+                if t > timestamp:
+                    break
+                found = key
+            return found
+
+    def compact(self, keep):
+        """
+        Rewrites the index without the objects that are not in `keep`, after they were removed from the object store
+
+        :param keep: The hashes of the objects that still exist
+        """
+        with self.__lock:
+            # Revisions that were removed end the history of the objects that replaced them
+            self.__parents = {k: (v if v in keep else '') for k, v in self.__parents.items() if k in keep}
+            self.__revisions = [(t, k) for t, k in self.__revisions if k in keep]
+            revisions = set(k for t, k in self.__revisions)
+
+            lines = ["o {0} {1}\n".format(key, parent).replace(' \n', '\n')
+                     for key, parent in self.__parents.items() if key not in revisions]
+            lines.extend("r {0} {1} {2!r}\n".format(key, self.__parents[key] or '-', t) for t, key in self.__revisions)
+            storage.get_backend(self.__root).write_log(HISTORY_NAME, lines)
+
+
+def get(root):
+    """
+    :param root: The project root directory
+    :return: The (lazily loaded) history index of the specified project
+    """
+    with __LOCK:
+        if root not in __INDEXES:
+            __INDEXES[root] = HistoryIndex(root)
+        return __INDEXES[root]
+
+
+def forget(root):
+    with __LOCK:
+        __INDEXES.pop(root, None)
@@ -0,0 +1,532 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Write-ahead edit journal for SoundClip projects
+
+A project is only written to disk when it is saved. To survive a crash between saves, every edit to an open project is
+appended to a journal as it happens. The journal is a log kept by the project's storage backend (see
+`backend.Backend.read_log`): a file with the loose backend, a table of the database with the sqlite backend, and
+memory only with the memory backend, which does not survive a crash anyway:
+
+.soundclip/
+└── journal
+
+{"base": <project revision>, "saved": <revision in project.json>, "time": <unix timestamp>}
+{"seq": 1, "op": "set", "stack": 0, "index": 3, "property": "name", "value": "Preshow"}
+{"seq": 2, "op": "insert", "stack": 0, "index": 4, "cue": {...}}
+...
+
+Edits are recorded by position: `set` (a cue property), `cue` (the whole cue, for changes that are not properties),
+`insert`, `replace` and `delete` (cues), `rename`, `add-stack` and `remove-stack` (cue stacks) and `project` (a
+project setting). The target of a control cue is recorded by its position too, as it may not have been stored yet.
+Cues of an added stack that were never loaded are recorded by their hash and index metadata, and stay unloaded.
+Records are buffered for a moment and written (and synced) together, so a burst of edits like renumbering a cue list
+costs a single write.
+
+Once enough edits have piled up, the project is checkpointed: it is stored in the object store like a save, but
+project.json is left alone, and the journal is restarted on top of the checkpoint revision. A real save restarts the
+journal as well. When the project is loaded again, the journal is replayed on top of its base revision in a single
+pass, as long as project.json is still the revision the journal was started from. Closing a project discards its
+journal, just like its unsaved changes.
+"""
+
+import json
+import time
+import weakref
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib
+
+from SoundClip import backend, storage
+from SoundClip.cue import ControlCue, Cue, CueStack, CueStackChangeType, CueStub, build_cue
+from SoundClip.exception import SCException
+
+JOURNAL_NAME = backend.JOURNAL_LOG
+
+# Milliseconds to buffer records for before writing them
+DEFAULT_FLUSH_INTERVAL = 250
+
+# Number of records after which the project is checkpointed
+DEFAULT_CHECKPOINT_RECORDS = 500
+
+# Seconds after which the project is checkpointed if anything was recorded
+DEFAULT_CHECKPOINT_INTERVAL = 5 * 60
+
+# Properties that describe where an object is stored rather than the object itself
+_UNTRACKED_PROPERTIES = ('current-hash', 'last-hash', 'root')
+
+
+class JournalException(SCException):
+    pass
+
+
+def read(root):
+    """
+    Reads the journal of a project. Lines cut short by a crash, and anything after a line that can't be parsed, are
+    ignored
+
+    :param root: The project root directory
+    :return: The journal header and its records, or `(None, [])` if the project has no journal
+    """
+    header = None
+    records = []
+    for line in storage.get_backend(root).read_log(JOURNAL_NAME):
+        if not line.endswith('\n'):
+            break
+        try:
+            j = json.loads(line)
+        except ValueError:
+            logger.warning("Ignoring the rest of the journal of {0} after a malformed record".format(root))
+            break
+        if header is None:
+            header = j
+        else:
+            records.append(j)
+    return header, records
+
+
+def base(root):
+    """
+    :param root: The project root directory
+    :return: The revision the journal of the project applies to, if it has a journal
+    """
+    lines = storage.get_backend(root).read_log(JOURNAL_NAME)
+    if not lines:
+        return None
+    line = lines[0]
+    try:
+        return json.loads(line).get('base', None) if line.endswith('\n') else None
+    except ValueError:
+        return None
+
+
+def recovery_base(root, saved):
+    """
+    :param root: The project root directory
+    :param saved: The revision project.json points at
+    :return: The revision to load the project from before replaying its journal, if it differs from `saved`
+    """
+    key = base(root)
+    if not key or key == saved:
+        return None
+
+    header, records = read(root)
+    if header is None or header.get('saved', None) != saved:
+        return None
+    if not storage.exists(root, key):
+        logger.warning("The journal of {0} starts from {1}, which no longer exists".format(root, key))
+        return None
+    return key
+
+
+def _plain(value, positions):
+    if isinstance(value, storage.PendingObject):
+        # Referenced cues may not have been stored yet (or changed since), so they are referred to by where they were
+        # when the edit was recorded. Cues that could not be located fall back to the hash they were last stored as
+        for cue, s, i in positions:
+            if cue is value.owner:
+                return {'stack': s, 'index': i}
+        return value.current_hash
+    elif isinstance(value, dict):
+        return {k: _plain(v, positions) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [_plain(v, positions) for v in value]
+    return value
+
+
+def _serialize(cue, positions=()):
+    return _plain(cue.serialize({}, {}), positions)
+
+
+def _serialize_stub(stub):
+    return {'stub': stub.current_hash, 'meta': stub.meta}
+
+
+def _target_position(j):
+    """
+    :return: The position a journaled control cue refers to its target by, if it does
+    """
+    target = j.get('target', None)
+    ref = target.get('ref', None) if isinstance(target, dict) else None
+    return (ref['stack'], ref['index']) if isinstance(ref, dict) else None
+
+
+def _is_plain(value):
+    return value is None or isinstance(value, (str, int, float, bool))
+
+
+class Journal(object):
+    """
+    Records the edits made to an open project, and replays them after a crash
+
+    :param project: The project to record
+    :param flush_interval: The number of milliseconds to buffer records for before writing them
+    :param checkpoint_records: The number of records after which the project is checkpointed
+    :param checkpoint_interval: The number of seconds after which the project is checkpointed if anything was recorded
+    """
+
+    def __init__(self, project, flush_interval=DEFAULT_FLUSH_INTERVAL, checkpoint_records=DEFAULT_CHECKPOINT_RECORDS,
+                 checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        self.__project = project
+        self.__root = project.root
+        self.__flush_interval = flush_interval
+        self.__checkpoint_records = checkpoint_records
+        self.__checkpoint_interval = checkpoint_interval
+
+        self.__base = None
+        self.__saved = None
+        self.__seq = 0
+        self.__records = []
+        self.__pending = []
+        self.__source = None
+        self.__checkpointed = time.time()
+
+        self.__stacks = []
+        self.__owners = weakref.WeakKeyDictionary()
+        self.__handlers = []
+
+    @property
+    def seq(self):
+        """
+        :return: The sequence number of the last recorded edit
+        """
+        return self.__seq
+
+    @property
+    def records(self):
+        """
+        :return: The number of edits recorded since the project was last checkpointed
+        """
+        return len(self.__records) + len(self.__pending)
+
+    def open(self, saved, replay=True):
+        """
+        Starts recording. The journal the project was left with is replayed first, if it applies to the project's
+        current revision, and is discarded otherwise
+
+        :param saved: The revision project.json points at
+        :param replay: Whether to replay the existing journal
+        :return: The number of edits that were replayed
+        """
+        header, records = read(self.__root)
+        applies = header is not None and header.get('saved', None) == saved and \
+            header.get('base', None) == (self.__project.current_hash or None)
+
+        replayed = 0
+        if replay and applies and records:
+            started = time.time()
+            replayed = self.__replay(records)
+            self.__records = records
+            self.__seq = max(r.get('seq', 0) for r in records)
+            logger.info("Recovered {0} unsaved edits to {1} from its journal in {2:.3f}s".format(
+                replayed, self.__root, time.time() - started
+            ))
+        elif records:
+            logger.warning("Discarding {0} journaled edits to {1}, the project was saved elsewhere".format(
+                len(records), self.__root
+            ))
+
+        self.__base = self.__project.current_hash or None
+        self.__saved = saved
+        self.__checkpointed = time.time()
+        self.__rewrite()
+        self.attach()
+        return replayed
+
+    def attach(self):
+        """
+        Starts listening to the project and its cue stacks
+        """
+        self.detach()
+        p = self.__project
+        self.__handlers.append((p, p.connect('cue-changed', self.__on_cue_changed)))
+        self.__handlers.append((p, p.connect('stack-changed', self.__on_stacks_changed)))
+        self.__handlers.append((p, p.connect('notify', self.__on_project_notify)))
+        self.__stacks = []
+        for stack in p.cue_stacks:
+            self.__track(stack)
+
+    def detach(self):
+        """
+        Stops listening to the project and its cue stacks
+        """
+        for obj, handler in self.__handlers:
+            obj.disconnect(handler)
+        self.__handlers = []
+        self.__stacks = []
+        self.__owners = weakref.WeakKeyDictionary()
+
+    def __track(self, stack):
+        self.__stacks.append(stack)
+        self.__handlers.append((stack, stack.connect('changed', self.__on_stack_changed)))
+        self.__handlers.append((stack, stack.connect('materialized', self.__on_materialized)))
+        self.__handlers.append((stack, stack.connect('replaced', self.__on_replaced)))
+        self.__handlers.append((stack, stack.connect('notify::name', self.__on_stack_renamed)))
+        for cue in stack.loaded():
+            self.__owners[cue] = stack
+
+    def __locate(self, cue):
+        stack = self.__owners.get(cue, None)
+        if stack is None:
+            return None, None
+        try:
+            return self.__stacks.index(stack), stack.index(cue)
+        except ValueError:
+            return None, None
+
+    def __positions(self, cue):
+        # The cues referenced by `cue`, with where they are now
+        if not isinstance(cue, ControlCue) or cue.target is None or cue.target.is_relative:
+            return []
+        target = cue.target.resolve(self.__project)
+        s, i = self.__locate(target)
+        return [(target, s, i)] if s is not None else []
+
+    def record(self, op, **fields):
+        """
+        Appends an edit to the journal. Records are written after `flush_interval` milliseconds, together with
+        everything else recorded in the meantime
+
+        :param op: The kind of edit
+        :param fields: The position and content of the edit. A `Cue` is serialized when the record is written, the
+                       cues it references are located right away
+        """
+        self.__seq += 1
+        fields['seq'] = self.__seq
+        fields['op'] = op
+        fields['_positions'] = [p for v in fields.values() if isinstance(v, Cue) for p in self.__positions(v)]
+        self.__pending.append(fields)
+
+        if self.__source is None:
+            self.__source = GLib.timeout_add(self.__flush_interval, self.__on_timeout)
+
+    def __on_timeout(self):
+        self.__source = None
+        self.flush()
+        self.__maybe_checkpoint()
+        return False
+
+    def flush(self):
+        """
+        Writes every buffered record to the journal and syncs it
+        """
+        if self.__source is not None:
+            GLib.source_remove(self.__source)
+            self.__source = None
+        if not self.__pending:
+            return
+
+        records = []
+        for r in self.__pending:
+            positions = r.pop('_positions', ())
+            records.append({k: _serialize(v, positions) if isinstance(v, Cue) else v for k, v in r.items()})
+        self.__pending = []
+
+        storage.get_backend(self.__root).append_log(JOURNAL_NAME, [json.dumps(r, sort_keys=True) + '\n'
+                                                                    for r in records])
+        self.__records.extend(records)
+
+    def __maybe_checkpoint(self):
+        if not self.__records or self.__project.saving:
+            return
+        if len(self.__records) >= self.__checkpoint_records or \
+                time.time() - self.__checkpointed >= self.__checkpoint_interval:
+            logger.debug("Checkpointing {0} after {1} journaled edits".format(self.__root, len(self.__records)))
+            self.__project.store_async(checkpoint=True)
+
+    def checkpointed(self, seq, revision, saved=False):
+        """
+        Restarts the journal on top of a revision that was stored. Edits recorded after the revision was captured are
+        kept
+
+        :param seq: The sequence number of the last edit included in the revision
+        :param revision: The hash of the stored project revision
+        :param saved: Whether project.json was updated to the revision as well
+        """
+        self.flush()
+        self.__records = [r for r in self.__records if r['seq'] > seq]
+        self.__base = revision
+        if saved:
+            self.__saved = revision
+        self.__checkpointed = time.time()
+        self.__rewrite()
+
+    def reset(self, revision):
+        """
+        Restarts the journal after the project was replaced by another revision (see `Project.revert_to`), discarding
+        everything recorded so far
+
+        :param revision: The revision the project now matches
+        """
+        if self.__source is not None:
+            GLib.source_remove(self.__source)
+            self.__source = None
+        self.__pending = []
+        self.__records = []
+        self.__base = revision
+        self.__checkpointed = time.time()
+        self.__rewrite()
+        self.attach()
+
+    def close(self, discard=True):
+        """
+        Stops recording
+
+        :param discard: Whether to remove the journal, or keep it to be replayed the next time the project is loaded
+        """
+        self.detach()
+        if discard:
+            if self.__source is not None:
+                GLib.source_remove(self.__source)
+                self.__source = None
+            self.__pending = []
+            self.__records = []
+            storage.get_backend(self.__root).remove_log(JOURNAL_NAME)
+        else:
+            self.flush()
+
+    def __rewrite(self):
+        header = {'base': self.__base, 'saved': self.__saved, 'time': time.time()}
+        lines = [json.dumps(header, sort_keys=True) + '\n']
+        lines.extend(json.dumps(r, sort_keys=True) + '\n' for r in self.__records)
+        storage.get_backend(self.__root).write_log(JOURNAL_NAME, lines)
+
+    def __on_cue_changed(self, project, cue, prop):
+        s, i = self.__locate(cue)
+        if s is None:
+            # Cues being loaded or not in a cue stack yet are recorded when they are inserted
+            return
+
+        value = cue.get_property(prop) if prop else None
+        if prop and _is_plain(value):
+            self.record('set', stack=s, index=i, property=prop, value=value)
+        else:
+            self.record('cue', stack=s, index=i, cue=cue)
+
+    def __on_stack_changed(self, stack, index, change):
+        # Updates are emitted for every cue update, including playback progress. Replacements are recorded from the
+        # `replaced` signal, and changes to cues from `cue-changed`
+        if change is CueStackChangeType.UPDATE:
+            return
+        s = self.__stacks.index(stack)
+        if change is CueStackChangeType.INSERT:
+            cue = stack.peek(index)
+            self.__owners[cue] = stack
+            self.record('insert', stack=s, index=index, cue=cue)
+        elif change is CueStackChangeType.DELETE:
+            self.record('delete', stack=s, index=index)
+
+    def __on_materialized(self, stack, index, cue):
+        self.__owners[cue] = stack
+
+    def __on_replaced(self, stack, index, cue):
+        self.__owners[cue] = stack
+        self.record('replace', stack=self.__stacks.index(stack), index=index, cue=cue)
+
+    def __on_stack_renamed(self, stack, pspec):
+        self.record('rename', stack=self.__stacks.index(stack), name=stack.name)
+
+    def __on_stacks_changed(self, project, index, action):
+        # Compare the tracked stacks with the project's, so inserts, removals and replacements are handled alike
+        stacks = project.cue_stacks
+        for s in reversed(range(len(self.__stacks))):
+            if self.__stacks[s] not in stacks:
+                self.record('remove-stack', stack=s)
+                self.__untrack(self.__stacks[s])
+        for s, stack in enumerate(stacks):
+            if stack not in self.__stacks:
+                # Tracked first, so references between the cues of the new stack can be located
+                self.__track(stack)
+                self.__stacks.insert(s, self.__stacks.pop())
+                cues = [_serialize_stub(cue) if isinstance(cue, CueStub) else _serialize(cue, self.__positions(cue))
+                        for cue in (stack.peek(i) for i in range(len(stack)))]
+                self.record('add-stack', stack=s, name=stack.name, cues=cues)
+
+    def __untrack(self, stack):
+        for obj, handler in [h for h in self.__handlers if h[0] is stack]:
+            obj.disconnect(handler)
+            self.__handlers.remove((obj, handler))
+        self.__stacks.remove(stack)
+
+    def __on_project_notify(self, project, pspec):
+        if pspec.name in _UNTRACKED_PROPERTIES:
+            return
+        value = project.get_property(pspec.name)
+        if _is_plain(value):
+            self.record('project', property=pspec.name, value=value)
+
+    def __replay(self, records):
+        p = self.__project
+        replayed = 0
+        for r in records:
+            try:
+                self.__apply(p, r)
+                replayed += 1
+            except Exception as ex:
+                logger.error("Unable to replay journaled edit {0} to {1}: {2}".format(r.get('seq', None), p.root, ex))
+        return replayed
+
+    @staticmethod
+    def __without_position(j):
+        # Control cues are loaded without their target when it was journaled by position, see `__retarget`
+        if _target_position(j) is None:
+            return j
+        return dict(j, target=dict(j['target'], ref=None))
+
+    @staticmethod
+    def __retarget(p, cue, j):
+        position = _target_position(j)
+        if position is not None and isinstance(cue, ControlCue):
+            cue.set_target(p.cue_stacks[position[0]][position[1]])
+
+    def __apply(self, p, r):
+        op = r['op']
+        if op == 'set':
+            p.cue_stacks[r['stack']][r['index']].set_property(r['property'], r['value'])
+        elif op == 'cue':
+            cue = p.cue_stacks[r['stack']][r['index']]
+            cue.load(p.root, cue.current_hash, Journal.__without_position(r['cue']))
+            Journal.__retarget(p, cue, r['cue'])
+            cue.mark_dirty()
+        elif op == 'insert':
+            cue = build_cue(p.root, None, Journal.__without_position(r['cue']), p)
+            Journal.__retarget(p, cue, r['cue'])
+            p.cue_stacks[r['stack']].insert(r['index'], cue)
+        elif op == 'replace':
+            cue = build_cue(p.root, None, Journal.__without_position(r['cue']), p)
+            Journal.__retarget(p, cue, r['cue'])
+            p.cue_stacks[r['stack']][r['index']] = cue
+        elif op == 'delete':
+            p.cue_stacks[r['stack']].pop(r['index'])
+        elif op == 'rename':
+            p.cue_stacks[r['stack']].rename(r['name'])
+        elif op == 'add-stack':
+            cues = [CueStub(j['stub'], j['meta']) if 'stub' in j else
+                    build_cue(p.root, None, Journal.__without_position(j), p) for j in r['cues']]
+            stack = CueStack(project=p, name=r['name'], cues=cues)
+            p.insert_cuelist(r['stack'], stack)
+            # Cues of the new stack may refer to each other
+            for cue, j in zip(cues, r['cues']):
+                Journal.__retarget(p, cue, j)
+        elif op == 'remove-stack':
+            p.remove_cuelist(p.cue_stacks[r['stack']])
+        elif op == 'project':
+            p.set_property(r['property'], r['value'])
+        else:
+            raise JournalException({
+                "message": "Unknown journal record {0}".format(op),
+                "record": r
+            })
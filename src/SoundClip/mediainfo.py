@@ -0,0 +1,333 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Shared, persistent cache of media metadata
+
+Running `GstPbutils.Discoverer` on a file means starting a pipeline and decoding the start of the file. The results
+(duration, the caps of the audio streams, tags, and whether SoundClip can play the file at all) are cached, for every
+project, in a single append-only file in the user's cache directory:
+
+~/.cache/soundclip/
+└── mediainfo
+
+{"path": <absolute path>, "size": <bytes>, "mtime": <ns>, "inode": <inode>, "duration": <ms>, "supported": <bool>,
+ "caps": [<caps of every audio stream>], "tags": {<tag>: <value>}, "error": <message or null>}
+
+An entry is only used while the size, modification time and inode of the file on disk still match, so files are only
+discovered again once they change. Later lines replace earlier ones for the same path, and the file is compacted when
+it is loaded if it holds too many stale lines.
+
+Files are discovered in the background by `SoundClip.discovery`, `discover` blocks until a file is discovered.
+"""
+
+import json
+import os
+import threading
+from urllib.parse import unquote, urlparse
+
+import gi
+gi.require_version('Gst', '1.0')
+gi.require_version('GstPbutils', '1.0')
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, Gst, GstPbutils
+
+CACHE_NAME = 'mediainfo'
+
+# Compact the cache file once it holds this many times more lines than entries
+_COMPACT_RATIO = 2
+
+__CACHE = None
+__LOCK = threading.Lock()
+
+
+def default_cache_path():
+    return os.path.join(GLib.get_user_cache_dir(), 'soundclip', CACHE_NAME)
+
+
+def to_path(uri):
+    """
+    :param uri: A file:// uri or a path
+    :return: The absolute path of the file
+    """
+    return os.path.abspath(unquote(urlparse(uri).path) if uri.startswith('file://') else uri)
+
+
+def to_uri(path):
+    return path if path.startswith('file://') else Gst.filename_to_uri(os.path.abspath(path))
+
+
+class MediaInfo(object):
+    """
+    What is known about a media file
+
+    :param path: The absolute path of the file
+    :param size: The size of the file when it was discovered
+    :param mtime: The modification time of the file when it was discovered, in nanoseconds
+    :param inode: The inode of the file when it was discovered
+    :param duration: The duration of the file in milliseconds
+    :param supported: Whether the file has an audio stream SoundClip can play
+    :param caps: The caps of every audio stream in the file
+    :param tags: The tags of the file, as strings
+    :param error: Why the file could not be discovered, if it couldn't
+    """
+
+    def __init__(self, path, size, mtime, inode, duration=0, supported=False, caps=None, tags=None, error=None):
+        self.path = path
+        self.size = size
+        self.mtime = mtime
+        self.inode = inode
+        self.duration = duration
+        self.supported = supported
+        self.caps = [] if caps is None else caps
+        self.tags = {} if tags is None else tags
+        self.error = error
+
+    @staticmethod
+    def from_dict(d):
+        return MediaInfo(d['path'], d['size'], d['mtime'], d['inode'], duration=d.get('duration', 0),
+                         supported=d.get('supported', False), caps=d.get('caps', None), tags=d.get('tags', None),
+                         error=d.get('error', None))
+
+    def as_dict(self):
+        return dict(self.__dict__)
+
+    def matches(self, st):
+        """
+        :param st: The `os.stat_result` of the file on disk
+        :return: Whether this information still describes the file
+        """
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime and st.st_ino == self.inode
+
+    def __repr__(self):
+        return "MediaInfo({0})".format(self.as_dict())
+
+
+def __tag_values(tags):
+    if tags is None:
+        return {}
+    values = {}
+    for i in range(tags.n_tags()):
+        name = tags.nth_tag_name(i)
+        value = tags.get_value_index(name, 0)
+        if isinstance(value, (str, int, float, bool)):
+            values[name] = value
+        elif value is not None:
+            values[name] = str(value)
+    return values
+
+
+def from_discoverer(path, st, info, error=None):
+    """
+    Builds the media information of a file from the results of a `GstPbutils.Discoverer`
+
+    :param path: The absolute path of the file
+    :param st: The `os.stat_result` of the file when it was discovered
+    :param info: The `GstPbutils.DiscovererInfo`, if discovery got that far
+    :param error: The error that stopped discovery, if any
+    """
+    m = MediaInfo(path, st.st_size, st.st_mtime_ns, st.st_ino)
+    if info is not None:
+        streams = info.get_audio_streams()
+        m.duration = int(info.get_duration() / Gst.MSECOND)
+        m.caps = [s.get_caps().to_string() for s in streams if s.get_caps() is not None]
+        m.tags = __tag_values(info.get_tags())
+        m.supported = len(streams) > 0
+    if error is not None:
+        m.error = error.message if isinstance(error, GLib.Error) else str(error)
+        m.supported = False
+    return m
+
+
+class MediaInfoCache(object):
+    """
+    The persistent media information cache
+
+    :param path: The file to keep the cache in
+    """
+
+    def __init__(self, path):
+        self.__path = path
+        self.__entries = {}
+        self.__lock = threading.RLock()
+        self.__discoverer = None
+        # Whether the cache file ends in a torn line that could not be truncated
+        self.__torn = False
+
+        self.__load()
+
+    @property
+    def path(self):
+        return self.__path
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __load(self):
+        if not os.path.isfile(self.__path):
+            return
+
+        lines = 0
+        end = 0
+        torn = False
+        try:
+            with open(self.__path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        torn = True
+                        break
+                    lines += 1
+                    end += len(line)
+                    try:
+                        m = MediaInfo.from_dict(json.loads(line.decode('utf-8')))
+                    except (ValueError, KeyError, TypeError):
+                        logger.warning("Ignoring malformed media info line {0}".format(line.strip()))
+                        continue
+                    self.__entries[m.path] = m
+        except OSError as ex:
+            logger.warning("Unable to read the media info cache {0}: {1}".format(self.__path, ex))
+            return
+
+        logger.debug("Loaded media info for {0} files from {1}".format(len(self.__entries), self.__path))
+        if torn:
+            # The last write was interrupted, drop the fragment so that the next entry doesn't get appended onto it
+            logger.warning("Dropping a torn line at the end of the media info cache {0}".format(self.__path))
+            try:
+                os.truncate(self.__path, end)
+            except OSError as ex:
+                logger.warning("Unable to truncate the media info cache {0}: {1}".format(self.__path, ex))
+                self.__torn = True
+
+        if lines > len(self.__entries) * _COMPACT_RATIO + 16:
+            try:
+                self.compact()
+            except OSError as ex:
+                logger.warning("Unable to compact the media info cache {0}: {1}".format(self.__path, ex))
+
+    def compact(self):
+        """
+        Rewrites the cache file with only the current entry of every file
+        """
+        with self.__lock:
+            tmp = self.__path + '.tmp'
+            with open(tmp, 'wt') as f:
+                for m in self.__entries.values():
+                    f.write(json.dumps(m.as_dict(), sort_keys=True) + '\n')
+            os.replace(tmp, self.__path)
+            self.__torn = False
+
+    def lookup(self, uri, st=None):
+        """
+        :param uri: A file:// uri or path
+        :param st: The `os.stat_result` of the file, if it has already been read
+        :return: The cached information of the file, if it has not changed since it was discovered, otherwise `None`
+        """
+        path = to_path(uri)
+        if st is None:
+            try:
+                st = os.stat(path)
+            except OSError:
+                return None
+        with self.__lock:
+            m = self.__entries.get(path, None)
+        return m if m is not None and m.matches(st) else None
+
+    def put(self, m):
+        """
+        Adds the information of a file to the cache, and appends it to the cache file
+        """
+        with self.__lock:
+            self.__entries[m.path] = m
+            try:
+                os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+                with open(self.__path, 'at') as f:
+                    if self.__torn:
+                        # End the torn line, it is skipped as malformed from now on
+                        f.write('\n')
+                        self.__torn = False
+                    f.write(json.dumps(m.as_dict(), sort_keys=True) + '\n')
+            except OSError as ex:
+                logger.warning("Unable to write the media info cache {0}: {1}".format(self.__path, ex))
+
+    def forget(self, uri):
+        with self.__lock:
+            self.__entries.pop(to_path(uri), None)
+
+    def discover(self, uri):
+        """
+        Returns the information of a media file, discovering it (and blocking until it is discovered) if it is new or
+        has changed since it was discovered
+
+        :param uri: A file:// uri or path
+        :return: A `MediaInfo`, or `None` if the file does not exist
+        """
+        path = to_path(uri)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+
+        m = self.lookup(path, st)
+        if m is not None:
+            return m
+
+        logger.debug("Discovering {0}".format(path))
+        if self.__discoverer is None:
+            self.__discoverer = GstPbutils.Discoverer()
+        try:
+            m = from_discoverer(path, st, self.__discoverer.discover_uri(to_uri(path)))
+        except GLib.Error as ex:
+            logger.warning("Cannot play audio file {0}: {1}".format(path, ex.message))
+            m = from_discoverer(path, st, None, ex)
+        self.put(m)
+        return m
+
+
+def get_cache():
+    """
+    :return: The media information cache shared by every project
+    """
+    global __CACHE
+    with __LOCK:
+        if __CACHE is None:
+            __CACHE = MediaInfoCache(default_cache_path())
+        return __CACHE
+
+
+def set_cache(cache):
+    """
+    Replaces the shared media information cache, for example with one kept somewhere other than the user's cache
+    directory
+    """
+    global __CACHE
+    with __LOCK:
+        __CACHE = cache
+
+
+def discover(uri):
+    """
+    See `MediaInfoCache.discover`
+    """
+    return get_cache().discover(uri)
+
+
+def is_supported(uri):
+    """
+    :param uri: A file:// uri or path
+    :return: Whether the file exists and has an audio stream SoundClip can play
+    """
+    m = discover(uri)
+    return m is not None and m.supported
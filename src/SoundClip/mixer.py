@@ -0,0 +1,554 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Single mixing pipeline for SoundClip
+
+The default audio engine (see `SoundClip.pipeline`) plays every cue through a pipeline of its own, each with its own
+connection to the sound server and its own clock. The mixer engine plays every cue through one long-lived pipeline, with
+a single output sink and a single clock:
+
+audiotestsrc (silent, live) -> capsfilter ---\\
+cue branch ------------------------------------> audiomixer -> audioconvert -> audioresample -> autoaudiosink
+cue branch ------------------------------------/
+
+Every playback controller gets a `MixerBranch`, a bin that is added to the pipeline and linked to a sink pad requested
+from the mixer while its cue is armed or playing, and removed again when it stops:
+
+uridecodebin -> audioconvert -> rgvolume -> audiopanorama -> volume -> audioconvert -> audioresample -> capsfilter
+
+Branches have the same interface as `pipeline.PlaybackPipeline`, so volume, pan and fades apply to a single branch.
+The silent live source keeps the mixer (and its clock) running while no cue is playing, and keeps a branch that is
+paused or still prerolling from holding up the others.
+
+A branch is paused (or armed) by blocking the buffers leaving it. When it is resumed its pad offset is set so the
+buffer it was holding back is mixed at the mixer's current running time, and playback picks up where it left off. The
+same happens for the first buffer after a flushing seek. Branches started together with `MixerBranch.play_at` are
+aligned to the same running time instead, so they are mixed sample-aligned.
+
+The mixing pipeline runs on the clock shared by every playback pipeline (see `pipeline.get_clock`).
+"""
+
+import threading
+
+import gi
+gi.require_version('Gst', '1.0')
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, Gst
+
+from SoundClip import fades
+from SoundClip.pipeline import get_clock
+
+# The format every branch is converted to before it is mixed
+MIX_CAPS = 'audio/x-raw,format=F32LE,layout=interleaved,rate=48000,channels=2'
+
+# How far ahead of the mixer's running time resumed branches are scheduled, so their first buffer is not late
+MIX_LATENCY = 30
+
+# Seconds to wait for a branch to preroll
+PREROLL_TIMEOUT = 5
+
+# The number of idle branches to keep around for reuse
+DEFAULT_IDLE_BRANCHES = 8
+
+__MIXER = None
+
+
+def is_available():
+    """
+    :return: Whether the GStreamer elements the mixer engine needs are installed
+    """
+    return all(Gst.ElementFactory.find(name) is not None for name in ('audiomixer', 'audiopanorama', 'audiotestsrc'))
+
+
+def _make(factory):
+    e = Gst.ElementFactory.make(factory, None)
+    if e is None:
+        raise RuntimeError("The GStreamer element {0} is not installed".format(factory))
+    return e
+
+
+class MixerBranch(object):
+    """
+    The part of the mixing pipeline that plays a single cue. See `pipeline.PlaybackPipeline` for the interface
+
+    :param mixer: The `Mixer` the branch feeds
+    """
+
+    def __init__(self, mixer):
+        self.owner = None
+        self.busy = False
+        self.__mixer = mixer
+        self.__generation = 0
+
+        # Guards the state and the blocking probe, which are also used from the branch's streaming thread
+        self.__lock = threading.Condition()
+        self.__state = Gst.State.NULL
+        self.__probe = None
+        # The running time of the buffer held back while the branch is blocked
+        self.__held = None
+        # The time on the shared clock `play_at` asked the branch to start at, until its first buffer is aligned
+        self.__play_at = None
+        # The time on the shared clock the branch started playing at, if it was started with `play_at`
+        self.__start_time = None
+        self.__mixer_pad = None
+
+        self.__bin = Gst.Bin.new(None)
+        self.__dec = _make('uridecodebin')
+        self.__dec.connect('pad-added', self.__on_decoded_pad)
+        self.__conv = _make('audioconvert')
+        self.__conv_sink = self.__conv.get_static_pad('sink')
+        self.__rgvol = _make('rgvolume')
+        self.__pan = _make('audiopanorama')
+        self.__vol = _make('volume')
+        self.__out_conv = _make('audioconvert')
+        self.__resample = _make('audioresample')
+        self.__caps = _make('capsfilter')
+        self.__caps.set_property('caps', Gst.Caps.from_string(MIX_CAPS))
+
+        chain = [self.__conv, self.__rgvol, self.__pan, self.__vol, self.__out_conv, self.__resample, self.__caps]
+        self.__bin.add(self.__dec)
+        for e in chain:
+            self.__bin.add(e)
+        for a, b in zip(chain, chain[1:]):
+            a.link(b)
+        self.__fader = fades.Fader(self.__vol)
+
+        self.__src = Gst.GhostPad.new('src', self.__caps.get_static_pad('src'))
+        self.__bin.add_pad(self.__src)
+        self.__src.add_probe(Gst.PadProbeType.EVENT_DOWNSTREAM | Gst.PadProbeType.EVENT_FLUSH, self.__on_event)
+
+    @property
+    def bin(self):
+        return self.__bin
+
+    @property
+    def uri(self):
+        return self.__dec.get_property('uri')
+
+    def point_at(self, uri):
+        """
+        Takes the branch out of the mix and swaps the file it plays
+        """
+        self.__detach()
+        self.__dec.set_property('uri', uri)
+
+    @property
+    def volume(self):
+        return self.__vol.get_property('volume')
+
+    @volume.setter
+    def volume(self, v):
+        self.__fader.cancel()
+        self.__vol.set_property('volume', v)
+
+    @property
+    def fading(self):
+        return self.__fader.fading
+
+    def fade(self, target, duration, shape=fades.LINEAR, callback=None):
+        """
+        Fades the volume to `target` over the next `duration` milliseconds of the file, see `fades.Fader`
+
+        :param callback: Called once the fade is complete. Not called if the fade is cancelled, or the pipeline is reset
+        """
+        # Where the volume element is, rather than the sink, which lags behind it
+        position = self.__fader.position
+        if position is None:
+            position = max(0, self.query_position()) * Gst.MSECOND
+        self.__fader.start(self.volume, target, position, duration * Gst.MSECOND, shape, callback)
+
+    @property
+    def pan(self):
+        return self.__pan.get_property('panorama')
+
+    @pan.setter
+    def pan(self, p):
+        self.__pan.set_property('panorama', max(min(p, 1.0), -1.0))
+
+    def set_state(self, state):
+        """
+        Adds the branch to the mix and holds it back (`PAUSED`), lets it play (`PLAYING`), or takes it out of the mix
+        (`READY` or `NULL`)
+        """
+        if state in (Gst.State.PAUSED, Gst.State.PLAYING):
+            self.__attach()
+        else:
+            self.__detach()
+            return Gst.StateChangeReturn.SUCCESS
+
+        with self.__lock:
+            self.__state = state
+            self.__play_at = None
+            self.__start_time = None
+            if state == Gst.State.PAUSED:
+                self.__block()
+            else:
+                self.__release()
+        return Gst.StateChangeReturn.SUCCESS
+
+    def play_at(self, clock_time):
+        """
+        Lets the branch play, so the buffer it is holding back is mixed at `clock_time` on the shared clock (see
+        `pipeline.get_clock`), or as soon as possible after it if the branch has not prerolled by then
+        """
+        self.__attach()
+        with self.__lock:
+            self.__state = Gst.State.PLAYING
+            self.__play_at = clock_time
+            self.__start_time = None
+            self.__release()
+        return Gst.StateChangeReturn.SUCCESS
+
+    @property
+    def start_time(self):
+        """
+        :return: The time on the shared clock the branch started playing at, once it was started with `play_at` and
+                 its first buffer was mixed, otherwise `None`
+        """
+        with self.__lock:
+            return self.__start_time
+
+    @property
+    def state(self):
+        """
+        :return: The state of the branch, and `Gst.State.VOID_PENDING`: branches change state as soon as they are asked
+                 to. Never blocks, unlike `get_state`
+        """
+        with self.__lock:
+            return self.__state, Gst.State.VOID_PENDING
+
+    @property
+    def prerolled(self):
+        """
+        :return: Whether the branch is paused and holding back its first buffer, ready to be mixed. The owner's
+                 `on_state_changed` is called once it is. Never blocks
+        """
+        with self.__lock:
+            return self.__state == Gst.State.PAUSED and self.__held is not None
+
+    def get_state(self, timeout=Gst.CLOCK_TIME_NONE):
+        """
+        Waits for a branch that was added to the mix to preroll, and returns its state like `Gst.Element.get_state`
+        """
+        with self.__lock:
+            if self.__state == Gst.State.PAUSED and self.__held is None and self.__probe is not None:
+                wait = PREROLL_TIMEOUT if timeout == Gst.CLOCK_TIME_NONE else min(timeout / Gst.SECOND,
+                                                                                  PREROLL_TIMEOUT)
+                self.__lock.wait_for(lambda: self.__held is not None or self.__probe is None, wait)
+            return Gst.StateChangeReturn.SUCCESS, self.__state, Gst.State.VOID_PENDING
+
+    def seek(self, ms):
+        if self.__mixer_pad is None:
+            return False
+        return self.__src.send_event(Gst.Event.new_seek(1.0, Gst.Format.TIME,
+                                                        Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                                                        Gst.SeekType.SET, ms * Gst.MSECOND, Gst.SeekType.NONE, -1))
+
+    def query_position(self):
+        if self.__mixer_pad is None:
+            return 0
+        return int(self.__src.query_position(Gst.Format.TIME)[1] / Gst.MSECOND)
+
+    def query_duration(self):
+        if self.__mixer_pad is None:
+            return 0
+        return int(self.__src.query_duration(Gst.Format.TIME)[1] / Gst.MSECOND)
+
+    def reset(self):
+        """
+        Takes the branch out of the mix and detaches it from its owner
+        """
+        self.__generation += 1
+        self.owner = None
+        self.busy = False
+        self.__fader.cancel()
+        self.__detach()
+        self.__vol.set_property('volume', 1.0)
+        self.__pan.set_property('panorama', 0.0)
+
+    def destroy(self):
+        self.reset()
+
+    def __attach(self):
+        if self.__mixer_pad is not None:
+            return
+        with self.__lock:
+            self.__block()
+        self.__mixer_pad = self.__mixer.attach(self)
+
+    def __detach(self):
+        if self.__mixer_pad is None:
+            return
+        pad, self.__mixer_pad = self.__mixer_pad, None
+
+        # Stopping the branch unblocks its streaming thread, so the lock must not be held here
+        self.__bin.set_state(Gst.State.NULL)
+        self.__mixer.detach(self, pad)
+
+        with self.__lock:
+            self.__state = Gst.State.NULL
+            if self.__probe is not None:
+                self.__src.remove_probe(self.__probe)
+                self.__probe = None
+            self.__held = None
+            self.__play_at = None
+            self.__start_time = None
+            self.__lock.notify_all()
+        self.__src.set_offset(0)
+
+    def __block(self):
+        # Called with the lock held
+        if self.__probe is None:
+            self.__held = None
+            self.__probe = self.__src.add_probe(Gst.PadProbeType.BLOCK | Gst.PadProbeType.BUFFER, self.__on_blocked)
+
+    def __release(self):
+        # Called with the lock held. The held back buffer is released straight away. Without one, the probe releases
+        # the next buffer
+        if self.__probe is not None and self.__held is not None:
+            self.__align(self.__held)
+            self.__src.remove_probe(self.__probe)
+            self.__probe = None
+            self.__held = None
+
+    def __align(self, running_time):
+        # Called with the lock held. Mixes the buffer at `running_time` (of the branch) at the mixer's current running
+        # time, or at the time given to `play_at` if that is still ahead
+        mix_time = self.__mixer.running_time() + MIX_LATENCY * Gst.MSECOND
+        if self.__play_at is not None:
+            mix_time = max(mix_time, self.__play_at - self.__mixer.base_time())
+            self.__start_time = self.__mixer.base_time() + mix_time
+            self.__play_at = None
+        self.__src.set_offset(mix_time - running_time)
+
+    def __running_time(self, pad, pts):
+        event = pad.get_sticky_event(Gst.EventType.SEGMENT, 0)
+        if event is None or pts == Gst.CLOCK_TIME_NONE:
+            return 0
+        return event.parse_segment().to_running_time(Gst.Format.TIME, pts)
+
+    def __on_blocked(self, pad, info):
+        running_time = self.__running_time(pad, info.get_buffer().pts)
+        with self.__lock:
+            if self.__state == Gst.State.PLAYING:
+                self.__align(running_time)
+                self.__probe = None
+                return Gst.PadProbeReturn.REMOVE
+            prerolled = self.__held is None
+            self.__held = running_time
+            self.__lock.notify_all()
+        if prerolled:
+            GLib.idle_add(self.__on_prerolled, self.__generation)
+        return Gst.PadProbeReturn.OK
+
+    def __on_event(self, pad, info):
+        event = info.get_event()
+        if event.type == Gst.EventType.FLUSH_STOP:
+            # The running time of the branch starts over after a flushing seek, so it has to be aligned again
+            with self.__lock:
+                self.__block()
+        elif event.type == Gst.EventType.EOS:
+            GLib.idle_add(self.__on_eos, self.__generation)
+        return Gst.PadProbeReturn.OK
+
+    def __on_decoded_pad(self, element, pad):
+        name = pad.query_caps(None).to_string()
+        if name.startswith("audio/") and not self.__conv_sink.is_linked():
+            logger.debug("Linking Pad: {0}".format(name))
+            pad.link(self.__conv_sink)
+
+    def __on_eos(self, generation):
+        if self.owner is not None and generation == self.__generation:
+            self.owner.on_eos(None, None)
+        return False
+
+    def __on_prerolled(self, generation):
+        if self.owner is not None and generation == self.__generation:
+            self.owner.on_state_changed()
+        return False
+
+    def on_error(self, bus, message):
+        if self.owner is not None:
+            self.owner.on_error(bus, message)
+
+
+class Mixer(object):
+    """
+    The mixing pipeline, and the branches checked out of it. Has the same interface as `pipeline.PipelinePool`. The
+    pipeline is built when the first branch is added to it, and keeps running until `shutdown`
+
+    :param size: The number of idle branches to keep for reuse
+    """
+
+    def __init__(self, size=DEFAULT_IDLE_BRANCHES):
+        self.__size = max(0, size)
+        self.__idle = []
+        self.__used = {}
+        self.__attached = []
+
+        self.__pipeline = None
+        self.__mix = None
+        self.__bus = None
+
+    @property
+    def size(self):
+        return self.__size
+
+    @size.setter
+    def size(self, size):
+        self.__size = max(0, size)
+        del self.__idle[self.__size:]
+
+    @property
+    def checked_out(self):
+        return len(self.__used)
+
+    @property
+    def idle(self):
+        return len(self.__idle)
+
+    @property
+    def pipeline(self):
+        """
+        :return: The mixing pipeline, once it has been built
+        """
+        return self.__pipeline
+
+    def running_time(self):
+        """
+        :return: The running time of the mixing pipeline in nanoseconds
+        """
+        if self.__pipeline is None:
+            return 0
+        clock = self.__pipeline.get_clock()
+        return clock.get_time() - self.__pipeline.get_base_time() if clock is not None else 0
+
+    def base_time(self):
+        """
+        :return: The time on the shared clock (see `pipeline.get_clock`) the running time of the mixer counts from
+        """
+        return self.__pipeline.get_base_time() if self.__pipeline is not None else 0
+
+    def __build(self):
+        logger.debug("Building the mixing pipeline")
+        self.__pipeline = Gst.Pipeline.new('soundclip-mixer')
+        self.__pipeline.use_clock(get_clock())
+
+        silence = _make('audiotestsrc')
+        silence.set_property('is-live', True)
+        Gst.util_set_object_arg(silence, 'wave', 'silence')
+        caps = _make('capsfilter')
+        caps.set_property('caps', Gst.Caps.from_string(MIX_CAPS))
+        self.__mix = _make('audiomixer')
+        self.__mix.set_property('latency', MIX_LATENCY * Gst.MSECOND)
+        chain = [silence, caps, self.__mix, _make('audioconvert'), _make('audioresample'), _make('autoaudiosink')]
+        for e in chain:
+            self.__pipeline.add(e)
+        for a, b in zip(chain, chain[1:]):
+            a.link(b)
+
+        self.__bus = self.__pipeline.get_bus()
+        self.__bus.add_signal_watch()
+        self.__bus.connect('message::error', self.__on_error)
+
+        self.__pipeline.set_state(Gst.State.PLAYING)
+
+    def attach(self, branch):
+        """
+        Adds a branch to the mixing pipeline
+
+        :return: The mixer pad the branch is linked to
+        """
+        if self.__pipeline is None:
+            self.__build()
+
+        self.__pipeline.add(branch.bin)
+        pad = self.__mix.get_request_pad('sink_%u')
+        branch.bin.get_static_pad('src').link(pad)
+        branch.bin.sync_state_with_parent()
+        self.__attached.append(branch)
+        return pad
+
+    def detach(self, branch, pad):
+        """
+        Removes a stopped branch from the mixing pipeline, and releases its mixer pad
+        """
+        src = branch.bin.get_static_pad('src')
+        src.unlink(pad)
+        self.__mix.release_request_pad(pad)
+        self.__pipeline.remove(branch.bin)
+        if branch in self.__attached:
+            self.__attached.remove(branch)
+
+    def checkout(self, owner, uri):
+        """
+        Hands a branch playing `uri` to `owner`. The mixer never runs out of branches
+
+        :return: A `MixerBranch`, not yet part of the mix
+        """
+        b = self.__idle.pop() if self.__idle else MixerBranch(self)
+        b.owner = owner
+        b.point_at(uri)
+        self.__used[b] = owner
+        return b
+
+    def touch(self, b):
+        pass
+
+    def checkin(self, b):
+        """
+        Takes a branch out of the mix and keeps it for reuse, if there is room
+        """
+        if self.__used.pop(b, None) is None:
+            return
+        b.reset()
+        if len(self.__idle) < self.__size:
+            self.__idle.append(b)
+
+    def clear(self):
+        self.__idle = []
+
+    def shutdown(self):
+        """
+        Stops the mixing pipeline. Branches that are still checked out are taken out of the mix first
+        """
+        for b in list(self.__used.keys()):
+            b.reset()
+        self.__used = {}
+        self.__idle = []
+        if self.__pipeline is not None:
+            self.__pipeline.set_state(Gst.State.NULL)
+            self.__bus.remove_signal_watch()
+            self.__pipeline = None
+            self.__mix = None
+
+    def __on_error(self, bus, message):
+        for branch in self.__attached:
+            if message.src is branch.bin or message.src.has_as_ancestor(branch.bin):
+                branch.on_error(bus, message)
+                return
+        logger.error("GStreamer mixer error: {0}".format(message.parse_error()))
+
+
+def get_mixer():
+    """
+    :return: The mixer shared by every project using the mixer engine
+    """
+    global __MIXER
+    if __MIXER is None:
+        __MIXER = Mixer()
+    return __MIXER
@@ -0,0 +1,179 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A bounded LRU cache for parsed objects from the object store
+
+Entries are namespaced (by project root), so closing a project can drop just its objects. The cache can be bounded by
+entry count, by the size of the object text the entries were parsed from, or both. Once over budget, the least
+recently used entries are evicted first, regardless of the namespace they belong to.
+"""
+
+import threading
+from collections import OrderedDict
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+
+class CacheStats(object):
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.entries = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': self.entries,
+            'bytes': self.bytes
+        }
+
+    def __repr__(self):
+        return "CacheStats({0})".format(self.as_dict())
+
+
+class ObjectCache(object):
+    """
+    A thread-safe LRU cache keyed by `(namespace, key)`
+
+    :param max_entries: The maximum number of entries to hold, or `None` for no limit
+    :param max_bytes: The maximum total size of all entries, or `None` for no limit
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.__max_entries = max_entries
+        self.__max_bytes = max_bytes
+
+        self.__entries = OrderedDict()
+        self.__bytes = 0
+        self.__stats = {}
+        self.__lock = threading.RLock()
+
+    def __stats_for(self, namespace):
+        if namespace not in self.__stats:
+            self.__stats[namespace] = CacheStats()
+        return self.__stats[namespace]
+
+    def __len__(self):
+        return len(self.__entries)
+
+    def __contains__(self, item):
+        return item in self.__entries
+
+    def configure(self, max_entries=None, max_bytes=None):
+        """
+        Changes the budget of the cache, evicting entries immediately if the cache is now over budget
+        """
+        with self.__lock:
+            self.__max_entries = max_entries
+            self.__max_bytes = max_bytes
+            self.__evict()
+
+    def get(self, namespace, key):
+        """
+        :return: The cached object, or `None` if it is not in the cache
+        """
+        with self.__lock:
+            stats = self.__stats_for(namespace)
+            entry = self.__entries.get((namespace, key), None)
+            if entry is None:
+                stats.misses += 1
+                return None
+
+            self.__entries.move_to_end((namespace, key))
+            stats.hits += 1
+            return entry[0]
+
+    def put(self, namespace, key, obj, size=0):
+        """
+        Adds an object to the cache, replacing any existing entry for the same key
+
+        :param size: The cost of this entry against the byte budget (usually the length of the object text)
+        """
+        with self.__lock:
+            self.__remove(namespace, key)
+
+            stats = self.__stats_for(namespace)
+            self.__entries[(namespace, key)] = (obj, size)
+            self.__bytes += size
+            stats.entries += 1
+            stats.bytes += size
+
+            self.__evict()
+
+    def discard(self, namespace, key):
+        with self.__lock:
+            self.__remove(namespace, key)
+
+    def clear(self, namespace=None):
+        """
+        Drops all entries for the specified namespace, or every entry in the cache if no namespace is specified
+        """
+        with self.__lock:
+            if namespace is None:
+                self.__entries.clear()
+                self.__bytes = 0
+                self.__stats.clear()
+                return
+
+            for ns, key in [k for k in self.__entries.keys() if k[0] == namespace]:
+                self.__remove(ns, key)
+            self.__stats.pop(namespace, None)
+
+    def stats(self, namespace=None):
+        """
+        :return: The counters for the specified namespace, or totals for the whole cache if no namespace is specified
+        """
+        with self.__lock:
+            if namespace is not None:
+                s = CacheStats()
+                s.__dict__.update(self.__stats_for(namespace).__dict__)
+                return s
+
+            total = CacheStats()
+            for s in self.__stats.values():
+                total.hits += s.hits
+                total.misses += s.misses
+                total.evictions += s.evictions
+            total.entries = len(self.__entries)
+            total.bytes = self.__bytes
+            return total
+
+    def __remove(self, namespace, key):
+        entry = self.__entries.pop((namespace, key), None)
+        if entry is not None:
+            stats = self.__stats_for(namespace)
+            self.__bytes -= entry[1]
+            stats.entries -= 1
+            stats.bytes -= entry[1]
+        return entry
+
+    def __over_budget(self):
+        return (self.__max_entries is not None and len(self.__entries) > self.__max_entries) or \
+               (self.__max_bytes is not None and self.__bytes > self.__max_bytes)
+
+    def __evict(self):
+        while self.__entries and self.__over_budget():
+            (namespace, key), (obj, size) = self.__entries.popitem(last=False)
+            stats = self.__stats_for(namespace)
+            self.__bytes -= size
+            stats.entries -= 1
+            stats.bytes -= size
+            stats.evictions += 1
+            logger.debug("Evicted {0} from the object cache".format(key))
@@ -0,0 +1,328 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Packfiles for the SoundClip object store
+
+Loose objects cost an open and a stat each, which adds up quickly on large shows (especially on network mounted show
+drives). A packfile combines many objects into a single append-only file, with a sorted index of the object hashes next
+to it. Both files are mapped into memory, so finding an object is a binary search over the index and a slice of the
+pack:
+
+.soundclip/
+└── objects
+    └── pack
+        ├── objects.idx
+        └── objects.pack
+
+objects.pack: "SCPK" | version (u32) | object content...
+objects.idx:  "SCIX" | version (u32) | count (u32) | count * (sha1 (20 bytes) | offset (u64) | length (u32))
+
+Index entries are sorted by their binary sha1. The pack itself is only ever appended to, the index is rewritten and
+atomically swapped into place every time objects are added.
+
+Dropping objects from the pack (see `rewrite`) writes a complete new pack and index next to the old ones. Renaming the
+new index to objects.idx.swap is the commit point: if a crash interrupts the swap, `recover` finishes it the next time
+the pack is opened, otherwise the half written files are thrown away.
+"""
+
+import mmap
+import os
+import struct
+import logging
+logger = logging.getLogger('SoundClip')
+
+from SoundClip.exception import SCException
+
+
+class PackException(SCException):
+    pass
+
+
+PACK_DIR = 'pack'
+PACK_NAME = 'objects.pack'
+INDEX_NAME = 'objects.idx'
+
+_NEW_SUFFIX = '.new'
+_SWAP_SUFFIX = '.swap'
+
+_PACK_MAGIC = b'SCPK'
+_INDEX_MAGIC = b'SCIX'
+_VERSION = 1
+
+_PACK_HEADER = struct.Struct('>4sI')
+_INDEX_HEADER = struct.Struct('>4sII')
+_INDEX_ENTRY = struct.Struct('>20sQI')
+
+
+def pack_path(root):
+    return os.path.join(root, '.soundclip', 'objects', PACK_DIR)
+
+
+class PackFile(object):
+    """
+    A read-only, memory mapped view of a project's packfile and its index
+    """
+
+    def __init__(self, root):
+        self.__root = root
+        self.__pack_file = None
+        self.__index_file = None
+        self.__pack = None
+        self.__index = None
+        self.__count = 0
+        self.__inode = None
+
+        self.__open()
+
+    def __open(self):
+        recover(self.__root)
+
+        pack = os.path.join(pack_path(self.__root), PACK_NAME)
+        index = os.path.join(pack_path(self.__root), INDEX_NAME)
+
+        if not os.path.isfile(pack) or not os.path.isfile(index):
+            return
+
+        self.__pack_file = open(pack, 'rb')
+        self.__index_file = open(index, 'rb')
+
+        if os.fstat(self.__index_file.fileno()).st_size < _INDEX_HEADER.size or \
+                os.fstat(self.__pack_file.fileno()).st_size < _PACK_HEADER.size:
+            self.close()
+            raise PackException({
+                "message": "The packfile or its index is truncated",
+                "root": self.__root
+            })
+
+        self.__inode = os.fstat(self.__pack_file.fileno()).st_ino
+        self.__pack = mmap.mmap(self.__pack_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.__index = mmap.mmap(self.__index_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version = _PACK_HEADER.unpack_from(self.__pack, 0)
+        if magic != _PACK_MAGIC or version != _VERSION:
+            self.close()
+            raise PackException({"message": "Unrecognized packfile format", "root": self.__root})
+
+        magic, version, self.__count = _INDEX_HEADER.unpack_from(self.__index, 0)
+        if magic != _INDEX_MAGIC or version != _VERSION or \
+                len(self.__index) < _INDEX_HEADER.size + self.__count * _INDEX_ENTRY.size:
+            self.close()
+            raise PackException({"message": "Unrecognized or truncated pack index", "root": self.__root})
+
+        logger.debug("Opened packfile for {0} with {1} objects".format(self.__root, self.__count))
+
+    def close(self):
+        for m in (self.__pack, self.__index):
+            if m is not None:
+                m.close()
+        for f in (self.__pack_file, self.__index_file):
+            if f is not None:
+                f.close()
+        self.__pack = self.__index = self.__pack_file = self.__index_file = None
+        self.__count = 0
+
+    def __len__(self):
+        return self.__count
+
+    def __contains__(self, key):
+        return self.__find(key) is not None
+
+    def __entry(self, i):
+        return _INDEX_ENTRY.unpack_from(self.__index, _INDEX_HEADER.size + i * _INDEX_ENTRY.size)
+
+    def __find(self, key):
+        if self.__count == 0:
+            return None
+
+        try:
+            needle = bytes.fromhex(key)
+        except ValueError:
+            return None
+
+        lo, hi = 0, self.__count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            sha, offset, length = self.__entry(mid)
+            if sha < needle:
+                lo = mid + 1
+            elif sha > needle:
+                hi = mid
+            else:
+                return offset, length
+        return None
+
+    def get(self, key):
+        """
+        :param key: The hex sha1 of the object to look up
+        :return: The raw content of the object, or `None` if the object is not in this pack
+        """
+        entry = self.__find(key)
+        if entry is None:
+            return None
+        offset, length = entry
+        return self.__pack[offset:offset+length]
+
+    def stamp(self, key):
+        """
+        :param key: The hex sha1 of an object
+        :return: A string identifying where the object is stored in this pack, which changes if the object is ever
+                 written again. `None` if the object is not in this pack
+        """
+        entry = self.__find(key)
+        if entry is None:
+            return None
+        return "pack:{0}:{1}:{2}".format(self.__inode, entry[0], entry[1])
+
+    def keys(self):
+        for i in range(0, self.__count):
+            yield self.__entry(i)[0].hex()
+
+    def entries(self):
+        """
+        :return: An iterator of `(sha1, offset, length)` for every object in the pack, in index order
+        """
+        for i in range(0, self.__count):
+            sha, offset, length = self.__entry(i)
+            yield sha.hex(), offset, length
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def recover(root):
+    """
+    Finishes or rolls back a `rewrite` that was interrupted by a crash
+
+    :param root: The project root directory
+    """
+    path = pack_path(root)
+    pack = os.path.join(path, PACK_NAME)
+    index = os.path.join(path, INDEX_NAME)
+
+    if os.path.isfile(index + _SWAP_SUFFIX):
+        logger.warning("Finishing an interrupted pack rewrite in {0}".format(path))
+        if os.path.isfile(pack + _NEW_SUFFIX):
+            os.replace(pack + _NEW_SUFFIX, pack)
+        os.replace(index + _SWAP_SUFFIX, index)
+        fsync_dir(path)
+
+    for stale in (pack + _NEW_SUFFIX, index + _NEW_SUFFIX):
+        if os.path.isfile(stale):
+            logger.warning("Removing {0} from an interrupted pack rewrite".format(stale))
+            os.remove(stale)
+
+
+def __write_index(path, entries):
+    with open(path, 'wb') as f:
+        f.write(_INDEX_HEADER.pack(_INDEX_MAGIC, _VERSION, len(entries)))
+        for key in sorted(entries.keys()):
+            offset, length = entries[key]
+            f.write(_INDEX_ENTRY.pack(bytes.fromhex(key), offset, length))
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def append(root, objects, existing=None):
+    """
+    Appends objects to the project's packfile and atomically replaces its index
+
+    :param root: The project root directory
+    :param objects: An iterable of `(key, content)` tuples, where content is the raw (bytes) object content
+    :param existing: The currently open `PackFile` for this project, if any. Objects already in it are skipped
+    :return: the number of objects appended
+    """
+    path = pack_path(root)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    pack = os.path.join(path, PACK_NAME)
+    index = os.path.join(path, INDEX_NAME)
+
+    entries = {}
+    if existing is not None:
+        for key, offset, length in existing.entries():
+            entries[key] = (offset, length)
+
+    added = 0
+    with open(pack, 'ab') as f:
+        if f.tell() == 0:
+            f.write(_PACK_HEADER.pack(_PACK_MAGIC, _VERSION))
+
+        for key, content in objects:
+            if key in entries:
+                continue
+            entries[key] = (f.tell(), len(content))
+            f.write(content)
+            added += 1
+
+        f.flush()
+        os.fsync(f.fileno())
+
+    if added == 0 and os.path.isfile(index):
+        return 0
+
+    tmp = index + '.tmp'
+    __write_index(tmp, entries)
+
+    os.replace(tmp, index)
+    fsync_dir(path)
+
+    logger.info("Appended {0} objects to the packfile in {1}".format(added, path))
+    return added
+
+
+def rewrite(root, objects):
+    """
+    Replaces the project's packfile with one containing only the specified objects. The currently open `PackFile` for
+    the project must be closed once this returns, and the objects must not be read from it while they are written.
+
+    :param root: The project root directory
+    :param objects: An iterable of `(key, content)` tuples, where content is the raw (bytes) object content
+    :return: the number of objects in the new packfile
+    """
+    path = pack_path(root)
+    if not os.path.exists(path):
+        os.makedirs(path)
+
+    pack = os.path.join(path, PACK_NAME)
+    index = os.path.join(path, INDEX_NAME)
+
+    entries = {}
+    with open(pack + _NEW_SUFFIX, 'wb') as f:
+        f.write(_PACK_HEADER.pack(_PACK_MAGIC, _VERSION))
+        for key, content in objects:
+            if key in entries:
+                continue
+            entries[key] = (f.tell(), len(content))
+            f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+    __write_index(index + _NEW_SUFFIX, entries)
+
+    # Commit point, see `recover`
+    os.replace(index + _NEW_SUFFIX, index + _SWAP_SUFFIX)
+    fsync_dir(path)
+
+    os.replace(pack + _NEW_SUFFIX, pack)
+    os.replace(index + _SWAP_SUFFIX, index)
+    fsync_dir(path)
+
+    logger.info("Rewrote the packfile in {0} with {1} objects".format(path, len(entries)))
+    return len(entries)
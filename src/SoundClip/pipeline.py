@@ -0,0 +1,420 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Reusable GStreamer playback pipelines
+
+Building a pipeline opens a connection to the audio device and starts streaming threads, so playback controllers (see
+`audio.PlaybackController`) don't own one. They check a `PlaybackPipeline` out of the shared `PipelinePool` when their
+cue is armed or played, point its decoder at their file, and return it when the cue stops:
+
+uridecodebin -> audioconvert -> rgvolume -> audiopanorama -> volume -> autoaudiosink
+
+The pool keeps at most `size` pipelines. When every one of them is checked out, the one checked out longest ago that
+is not playing (a cue that was armed, but never played) is taken back from its controller. Playback is never refused:
+if every pipeline is playing, an extra one is built and torn down again once it is returned.
+
+Pipelines keep track of their state from the `state-changed` messages on their bus, so the state of a cue can be
+checked (see `PlaybackPipeline.state`) from the main loop as often as needed without waiting on the pipeline.
+
+Every pipeline runs on the same clock (see `get_clock`), so cues playing on different pipelines can be scheduled to
+start at the same moment with `PlaybackPipeline.play_at`, see `audio.GroupStart`.
+
+Pipelines belong to the main loop: the pool must only be used from the main thread.
+"""
+
+from collections import OrderedDict
+
+import gi
+gi.require_version('Gst', '1.0')
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, Gst
+
+from SoundClip import fades
+
+DEFAULT_POOL_SIZE = 8
+
+__POOL = None
+__CLOCK = None
+
+
+def get_clock():
+    """
+    :return: The clock every playback pipeline, and the mixer, runs on
+    """
+    global __CLOCK
+    if __CLOCK is None:
+        __CLOCK = Gst.SystemClock.obtain()
+    return __CLOCK
+
+
+class PlaybackPipeline(object):
+    """
+    A playback pipeline, and the controller it is checked out to. Bus messages are passed on to the controller's
+    `on_eos`, `on_error`, `on_drained` and `on_state_changed` handlers
+    """
+
+    def __init__(self):
+        self.owner = None
+        # Whether the owner is playing (or paused in the middle of) its cue, so the pipeline can't be taken back
+        self.busy = False
+        # Bumped every time the pipeline is returned, so messages meant for an earlier owner are dropped
+        self.__generation = 0
+        # The time on the shared clock playback was scheduled to start at by `play_at`
+        self.__start_time = None
+        # The state of the pipeline as last posted on its bus, and the state it was last asked to change to
+        self.__state = Gst.State.NULL
+        self.__target = Gst.State.NULL
+
+        self.__pipeline = Gst.Pipeline()
+        self.__pipeline.use_clock(get_clock())
+
+        # Messages are tagged with the generation they were posted in, and handled on the main loop. Messages posted for
+        # an earlier owner are dropped, even if they are only handled once the pipeline was checked out again
+        self.__bus = self.__pipeline.get_bus()
+        self.__bus.enable_sync_message_emission()
+        for name, handler in (('eos', self.__on_eos), ('error', self.__on_error),
+                              ('state-changed', self.__on_state_changed)):
+            self.__bus.connect('sync-message::' + name,
+                               lambda bus, message, h=handler: GLib.idle_add(h, self.__generation, message))
+
+        self.__dec = Gst.ElementFactory.make('uridecodebin', None)
+        self.__dec.connect('pad-added', self.__on_decoded_pad)
+        self.__dec.connect('drained', lambda *x: GLib.idle_add(self.__on_drained, self.__generation))
+        self.__conv = Gst.ElementFactory.make('audioconvert', None)
+        self.__conv_sink = self.__conv.get_static_pad('sink')
+        self.__rgvol = Gst.ElementFactory.make('rgvolume', None)
+        self.__pan = Gst.ElementFactory.make('audiopanorama', None)
+        self.__vol = Gst.ElementFactory.make('volume', None)
+        self.__sink = Gst.ElementFactory.make('autoaudiosink', None)
+
+        self.__pipeline.add(self.__dec)
+        self.__pipeline.add(self.__conv)
+        self.__pipeline.add(self.__rgvol)
+        self.__pipeline.add(self.__pan)
+        self.__pipeline.add(self.__vol)
+        self.__pipeline.add(self.__sink)
+
+        self.__conv.link(self.__rgvol)
+        self.__rgvol.link(self.__pan)
+        self.__pan.link(self.__vol)
+        self.__vol.link(self.__sink)
+
+        self.__fader = fades.Fader(self.__vol)
+
+    @property
+    def uri(self):
+        return self.__dec.get_property('uri')
+
+    def point_at(self, uri):
+        """
+        Stops the pipeline and swaps the file it plays
+        """
+        self.__set_state(Gst.State.NULL)
+        self.__dec.set_property('uri', uri)
+
+    @property
+    def volume(self):
+        return self.__vol.get_property('volume')
+
+    @volume.setter
+    def volume(self, v):
+        self.__fader.cancel()
+        self.__vol.set_property('volume', v)
+
+    @property
+    def fading(self):
+        return self.__fader.fading
+
+    def fade(self, target, duration, shape=fades.LINEAR, callback=None):
+        """
+        Fades the volume to `target` over the next `duration` milliseconds of the file, see `fades.Fader`
+
+        :param callback: Called once the fade is complete. Not called if the fade is cancelled, or the pipeline is reset
+        """
+        # Where the volume element is, rather than the sink, which lags behind it
+        position = self.__fader.position
+        if position is None:
+            position = max(0, self.query_position()) * Gst.MSECOND
+        self.__fader.start(self.volume, target, position, duration * Gst.MSECOND, shape, callback)
+
+    @property
+    def pan(self):
+        return self.__pan.get_property('panorama')
+
+    @pan.setter
+    def pan(self, p):
+        self.__pan.set_property('panorama', max(min(p, 1.0), -1.0))
+
+    def set_state(self, state):
+        self.__restore_start_time()
+        if state == Gst.State.PLAYING:
+            self.__start_time = None
+        return self.__set_state(state)
+
+    def __set_state(self, state):
+        self.__target = state
+        ret = self.__pipeline.set_state(state)
+        if ret == Gst.StateChangeReturn.SUCCESS:
+            self.__state = state
+        elif ret == Gst.StateChangeReturn.FAILURE:
+            self.__target = self.__state
+        return ret
+
+    def play_at(self, clock_time):
+        """
+        Starts playing so the position the pipeline is paused at is played at `clock_time` on the shared clock, rather
+        than as soon as the pipeline gets to `PLAYING`. The pipeline should be prerolled first
+
+        :param clock_time: The time on the shared clock (see `get_clock`) in nanoseconds
+        """
+        self.__restore_start_time()
+        prerolled = self.prerolled
+        # The running time the pipeline is paused at, which is played at the base time plus that running time
+        paused_at = self.__pipeline.get_start_time()
+        self.__pipeline.set_start_time(Gst.CLOCK_TIME_NONE)
+        self.__pipeline.set_base_time(clock_time - paused_at)
+
+        if prerolled:
+            self.__start_time = clock_time
+        else:
+            # Not prerolled, so the first buffer may only arrive after the moment it was meant to be played at
+            self.__start_time = None
+            self.__vol.get_static_pad('src').add_probe(Gst.PadProbeType.BUFFER, self.__on_first_buffer,
+                                                       self.__generation, clock_time)
+        return self.__set_state(Gst.State.PLAYING)
+
+    @property
+    def start_time(self):
+        """
+        :return: The time on the shared clock the pipeline started playing at, once it was started with `play_at` and
+                 its first buffer was ready, otherwise `None`
+        """
+        return self.__start_time
+
+    def __restore_start_time(self):
+        # `play_at` stops the pipeline from picking its own base time, it has to again once the pipeline is paused,
+        # seeked or stopped
+        if self.__pipeline.get_start_time() == Gst.CLOCK_TIME_NONE:
+            self.__pipeline.set_start_time(0)
+
+    def __on_first_buffer(self, pad, info, generation, clock_time):
+        if generation == self.__generation:
+            self.__start_time = max(clock_time, get_clock().get_time())
+        return Gst.PadProbeReturn.REMOVE
+
+    @property
+    def state(self):
+        """
+        :return: The state the pipeline is in, and the state it is changing to (`Gst.State.VOID_PENDING` if it is not
+                 changing state). Never blocks, unlike `get_state`
+        """
+        return self.__state, self.__target if self.__target != self.__state else Gst.State.VOID_PENDING
+
+    @property
+    def prerolled(self):
+        """
+        :return: Whether the pipeline is paused and ready to play, as posted on its bus. Never blocks
+        """
+        return self.__state == Gst.State.PAUSED and self.__target == Gst.State.PAUSED
+
+    def get_state(self, timeout=Gst.CLOCK_TIME_NONE):
+        """
+        Waits for the pipeline to finish changing state, like `Gst.Element.get_state`, and brings `state` up to date
+        without waiting for the bus. Blocks for as long as `timeout`
+        """
+        ret, state, pending = self.__pipeline.get_state(timeout)
+        if ret == Gst.StateChangeReturn.SUCCESS:
+            self.__state = state
+        elif ret == Gst.StateChangeReturn.FAILURE:
+            self.__target = self.__state
+        return ret, state, pending
+
+    def seek(self, ms):
+        self.__restore_start_time()
+        return self.__pipeline.seek_simple(Gst.Format.TIME, Gst.SeekFlags.FLUSH | Gst.SeekFlags.KEY_UNIT,
+                                           ms * Gst.MSECOND)
+
+    def query_position(self):
+        """
+        :return: The playback position in milliseconds
+        """
+        return int(self.__pipeline.query_position(Gst.Format.TIME)[1] / Gst.MSECOND)
+
+    def query_duration(self):
+        """
+        :return: The duration of the file in milliseconds, once the pipeline is prerolled
+        """
+        return int(self.__pipeline.query_duration(Gst.Format.TIME)[1] / Gst.MSECOND)
+
+    def reset(self):
+        """
+        Stops the pipeline and detaches it from its owner
+        """
+        self.__generation += 1
+        self.owner = None
+        self.busy = False
+        self.__fader.cancel()
+        self.__start_time = None
+        self.__restore_start_time()
+        self.__set_state(Gst.State.NULL)
+        self.__vol.set_property('volume', 1.0)
+        self.__pan.set_property('panorama', 0.0)
+
+    def destroy(self):
+        self.reset()
+        self.__bus.disable_sync_message_emission()
+
+    def __on_decoded_pad(self, element, pad):
+        name = pad.query_caps(None).to_string()
+        if name.startswith("audio/") and not self.__conv_sink.is_linked():
+            logger.debug("Linking Pad: {0}".format(name))
+            pad.link(self.__conv_sink)
+
+    def __on_eos(self, generation, message):
+        if self.owner is not None and generation == self.__generation:
+            self.owner.on_eos(self.__bus, message)
+        return False
+
+    def __on_error(self, generation, message):
+        if generation != self.__generation:
+            return False
+        # The state change the pipeline was going through won't complete
+        self.__target = self.__state
+        if self.owner is not None:
+            self.owner.on_error(self.__bus, message)
+        return False
+
+    def __on_state_changed(self, generation, message):
+        if message.src != self.__pipeline or generation != self.__generation:
+            return False
+        old, new, pending = message.parse_state_changed()
+        self.__state = new
+        if self.owner is not None and pending == Gst.State.VOID_PENDING:
+            self.owner.on_state_changed()
+        return False
+
+    def __on_drained(self, generation):
+        if self.owner is not None and generation == self.__generation:
+            self.owner.on_drained()
+        return False
+
+
+class PipelinePool(object):
+    """
+    A bounded set of playback pipelines shared by every playback controller
+
+    :param size: The number of pipelines to keep
+    """
+
+    def __init__(self, size=DEFAULT_POOL_SIZE):
+        self.__size = max(1, size)
+        self.__idle = []
+        # Checked out pipelines, in the order they were checked out or last played in
+        self.__used = OrderedDict()
+
+    @property
+    def size(self):
+        return self.__size
+
+    @size.setter
+    def size(self, size):
+        self.__size = max(1, size)
+        while self.__idle and len(self.__idle) + len(self.__used) > self.__size:
+            self.__idle.pop().destroy()
+
+    @property
+    def checked_out(self):
+        return len(self.__used)
+
+    @property
+    def idle(self):
+        return len(self.__idle)
+
+    def checkout(self, owner, uri):
+        """
+        Hands a pipeline playing `uri` to `owner`. When the pool is exhausted, a pipeline that is not busy is taken
+        back from its owner first, which is told through its `on_pipeline_reclaimed` method
+
+        :param owner: The playback controller to check the pipeline out to
+        :param uri: The file to play
+        :return: A `PlaybackPipeline`, stopped
+        """
+        if self.__idle:
+            p = self.__idle.pop()
+        elif len(self.__used) < self.__size:
+            logger.debug("Building playback pipeline {0} of {1}".format(len(self.__used) + 1, self.__size))
+            p = PlaybackPipeline()
+        else:
+            p = next((p for p in self.__used if not p.busy), None)
+            if p is not None:
+                previous = self.__used.pop(p)
+                logger.debug("Reclaiming the playback pipeline of {0}".format(p.uri))
+                previous.on_pipeline_reclaimed()
+                p.reset()
+            else:
+                logger.warning("All {0} playback pipelines are playing, building another one".format(self.__size))
+                p = PlaybackPipeline()
+
+        p.owner = owner
+        p.point_at(uri)
+        self.__used[p] = owner
+        return p
+
+    def touch(self, p):
+        """
+        Marks a pipeline as recently used, so it is the last to be taken back
+        """
+        if p in self.__used:
+            self.__used.move_to_end(p)
+
+    def checkin(self, p):
+        """
+        Returns a pipeline to the pool. Pipelines the pool has no room for are torn down
+        """
+        if self.__used.pop(p, None) is None:
+            return
+        if len(self.__idle) + len(self.__used) < self.__size:
+            p.reset()
+            self.__idle.append(p)
+        else:
+            p.destroy()
+
+    def clear(self):
+        """
+        Tears down every pipeline that is not checked out
+        """
+        for p in self.__idle:
+            p.destroy()
+        self.__idle = []
+
+
+def get_pool():
+    """
+    :return: The pipeline pool shared by every playback controller
+    """
+    global __POOL
+    if __POOL is None:
+        __POOL = PipelinePool()
+    return __POOL
+
+
+def set_pool(pool):
+    """
+    Replaces the shared pipeline pool, for example with a bigger one
+    """
+    global __POOL
+    __POOL = pool
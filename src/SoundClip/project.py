@@ -13,17 +13,20 @@
 
 import json
 import os
+import threading
 
 import logging
 logger = logging.getLogger('SoundClip')
 
 from enum import Enum
-from gi.repository import GObject
+from gi.repository import GLib, GObject
 from logging.handlers import RotatingFileHandler
 
-from SoundClip.cue import CueStack
+from SoundClip import audio, cuetree, history, journal, storage
+from SoundClip.cue import AudioCue, CueStack, CueIdentityMap
 from SoundClip.exception import SCException
 from SoundClip.util import sha
+from SoundClip.verify import Verifier
 
 
 class ProjectParserException(SCException):
@@ -40,10 +43,102 @@ class StackChangeAction(Enum):
     DELETE = 2
 
 
+class ProjectSnapshot(object):
+    """
+    An immutable capture of everything that needs to be written for a save. Taking the snapshot only copies state
+    (on the main thread), `write` does the hashing and disk I/O and may run on a worker thread, and `apply` reports the
+    new hashes back to the cues and stacks (on the main thread again).
+
+    Every save that changes the project also stores the project itself as an object, chained to the previous version
+    of the project, and records the new objects in the history index (see `SoundClip.history`).
+
+    :param root: The project root directory
+    :param d: The serialized project, which may reference pending objects
+    :param current_hash: The hash of the project revision the snapshot was taken from
+    :param checkpoint: Only store the project revision as an object, without updating project.json or recording it in
+                       the history index (see `SoundClip.journal`)
+    """
+
+    def __init__(self, root, d, current_hash=None, checkpoint=False):
+        self.__root = root
+        self.__d = d
+        self.__current_hash = current_hash
+        self.__checkpoint = checkpoint
+        self.__results = []
+        self.__stacks = None
+        self.__revision = None
+
+    @property
+    def root(self):
+        return self.__root
+
+    @property
+    def stacks(self):
+        """
+        :return: The hashes of the project's cue stacks, once the snapshot has been written
+        """
+        return self.__stacks
+
+    @property
+    def revision(self):
+        """
+        :return: The hash of the project revision, once the snapshot has been written
+        """
+        return self.__revision
+
+    @property
+    def checkpoint(self):
+        return self.__checkpoint
+
+    def __previous(self, d):
+        """
+        :return: The stored revision the snapshot was taken from, if the snapshot is identical to it
+        """
+        if not self.__current_hash or not storage.exists(self.__root, self.__current_hash):
+            return None
+        previous = storage.read(self.__root, self.__current_hash)
+        return previous if {k: v for k, v in previous.items() if k != 'previousRevision'} == d else None
+
+    def write(self):
+        self.__results = []
+        created = False
+        with storage.Transaction(self.__root) as tx:
+            d = storage.resolve(tx, self.__d, self.__results)
+            previous = self.__previous(d)
+            if previous is not None:
+                # project.json may still point at another revision after the project was reverted
+                self.__revision = self.__current_hash
+                if not self.__checkpoint:
+                    tx.write_project(dict(previous))
+            else:
+                d['previousRevision'] = self.__current_hash or ''
+                self.__revision, last = tx.write(dict(d), self.__current_hash or '')
+                if not self.__checkpoint:
+                    tx.write_project(d)
+                    created = True
+            written = tx.written
+        self.__stacks = d['stacks']
+
+        # A save that rewrites project.json with a revision that was only checkpointed before still has to be recorded
+        index = history.get(self.__root)
+        recorded = created or (not self.__checkpoint and self.__revision not in set(k for t, k in index.revisions()))
+        index.record(written, revision=self.__revision if recorded else None)
+
+        logger.debug("Wrote {0} objects for {1}".format(len(self.__results), self.__root))
+
+    def apply(self):
+        for pending in self.__results:
+            pending.apply()
+
+
 class Project(GObject.GObject):
 
     __gsignals__ = {
-        'stack-changed': (GObject.SIGNAL_RUN_FIRST, None, (int, GObject.TYPE_PYOBJECT))
+        'stack-changed': (GObject.SIGNAL_RUN_FIRST, None, (int, GObject.TYPE_PYOBJECT)),
+        'saved': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT)),
+        'reverted': (GObject.SIGNAL_RUN_FIRST, None, (str, )),
+        'checksum-mismatch': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, )),
+        'cue-changed': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, GObject.TYPE_PYOBJECT))
     }
 
     __MAX_LOG_COUNT__ = 5
@@ -55,10 +150,19 @@ class Project(GObject.GObject):
     current_hash = GObject.property(type=str)
     last_hash = GObject.property(type=str)
     max_duration_discovery_difference = GObject.property(type=GObject.TYPE_LONG)
+    lazy_load = GObject.property(type=bool, default=False)
+    object_codec = GObject.property(type=str)
+    verify_policy = GObject.property(type=str, default=storage.VerifyPolicy.INLINE.value)
+    storage_backend = GObject.property(type=str)
+    journal_edits = GObject.property(type=bool, default=True)
+    audio_engine = GObject.property(type=str)
 
     def __init__(self, name="Untitled Project", creator="", root="", panic_fade_time=500, panic_hard_stop_time=1000,
-                 cue_stacks=None, current_hash=None, last_hash=None, max_duration_discovery_difference=5):
+                 cue_stacks=None, current_hash=None, last_hash=None, max_duration_discovery_difference=5,
+                 lazy_load=False, object_codec="", verify_policy=storage.VerifyPolicy.INLINE.value, storage_backend="",
+                 journal_edits=True, audio_engine=""):
         GObject.GObject.__init__(self)
+        self.cue_map = CueIdentityMap()
         self.name = name
         self.creator = creator
         self.__root = root
@@ -68,11 +172,25 @@ class Project(GObject.GObject):
         self.current_hash = current_hash
         self.last_hash = last_hash
         self.max_duration_discovery_difference = max_duration_discovery_difference
+        self.lazy_load = lazy_load
+        self.object_codec = object_codec
+        self.verify_policy = verify_policy
+        self.storage_backend = storage_backend
+        self.journal_edits = journal_edits
+        self.audio_engine = audio_engine
+        self.__verifier = None
+        self.__journal = None
         self.__dirty = True
+        self.__saving = False
+        # The callbacks of the saves that are queued behind the one running, `None` if none is queued
+        self.__save_queued = None
 
         self.__logfile_handler = None
 
         self.init_logfile()
+        self.configure_storage()
+
+        self.connect('notify::audio-engine', self.__on_audio_engine_changed)
 
     def __iadd__(self, other):
         if not isinstance(other, CueStack):
@@ -89,7 +207,7 @@ class Project(GObject.GObject):
             raise ValueError("{0} isn't in this project".format(other))
 
         key = self.cue_stacks.index(other)
-        self.cue_stacks.remove(key)
+        del self.cue_stacks[key]
 
         self.emit('stack-changed', key, StackChangeAction.DELETE)
 
@@ -115,6 +233,57 @@ class Project(GObject.GObject):
     def root(self):
         return self.__root
 
+    @property
+    def journal(self):
+        """
+        :return: The edit journal of the project, once it has been loaded or saved with `journal_edits` enabled
+        """
+        return self.__journal
+
+    def __open_journal(self, saved, replay=True):
+        if self.__journal is not None or not self.__root or not self.journal_edits:
+            return 0
+        self.__journal = journal.Journal(self)
+        return self.__journal.open(saved, replay=replay)
+
+    @property
+    def verifier(self):
+        """
+        :return: The background verifier of the project, if it uses the deferred verify policy
+        """
+        return self.__verifier
+
+    def __on_audio_engine_changed(self, project, pspec):
+        engine = audio.get_engine(self.audio_engine)
+        for stack in self.cue_stacks:
+            for cue in stack.loaded():
+                if isinstance(cue, AudioCue):
+                    cue.set_audio_engine(engine)
+
+    def configure_storage(self):
+        """
+        Applies the project's storage backend, object codec and verify policy to its object store. Projects that were
+        already stored with another backend keep using it (see `storage.migrate`)
+        """
+        if not self.__root:
+            return
+
+        b = storage.set_backend(self.__root, self.storage_backend or None)
+        if self.storage_backend and b.name != self.storage_backend:
+            self.storage_backend = b.name
+        storage.set_codec(self.__root, self.object_codec)
+
+        try:
+            policy = storage.VerifyPolicy(self.verify_policy)
+        except ValueError:
+            logger.warning("Unknown verify policy {0}, verifying inline".format(self.verify_policy))
+            policy = storage.VerifyPolicy.INLINE
+
+        if policy is storage.VerifyPolicy.DEFERRED and self.__verifier is None:
+            self.__verifier = Verifier(self.__root)
+            self.__verifier.connect('checksum-mismatch', lambda v, ex: self.emit('checksum-mismatch', ex))
+        storage.set_verify_policy(self.__root, policy, self.__verifier)
+
     def change_root(self, path):
         logger.debug("Current Root: {0}".format(self.__root))
         if self.__root and self.__root != path:
@@ -151,10 +320,13 @@ class Project(GObject.GObject):
             self.__logfile_handler = None
 
     def add_cuelist(self, other):
+        self.insert_cuelist(len(self.cue_stacks), other)
+
+    def insert_cuelist(self, i, other):
         if not isinstance(other, CueStack):
             raise TypeError("Can't add type {0} to Project".format(type(other)))
-        self.cue_stacks.append(other)
-        self.emit('stack-changed', len(self.cue_stacks)-1, StackChangeAction.INSERT)
+        self.cue_stacks.insert(i, other)
+        self.emit('stack-changed', i, StackChangeAction.INSERT)
 
     def remove_cuelist(self, other):
         if not isinstance(other, CueStack):
@@ -163,7 +335,7 @@ class Project(GObject.GObject):
             raise ValueError("{0} isn't in this project".format(other))
 
         key = self.cue_stacks.index(other)
-        self.cue_stacks.remove(key)
+        del self.cue_stacks[key]
 
         self.emit('stack-changed', key, StackChangeAction.DELETE)
 
@@ -181,61 +353,315 @@ class Project(GObject.GObject):
     def close(self):
         for stack in self.cue_stacks:
             stack.stop_all()
+            for cue in stack.loaded():
+                cue.release()
+        self.cue_map.clear()
+
+        if self.__journal is not None:
+            # Closing a project discards its unsaved changes, the journal is only replayed after a crash
+            self.__journal.close()
+            self.__journal = None
+
+        if self.__root:
+            storage.forget(self.__root)
+            history.forget(self.__root)
 
         self.close_logfile()
 
         # TODO: Save project to disk if new
 
     @staticmethod
-    def load(path):
-        if not os.path.isdir(os.path.join(path, ".soundclip")):
+    def __settings(j):
+        return {
+            'name': j['name'] if 'name' in j else "Untitled Project",
+            'creator': j['creator'] if 'creator' in j else "",
+            'panic_fade_time': j['panicFadeTime'] if 'panicFadeTime' in j else 500,
+            'panic_hard_stop_time': j['panicHardStopTime'] if 'panicHardStopTime' in j else 1000,
+            'max_duration_discovery_difference': j['discoveryEpsilon'] if 'discoveryEpsilon' in j else 5,
+            'last_hash': j['previousRevision'] if 'previousRevision' in j else None,
+            'lazy_load': bool(j['lazyLoad']) if 'lazyLoad' in j else False,
+            'object_codec': j['objectCodec'] if 'objectCodec' in j else "",
+            'verify_policy': j['verifyPolicy'] if 'verifyPolicy' in j else storage.VerifyPolicy.INLINE.value,
+            'storage_backend': j['storageBackend'] if 'storageBackend' in j else "",
+            'journal_edits': bool(j['journalEdits']) if 'journalEdits' in j else True,
+            'audio_engine': j['audioEngine'] if 'audioEngine' in j else ""
+        }
+
+    @staticmethod
+    def load(path, lazy=None, revision=None):
+        """
+        Loads a project from disk
+
+        :param path: The project root directory
+        :param lazy: Whether to only load the cue stack indices and load cues on first access. Defaults to the
+                     project's `lazy_load` setting
+        :param revision: The hash of an earlier revision of the project to load (see `SoundClip.history`) instead of
+                         the last saved one. The edit journal is only replayed when the last saved revision is loaded
+        """
+        content = storage.read_project(path)
+        if content is None:
             raise FileNotFoundError("Path does not exist or not a soundclip project")
 
-        with open(os.path.join(path, ".soundclip", "project.json"), "rt") as dbobj:
-            content = dbobj.read()
+        storage.cleanup(path)
 
-        if not content:
-            raise ProjectParserException({
-                "message": "The project is corrupted (project.json was empty)!",
-                "path": path
-            })
+        if revision is None:
+            if not content.strip():
+                raise ProjectParserException({
+                    "message": "The project is corrupted (project.json was empty)!",
+                    "path": path
+                })
+
+            j = json.loads(content)
+
+            # Projects saved before project revisions were stored as objects have no revision to point back to
+            current_hash = sha(content.strip())
+            if not storage.exists(path, current_hash):
+                current_hash = None
+            saved = current_hash
 
-        j = json.loads(content)
+            # Unsaved edits are replayed on top of the last checkpoint, see `SoundClip.journal`
+            checkpoint = journal.recovery_base(path, saved)
+            if checkpoint is not None:
+                j = Project.__read_revision(path, checkpoint)
+                current_hash = checkpoint
+        else:
+            j = Project.__read_revision(path, revision)
+            current_hash = revision
 
-        name = j['name'] if 'name' in j else "Untitled Project"
-        creator = j['creator'] if 'creator' in j else ""
-        panic_fade_time = j['panicFadeTime'] if 'panicFadeTime' in j else 500
-        panic_hard_stop_time = j['panicHardStopTime'] if 'panicHardStopTime' in j else 1000
-        eps = j['discoveryEpsilon'] if 'discoveryEpsilon' in j else 5
-        last_hash = j['previousRevision'] if 'previousRevision' in j else None
+        settings = Project.__settings(j)
+        lazy = settings['lazy_load'] if lazy is None else lazy
 
-        p = Project(name=name, creator=creator, root=path, cue_stacks=[], panic_fade_time=panic_fade_time,
-                    panic_hard_stop_time=panic_hard_stop_time, current_hash=sha(content), last_hash=last_hash,
-                    max_duration_discovery_difference=eps)
+        p = Project(root=path, cue_stacks=[], current_hash=current_hash, **settings)
 
         if 'stacks' in j:
+            objects = Project.__prefetch(path, j['stacks'], cues=not lazy)
             for key in j['stacks']:
-                p += CueStack.load(path, key, p)
+                p += CueStack.load(path, key, p, objects=objects, lazy=lazy)
+
+        storage.get_verified(path).flush()
+
+        # The top of every cue stack is played first, so its media is discovered first
+        for stack in p.cue_stacks:
+            stack.standby(0)
 
+        if revision is None:
+            p.__open_journal(saved)
         return p
 
-    def store(self):
+    @staticmethod
+    def __read_revision(path, revision):
+        j = storage.read(path, revision)
+        if j.get('type', None) != 'project':
+            raise ProjectParserException({
+                "message": "{0} is not a project revision".format(revision),
+                "path": path,
+                "revision": revision
+            })
+        return j
+
+    def revert_to(self, revision):
+        """
+        Replaces the cue stacks and settings of the project with those of an earlier revision, in place. Cues that are
+        the same in both revisions (and have not been changed since) are kept as they are, everything else is read
+        from the object store in a single prefetch pass. Unsaved changes are discarded.
+
+        :param revision: The hash of the project revision to revert to (see `SoundClip.history`)
+        """
+        j = Project.__read_revision(self.__root, revision)
+        settings = Project.__settings(j)
+
+        if self.__journal is not None:
+            self.__journal.detach()
+
+        shared = CueIdentityMap()
+        old = []
+        for stack in self.cue_stacks:
+            stack.stop_all()
+            stack.detach()
+            for cue in stack.loaded():
+                old.append(cue)
+                if cue.current_hash and not cue.needs_store():
+                    shared.adopt(cue.current_hash, cue)
+
+        lazy = self.lazy_load
+        objects = Project.__prefetch(self.__root, j.get('stacks', []), cues=not lazy)
+
+        self.cue_map = shared
+        stacks = [CueStack.load(self.__root, key, self, objects=objects, lazy=lazy) for key in j.get('stacks', [])]
+
+        kept = set(id(cue) for stack in stacks for cue in stack.loaded())
+        for cue in old:
+            if id(cue) not in kept:
+                cue.release()
+
+        for k, v in settings.items():
+            setattr(self, k, v)
+        self.cue_stacks = stacks
+        self.current_hash = revision
+
+        if self.__journal is not None:
+            self.__journal.reset(revision)
+
+        logger.info("Reverted {0} to {1}, {2} of {3} loaded cues were kept".format(
+            self.name, revision, len(kept.intersection(id(cue) for cue in old)), len(old)
+        ))
+        self.emit('reverted', revision)
+
+    def revert_to_time(self, timestamp):
+        """
+        Reverts the project to the last revision saved at or before the specified time (see `revert_to`)
+
+        :param timestamp: A unix timestamp
+        :return: The hash of the revision the project was reverted to, or `None` if there was no revision saved yet
+        """
+        revision = history.get(self.__root).revision_at(timestamp)
+        if revision is not None:
+            self.revert_to(revision)
+        return revision
+
+    def revisions(self):
+        """
+        :return: Every saved revision of the project as `(timestamp, hash)`, oldest first
+        """
+        return history.get(self.__root).revisions() if self.__root else []
+
+    @staticmethod
+    def __prefetch(path, stacks, cues=True):
+        """
+        Reads every object the project references in parallel, one level of the object graph at a time: first the
+        cue stacks and their cue trees, then their cues, and finally the cues referenced by control cues.
+
+        :param cues: Whether to read the cues, or just the cue stacks and their trees
+        :return: A dictionary of hash to parsed object
+        """
+        objects = storage.prefetch(path, stacks)
+        cuetree.prefetch(path, [objects[stack].get('tree', None) for stack in stacks], objects)
+        if not cues:
+            return objects
+
+        keys = []
+        for stack in stacks:
+            j = objects[stack]
+            keys.extend(cuetree.load(path, j['tree'], objects)[0] if 'tree' in j else j.get('cues', []))
+
+        objects.update(storage.prefetch(path, [key for key in keys if key not in objects]))
+
+        refs = [objects[key]['target'].get('ref', None) for key in keys
+                if objects[key].get('type', None) == 'control' and isinstance(objects[key].get('target', None), dict)]
+        objects.update(storage.prefetch(path, [key for key in refs if key and key not in objects]))
+
+        logger.debug("Prefetched {0} objects for {1}".format(len(objects), path))
+        return objects
+
+    def snapshot(self, checkpoint=False):
+        """
+        Captures the serializable state of the project. Must be called from the main thread.
+
+        :param checkpoint: Whether the snapshot is a journal checkpoint rather than a save (see `ProjectSnapshot`)
+        :return: A `ProjectSnapshot` that can be written from any thread
+        """
         if not self.__root:
             raise IllegalProjectStateException({
                 "message": "Projects must have a root before they can be saved"
             })
 
-        if not os.path.exists(self.__root) or not os.path.isdir(self.__root):
-            os.makedirs(self.__root)
+        d = {'type': 'project', 'name': self.name, 'creator': self.creator, 'stacks': [],
+             'panicFadeTime': self.panic_fade_time, 'panicHardStopTime': self.panic_hard_stop_time,
+             'discoveryEpsilon': self.max_duration_discovery_difference, 'lazyLoad': self.lazy_load,
+             'objectCodec': self.object_codec, 'verifyPolicy': self.verify_policy,
+             'storageBackend': self.storage_backend, 'journalEdits': self.journal_edits,
+             'audioEngine': self.audio_engine}
 
-        d = {'name': self.name, 'creator': self.creator, 'stacks': [], 'panicFadeTime': self.panic_fade_time,
-             'panicHardStopTime': self.panic_hard_stop_time, 'discoveryEpsilon': self.max_duration_discovery_difference}
+        self.configure_storage()
 
+        memo = {}
         for stack in self.cue_stacks:
-            d['stacks'].append(stack.store(self.__root))
+            d['stacks'].append(stack.snapshot(memo))
 
-        with open(os.path.join(self.__root, '.soundclip', 'project.json'), 'w') as f:
-            json.dump(d, f)
-            f.write("\n")
+        return ProjectSnapshot(self.__root, d, self.current_hash, checkpoint=checkpoint)
 
-        logger.info("Project {0} saved to {1}".format(self.name, self.__root))
\ No newline at end of file
+    @property
+    def saving(self):
+        return self.__saving
+
+    def __on_stored(self, snapshot, seq):
+        snapshot.apply()
+        if snapshot.revision != self.current_hash:
+            self.current_hash, self.last_hash = snapshot.revision, self.current_hash
+
+        if self.__journal is not None:
+            self.__journal.checkpointed(seq, snapshot.revision, saved=not snapshot.checkpoint)
+        elif not snapshot.checkpoint:
+            self.__open_journal(snapshot.revision, replay=False)
+
+    def __journal_seq(self):
+        return self.__journal.seq if self.__journal is not None else 0
+
+    def store(self):
+        seq = self.__journal_seq()
+        snapshot = self.snapshot()
+        snapshot.write()
+        self.__on_stored(snapshot, seq)
+
+        logger.info("Project {0} saved to {1}".format(self.name, self.__root))
+
+    def store_async(self, callback=None, checkpoint=False):
+        """
+        Saves the project without blocking the main loop. The project is captured immediately, hashing and writing
+        happen on a worker thread. When the save finishes, the `saved` signal is emitted (and `callback` is called)
+        on the main thread with the stack hashes that were written and the exception that stopped the save, if any.
+
+        If a save is already running, another one is started as soon as it finishes. Saves queued in the meantime are
+        coalesced into that one, and all of their callbacks are called when it finishes.
+
+        :param callback: called with `(project, stack_hashes, error)`
+        :param checkpoint: Only checkpoint the edit journal instead of saving (see `SoundClip.journal`). Checkpoints
+                           are skipped while a save is running, and do not emit `saved`
+        """
+        if self.__saving:
+            if checkpoint:
+                return
+            logger.debug("Save already in progress, queueing another")
+            if self.__save_queued is None:
+                self.__save_queued = []
+            if callable(callback):
+                self.__save_queued.append(callback)
+            return
+
+        self.__store_async([callback] if callable(callback) else [], checkpoint)
+
+    def __store_async(self, callbacks, checkpoint):
+        seq = self.__journal_seq()
+        snapshot = self.snapshot(checkpoint=checkpoint)
+        self.__saving = True
+
+        def finish(error):
+            self.__saving = False
+            if error is None:
+                self.__on_stored(snapshot, seq)
+                logger.info("Project {0} {1} {2}".format(
+                    self.name, "checkpointed in" if checkpoint else "saved to", snapshot.root
+                ))
+            else:
+                logger.error("Unable to save project {0}: {1}".format(self.name, error))
+
+            # Start the queued save first, so that saves asked for by the callbacks are queued behind it
+            if self.__save_queued is not None:
+                queued, self.__save_queued = self.__save_queued, None
+                self.__store_async(queued, False)
+
+            if not checkpoint:
+                self.emit('saved', snapshot.stacks, error)
+            for callback in callbacks:
+                callback(self, snapshot.stacks, error)
+            return False
+
+        def work():
+            error = None
+            try:
+                snapshot.write()
+            except Exception as ex:
+                error = ex
+            GLib.idle_add(finish, error)
+
+        threading.Thread(target=work, name="SoundClip Save", daemon=True).start()
\ No newline at end of file
@@ -0,0 +1,299 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Central scheduler for timed work on the main loop
+
+Fades, pre-waits, control cues and progress updates all need to run something at a point in time, or every so often
+while they are active. Rather than each of them keeping a GLib timeout of its own, they schedule `Task`s with the shared
+`Scheduler`, which keeps the deadlines of every task in a min-heap and holds a single GLib timeout for the earliest
+one. When nothing is scheduled, nothing wakes up.
+
+Deadlines are in milliseconds on the monotonic clock of `util.now`. Periodic tasks run every `interval` milliseconds
+until they are cancelled or their callback returns `False`, like GLib sources. A periodic task that falls behind skips
+the runs it missed rather than running several times in a row.
+"""
+
+import heapq
+import math
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, GObject
+
+from SoundClip.util import now
+
+# Compact the heap once more than this fraction of its entries are cancelled tasks
+_COMPACT_RATIO = 0.5
+
+__SCHEDULER = None
+
+
+class Task(object):
+    """
+    A callback scheduled with a `Scheduler`. Use `cancel` to unschedule it
+
+    :param deadline: When the callback runs next, in milliseconds (see `util.now`)
+    :param interval: The number of milliseconds between two runs of a periodic task, `None` for one-shot tasks
+    """
+
+    def __init__(self, scheduler, deadline, interval, callback, args):
+        self.deadline = deadline
+        self.interval = interval
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        # Whether the task is in the scheduler's heap
+        self.scheduled = False
+        self.__scheduler = scheduler
+
+    @property
+    def periodic(self):
+        return self.interval is not None
+
+    @property
+    def active(self):
+        """
+        :return: Whether the task will run again
+        """
+        return self.scheduled and not self.cancelled
+
+    def cancel(self):
+        self.__scheduler.cancel(self)
+
+    def __repr__(self):
+        return "Task({0} at {1:.1f}{2})".format(getattr(self.callback, '__name__', self.callback), self.deadline,
+                                                ", every {0}ms".format(self.interval) if self.periodic else "")
+
+
+class Scheduler(object):
+    """
+    Runs tasks on the main loop at their deadlines
+
+    :param clock: Returns the current time in milliseconds. Defaults to `util.now`
+    """
+
+    def __init__(self, clock=now):
+        self.__clock = clock
+        self.__heap = []
+        self.__seq = 0
+        self.__cancelled = 0
+
+        self.__source = None
+        self.__source_deadline = None
+        self.__running = False
+
+    def __len__(self):
+        """
+        :return: The number of tasks that are scheduled
+        """
+        return len(self.__heap) - self.__cancelled
+
+    def time(self):
+        return self.__clock()
+
+    def call_at(self, deadline, callback, *args):
+        """
+        Runs `callback(*args)` once, at `deadline`
+
+        :param deadline: When to run the callback, in milliseconds (see `util.now`)
+        :return: The scheduled `Task`
+        """
+        task = Task(self, deadline, None, callback, args)
+        self.__push(task)
+        return task
+
+    def call_later(self, delay, callback, *args):
+        """
+        Runs `callback(*args)` once, `delay` milliseconds from now
+
+        :return: The scheduled `Task`
+        """
+        return self.call_at(self.__clock() + max(0, delay), callback, *args)
+
+    def call_every(self, interval, callback, *args, delay=None):
+        """
+        Runs `callback(*args)` every `interval` milliseconds, until the task is cancelled or the callback returns
+        `False`
+
+        :param interval: The number of milliseconds between two runs
+        :param delay: The number of milliseconds until the first run. Defaults to `interval`
+        :return: The scheduled `Task`
+        """
+        if interval <= 0:
+            raise ValueError("The interval of a periodic task must be positive, got {0}".format(interval))
+        task = Task(self, self.__clock() + (interval if delay is None else max(0, delay)), interval, callback, args)
+        self.__push(task)
+        return task
+
+    def cancel(self, task):
+        """
+        Unschedules a task. Tasks that already ran, or were cancelled before, are left alone
+        """
+        if task.cancelled:
+            return
+        task.cancelled = True
+        if not task.scheduled:
+            return
+
+        self.__cancelled += 1
+        if self.__cancelled > len(self.__heap) * _COMPACT_RATIO and len(self.__heap) > 32:
+            self.__heap = [entry for entry in self.__heap if not entry[2].cancelled]
+            heapq.heapify(self.__heap)
+            self.__cancelled = 0
+        self.__arm()
+
+    def __push(self, task):
+        self.__seq += 1
+        task.scheduled = True
+        heapq.heappush(self.__heap, (task.deadline, self.__seq, task))
+        self.__arm()
+
+    def __arm(self):
+        # Keeps a single GLib timeout for the earliest deadline
+        while self.__heap and self.__heap[0][2].cancelled:
+            heapq.heappop(self.__heap)[2].scheduled = False
+            self.__cancelled -= 1
+
+        if self.__running:
+            # The timeout is armed again once every task that is due has run
+            return
+
+        if not self.__heap:
+            if self.__source is not None:
+                GLib.source_remove(self.__source)
+                self.__source = None
+            return
+
+        deadline = self.__heap[0][0]
+        if self.__source is not None:
+            if self.__source_deadline <= deadline:
+                return
+            GLib.source_remove(self.__source)
+
+        delay = max(0, int(math.ceil(deadline - self.__clock())))
+        self.__source = GLib.timeout_add(delay, self.__run)
+        self.__source_deadline = deadline
+
+    def __run(self):
+        self.__source = None
+        self.__running = True
+        try:
+            t = self.__clock()
+            while self.__heap and self.__heap[0][0] <= t:
+                deadline, seq, task = heapq.heappop(self.__heap)
+                task.scheduled = False
+                if task.cancelled:
+                    self.__cancelled -= 1
+                    continue
+
+                try:
+                    more = task.callback(*task.args)
+                except Exception:
+                    logger.exception("Scheduled task {0} failed".format(task))
+                    more = False
+
+                if task.periodic and more is not False and not task.cancelled and not task.scheduled:
+                    task.deadline = deadline + task.interval
+                    if task.deadline <= t:
+                        task.deadline = t + task.interval
+                    self.__seq += 1
+                    task.scheduled = True
+                    heapq.heappush(self.__heap, (task.deadline, self.__seq, task))
+                elif not task.scheduled:
+                    task.cancelled = True
+        finally:
+            self.__running = False
+            self.__arm()
+        return False
+
+
+class Timer(GObject.Object):
+    """
+    Counts down `duration` milliseconds, emitting `update` with the elapsed time every `resolution` milliseconds, and
+    `expired` at the end
+
+    :param scheduler: The scheduler to run on. Defaults to the shared scheduler
+    """
+
+    __gsignals__ = {
+        'expired': (GObject.SIGNAL_RUN_FIRST, None, ()),
+        'update': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_LONG,))
+    }
+
+    def __init__(self, duration, resolution=50, scheduler=None):
+        super().__init__()
+
+        self.__duration = duration
+        self.__resolution = resolution
+        self.__scheduler = scheduler if scheduler is not None else get_scheduler()
+        self.__start_time = -1
+        self.__task = None
+
+    def fire(self):
+        self.__start_time = self.__scheduler.time()
+        self.__task = self.__scheduler.call_every(self.__resolution, self.tick)
+
+    def cancel(self):
+        """
+        Stops the timer without emitting `expired`
+        """
+        if self.__task is not None:
+            self.__task.cancel()
+            self.__task = None
+
+    def tick(self):
+        current_time = self.__scheduler.time()
+
+        more = current_time < self.__start_time + self.__duration
+
+        if more:
+            self.emit('update', current_time-self.__start_time)
+        else:
+            self.__task = None
+            self.emit('expired')
+
+        return more
+GObject.type_register(Timer)
+
+
+def get_scheduler():
+    """
+    :return: The scheduler shared by everything running on the main loop
+    """
+    global __SCHEDULER
+    if __SCHEDULER is None:
+        __SCHEDULER = Scheduler()
+    return __SCHEDULER
+
+
+def call_at(deadline, callback, *args):
+    """
+    See `Scheduler.call_at`
+    """
+    return get_scheduler().call_at(deadline, callback, *args)
+
+
+def call_later(delay, callback, *args):
+    """
+    See `Scheduler.call_later`
+    """
+    return get_scheduler().call_later(delay, callback, *args)
+
+
+def call_every(interval, callback, *args, delay=None):
+    """
+    See `Scheduler.call_every`
+    """
+    return get_scheduler().call_every(interval, callback, *args, delay=delay)
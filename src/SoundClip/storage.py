@@ -31,14 +31,32 @@ Example disk format:
 
 Cues are serialized to json by the serializer for their specific type. All cues and cuelists contain a pointer to their
 previous revisions
+
+Where the objects are kept is up to the project's storage backend (see `SoundClip.backend`). The layout above is the
+default loose backend; loose objects can be folded into a packfile with `repack` (see `SoundClip.pack`).
+
+Saves go through a `Transaction`: the whole batch of objects is handed to the backend at once, which makes it durable
+before it replaces project.json. A crash mid-save leaves the previous project.json pointing at complete objects.
+
+Objects may be compressed (see `SoundClip.codec`). The codec used for new objects is set per project with `set_codec`,
+objects are always hashed over their plain json content.
+
+Reads verify the checksum of every object according to the project's `VerifyPolicy`. Objects that passed verification
+are remembered in a log kept by the backend (.soundclip/verified for loose projects), along with a stamp of where
+they were read from, so the trusted and deferred policies only verify objects again once they have been written again.
 """
 
 import json
 import os
+import threading
 import logging
+from concurrent.futures import ThreadPoolExecutor
+from enum import Enum
 logger = logging.getLogger('SoundClip')
 
+from SoundClip import backend, codec, pack
 from SoundClip.exception import SCException
+from SoundClip.objectcache import ObjectCache
 from SoundClip.util import sha
 
 
@@ -54,7 +72,395 @@ class IllegalObjectException(StorageException):
     pass
 
 
-__CACHE = {}
+class VerifyPolicy(Enum):
+    # Verify every object as it is read
+    INLINE = 'inline'
+    # Hand objects that were not verified before to a background verifier (see `SoundClip.verify`), and return them
+    # right away
+    DEFERRED = 'deferred'
+    # Only verify objects that were not verified before
+    TRUSTED = 'trusted'
+
+
+# Budget for parsed objects, measured in bytes of object text
+DEFAULT_CACHE_BYTES = 64 * 1024 * 1024
+
+# Number of threads used to read objects in parallel
+DEFAULT_PREFETCH_WORKERS = 8
+
+VERIFIED_NAME = backend.VERIFIED_LOG
+
+__CACHE = ObjectCache(max_bytes=DEFAULT_CACHE_BYTES)
+__BACKENDS = {}
+__BACKENDS_LOCK = threading.Lock()
+__CODECS = {}
+__POLICIES = {}
+__VERIFIERS = {}
+__VERIFIED = {}
+__REUSED = {}
+__REUSED_LOCK = threading.Lock()
+
+
+def get_cache():
+    """
+    :return: The object cache shared by all projects. Entries are namespaced by project root
+    """
+    return __CACHE
+
+
+def forget(root):
+    """
+    Drops everything held in memory for the specified project (cached objects, settings, and the open backend)
+
+    :param root: The project root directory
+    """
+    __CACHE.clear(root)
+    __CODECS.pop(root, None)
+    __POLICIES.pop(root, None)
+    __VERIFIERS.pop(root, None)
+    if root in __VERIFIED:
+        __VERIFIED.pop(root).flush()
+    with __BACKENDS_LOCK:
+        if root in __BACKENDS:
+            __BACKENDS.pop(root).close()
+
+
+def set_codec(root, name):
+    """
+    Sets the codec new objects are written with for the specified project
+
+    :param root: The project root directory
+    :param name: The name of a registered codec (see `SoundClip.codec`), or `None` to write plain json
+    """
+    codec.get(name)
+    __CODECS[root] = name or None
+
+
+def get_codec(root):
+    return __CODECS.get(root, None)
+
+
+def set_verify_policy(root, policy, verifier=None):
+    """
+    Sets how objects read from the specified project are verified
+
+    :param root: The project root directory
+    :param policy: A `VerifyPolicy`
+    :param verifier: The background verifier for the `DEFERRED` policy, with a `submit(key, content, stamp)` method
+                     (see `SoundClip.verify.Verifier`). Without one, objects are verified inline
+    """
+    __POLICIES[root] = policy
+    if verifier is not None:
+        __VERIFIERS[root] = verifier
+    else:
+        __VERIFIERS.pop(root, None)
+
+
+def get_verify_policy(root):
+    return __POLICIES.get(root, VerifyPolicy.INLINE)
+
+
+class VerifiedSet(object):
+    """
+    The objects of a project that passed checksum verification, and a stamp of the file (or pack entry) each one was
+    verified in. New entries are kept in memory until the set is flushed to the project's verified log (see
+    `backend.Backend.read_log`), which is rewritten without the objects that no longer exist by `compact`.
+
+    :param root: The project root directory
+    """
+
+    def __init__(self, root):
+        self.__root = root
+        self.__stamps = {}
+        self.__pending = []
+        self.__lock = threading.Lock()
+
+        for line in get_backend(root).read_log(VERIFIED_NAME):
+            parts = line.split()
+            if len(parts) != 2 or not line.endswith('\n'):
+                continue
+            if parts[1] == '-':
+                self.__stamps.pop(parts[0], None)
+            else:
+                self.__stamps[parts[0]] = parts[1]
+
+    def __len__(self):
+        return len(self.__stamps)
+
+    def check(self, key, stamp):
+        """
+        :return: Whether the object was verified where it is stored now
+        """
+        with self.__lock:
+            return stamp is not None and self.__stamps.get(key, None) == stamp
+
+    def add(self, key, stamp):
+        if stamp is None:
+            return
+        with self.__lock:
+            if self.__stamps.get(key, None) != stamp:
+                self.__stamps[key] = stamp
+                self.__pending.append("{0} {1}\n".format(key, stamp))
+
+    def discard(self, key):
+        with self.__lock:
+            if self.__stamps.pop(key, None) is not None:
+                self.__pending.append("{0} -\n".format(key))
+
+    def flush(self):
+        """
+        Appends the entries added since the last flush to the verified log
+        """
+        with self.__lock:
+            lines, self.__pending = self.__pending, []
+        if lines:
+            get_backend(self.__root).append_log(VERIFIED_NAME, lines)
+
+    def compact(self, keep):
+        """
+        Rewrites the verified log without the objects that are not in `keep`, after they were removed from the object
+        store
+
+        :param keep: The hashes of the objects that still exist
+        """
+        with self.__lock:
+            self.__stamps = {k: v for k, v in self.__stamps.items() if k in keep}
+            self.__pending = []
+            lines = ["{0} {1}\n".format(k, v) for k, v in self.__stamps.items()]
+        get_backend(self.__root).write_log(VERIFIED_NAME, lines)
+
+
+def get_verified(root):
+    """
+    :param root: The project root directory
+    :return: The (lazily loaded) set of verified objects of the specified project
+    """
+    if root not in __VERIFIED:
+        __VERIFIED[root] = VerifiedSet(root)
+    return __VERIFIED[root]
+
+
+def track_reuse(root):
+    """
+    Starts recording the objects that transactions on the specified project skip writing because they are already in
+    the object store. Used by the garbage collector: an object it found unreachable may be referenced again by a save
+    before it is swept, without being written again
+
+    :param root: The project root directory
+    """
+    with __REUSED_LOCK:
+        __REUSED[root] = set()
+
+
+def untrack_reuse(root):
+    with __REUSED_LOCK:
+        __REUSED.pop(root, None)
+
+
+def reused(root):
+    """
+    :param root: The project root directory
+    :return: The objects reused by transactions since `track_reuse` was called for the project
+    """
+    with __REUSED_LOCK:
+        return set(__REUSED.get(root, ()))
+
+
+def note_reuse(root, key):
+    with __REUSED_LOCK:
+        if root in __REUSED:
+            __REUSED[root].add(key)
+
+
+def get_backend(root):
+    """
+    :param root: The project root directory
+    :return: The storage backend of the specified project. Opened on first use with the backend the project was stored
+             with (see `backend.detect`), or the loose backend for new projects
+    """
+    with __BACKENDS_LOCK:
+        if root not in __BACKENDS:
+            __BACKENDS[root] = backend.create(backend.detect(root) or backend.LooseBackend.name, root)
+        return __BACKENDS[root]
+
+
+def attach(root, b):
+    """
+    Uses the specified backend instance for a project, replacing the one that was open
+
+    :param root: The project root directory
+    :param b: A `backend.Backend`
+    """
+    with __BACKENDS_LOCK:
+        previous = __BACKENDS.get(root, None)
+        if previous is not None and previous is not b:
+            previous.close()
+        __BACKENDS[root] = b
+    __CACHE.clear(root)
+
+
+def set_backend(root, name):
+    """
+    Selects the backend a project is stored with. Projects that were already stored with another backend keep it
+    until they are migrated (see `migrate`)
+
+    :param root: The project root directory
+    :param name: The name of a registered backend, or `None` for the default
+    :return: The backend the project actually uses
+    """
+    b = get_backend(root)
+    name = name or backend.LooseBackend.name
+    if b.name == name:
+        return b
+
+    stored = backend.detect(root) if b.name != backend.MemoryBackend.name else b.name
+    if stored is not None:
+        logger.warning("{0} is stored with the {1} backend, not switching to {2} without migrating".format(
+            root, stored, name
+        ))
+        return b
+
+    b = backend.create(name, root)
+    attach(root, b)
+    return b
+
+
+def migrate(root, name):
+    """
+    Copies every object, project.json and the logs of a project to another backend, and switches the project over to
+    it. The old backend's files are only removed once the new backend has everything.
+
+    :param root: The project root directory
+    :param name: The name of the backend to migrate to
+    :return: The number of objects copied
+    """
+    source = get_backend(root)
+    if source.name == name:
+        return 0
+
+    target = backend.create(name, root)
+    batch = target.batch()
+    copied = 0
+    for key in source.keys():
+        raw, stamp = source.read(key)
+        if raw is not None:
+            batch.put(key, raw)
+            copied += 1
+    project = source.read_project()
+    if project is not None:
+        batch.set_project(project.encode('utf-8'))
+    batch.commit()
+    for name in backend.LOGS:
+        # Stamps only mean something to the backend that handed them out
+        if name == VERIFIED_NAME:
+            continue
+        lines = source.read_log(name)
+        if lines:
+            target.write_log(name, lines)
+
+    attach(root, target)
+    __discard_store(source)
+
+    logger.info("Migrated {0} objects of {1} from the {2} backend to {3}".format(copied, root, source.name, name))
+    return copied
+
+
+def __discard_store(b):
+    d = os.path.join(b.root, '.soundclip')
+    if b.name == backend.LooseBackend.name:
+        b.remove(list(b.keys()))
+        b.close()
+        paths = [os.path.join(pack.pack_path(b.root), name) for name in (pack.PACK_NAME, pack.INDEX_NAME)]
+        paths.append(os.path.join(d, backend.PROJECT_NAME))
+        paths.extend(os.path.join(d, name) for name in backend.LOGS)
+    elif b.name == backend.SQLiteBackend.name:
+        b.close()
+        paths = [os.path.join(d, backend.DATABASE_NAME + suffix) for suffix in ('', '-wal', '-shm')]
+    else:
+        b.close()
+        paths = []
+
+    for path in paths:
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+def exists(root, key):
+    return get_backend(root).exists(key)
+
+
+def keys(root):
+    """
+    :return: An iterator of the key of every object stored for the specified project
+    """
+    return get_backend(root).keys()
+
+
+def read_project(root):
+    """
+    :param root: The project root directory
+    :return: The content of the project's project.json, or `None` if the project was never stored
+    """
+    return get_backend(root).read_project()
+
+
+def read_raw(root, key):
+    """
+    :param root: The project root directory
+    :param key: The checksum of the object to read
+    :return: The encoded object as it is stored (see `SoundClip.codec`), or `None` if the object doesn't exist
+    """
+    return get_backend(root).read(key)[0]
+
+
+def verify(key, content):
+    """
+    :param key: The key an object was read as
+    :param content: The decoded (json) content of the object
+    :raises ChecksumMismatchException: If the content does not hash to the key
+    """
+    checksum = sha(content)
+    if checksum != key:
+        raise ChecksumMismatchException({
+            "message": "Cryptographic Checksum Mismatch. Was expecting {0}, got {1}".format(key, checksum),
+            "key": key,
+            "checksum": checksum
+        })
+
+
+def object_time(root, key):
+    """
+    :param root: The project root directory
+    :param key: The checksum of an object
+    :return: The time the object was written, as a unix timestamp (or a time after that, for packed objects). `None`
+             if the object doesn't exist
+    """
+    return get_backend(root).object_time(key)
+
+
+def remove(root, keys):
+    """
+    Deletes objects from the object store. The caller is responsible for making sure nothing references them anymore.
+    Some backends only reclaim the space on `compact`
+
+    :param root: The project root directory
+    :param keys: The checksums of the objects to remove
+    :return: The number of objects removed
+    """
+    keys = list(keys)
+    for key in keys:
+        __CACHE.discard(root, key)
+    return get_backend(root).remove(keys)
+
+
+def compact(root, keep, fold=True):
+    """
+    Reclaims the space of every object not in `keep` (see `backend.Backend.compact`)
+    """
+    dropped, folded = get_backend(root).compact(keep, fold=fold)
+    if dropped:
+        __CACHE.clear(root)
+    return dropped, folded
 
 
 def read(root, key, force_reload=False):
@@ -65,21 +471,28 @@ def read(root, key, force_reload=False):
 
     :param root: The project root directory
     :param key: The checksum of the object to read
+    :param force_reload: Bypass the object cache and read the object from disk again
     :return: the json content of the specified object
     """
-    if key in __CACHE and not force_reload:
-        logger.debug("Loading {0} from object cache".format(key))
-        return __CACHE[key]
-    else:
+    if not force_reload:
+        obj = __CACHE.get(root, key)
+        if obj is not None:
+            logger.debug("Loading {0} from object cache".format(key))
+            return obj
         logger.debug("Cache-Miss: {0} not yet in object cache".format(key))
 
-    path = os.path.join(root, '.soundclip', 'objects', key[0:2], key[2:40])
-    logger.debug("Asked to load {0}, looking for {1}".format(key, path))
-    if not os.path.exists(path):
+    logger.debug("Asked to load {0}".format(key))
+    raw, stamp = get_backend(root).read(key)
+    if raw is None:
         raise FileNotFoundError("The specified object doesn't exist in the database!")
 
-    with open(path, "rt") as dbobj:
-        content = dbobj.read().strip()
+    try:
+        content = codec.decode(raw)
+    except codec.CodecException as ex:
+        raise IllegalObjectException({
+            "message": "The object read from the database could not be decoded: {0}".format(ex),
+            "key": key
+        })
 
     if not content:
         raise IllegalObjectException({
@@ -87,55 +500,245 @@ def read(root, key, force_reload=False):
             "key": key
         })
 
-    checksum = sha(content)
-    if checksum != key:
-        raise ChecksumMismatchException({
-            "message": "Cryptographic Checksum Mismatch. Was expecting {0}, got {1}".format(key, checksum),
-            "key": key,
-            "checksum": checksum
-        })
+    policy = get_verify_policy(root)
+    if policy is VerifyPolicy.INLINE:
+        verify(key, content)
+    elif not get_verified(root).check(key, stamp):
+        verifier = __VERIFIERS.get(root, None)
+        if policy is VerifyPolicy.DEFERRED and verifier is not None:
+            verifier.submit(key, content, stamp)
+        else:
+            verify(key, content)
+            get_verified(root).add(key, stamp)
 
     obj = json.loads(content)
-    __CACHE[key] = obj
+    __CACHE.put(root, key, obj, size=len(content))
     return obj
 
 
-def write(root, d, current_hash):
+def prefetch(root, keys, max_workers=DEFAULT_PREFETCH_WORKERS):
     """
-    Writes an object to the database, returning its sha1 checksum. Like git, objects are keyed by the sha1 hash of their
-    content. The first two bytes of the hash refer to the sub directory of the objects store, the remaining 40 bytes
-    are the name of the file.
+    Reads (and verifies) many objects in parallel. File I/O and hashing happen on a pool of worker threads, so the
+    caller only has to build its objects from the parsed dictionaries.
 
     :param root: The project root directory
-    :param d: The dictionary to serialize
-    :return: the sha1 checksum that refers to this project
+    :param keys: The hashes of the objects to read. Duplicates are only read once
+    :param max_workers: The maximum number of threads to read with
+    :return: A dictionary of hash to the json content of that object
     """
+    keys = list(dict.fromkeys(k for k in keys if k))
+    if not keys:
+        return {}
+    if len(keys) == 1 or max_workers <= 1:
+        return {key: read(root, key) for key in keys}
 
-    if 'previousRevision' not in d:
-        d['previousRevision'] = ''
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(keys))) as pool:
+        return dict(zip(keys, pool.map(lambda key: read(root, key), keys)))
 
-    s = json.dumps(d, sort_keys=True).strip()
-    checksum = sha(s)
 
-    logger.debug("Asked to store {0} (current has was {1}, checksum: {2})".format(s, current_hash, checksum))
+def __intact(key, raw):
+    try:
+        content = codec.decode(raw)
+    except codec.CodecException:
+        return False
+    return bool(content) and sha(content) == key
 
-    path = os.path.join(root, '.soundclip', 'objects', checksum[0:2])
 
-    if not os.path.exists(path):
-        os.makedirs(path)
+def cleanup(root):
+    """
+    Removes whatever was left behind by saves that never finished. Objects the backend can recover are kept if they
+    are intact
+    """
+    get_backend(root).cleanup(check=__intact)
 
-    object_path = os.path.join(path, checksum[2:40])
 
-    # No need to write duplicate objects
-    if checksum == current_hash and os.path.exists(object_path):
-        logger.debug("{0} is already in the object store, skipping".format(checksum))
-        return checksum, d['previousRevision']
+class Transaction(object):
+    """
+    A batch of object writes (and optionally a new project.json) that becomes durable all at once.
+
+    Objects are encoded and handed to the project's backend as they are added (see `backend.Batch`). `commit` makes
+    them all durable and only then replaces project.json. If the transaction is used as a context manager, it is
+    committed when the block exits normally and aborted if it raises.
+
+    :param root: The project root directory
+    :param codec_name: The codec to write objects with. Defaults to the project's codec (see `set_codec`)
+    """
 
-    d['previousRevision'] = current_hash
+    def __init__(self, root, codec_name=None):
+        self.__root = root
+        self.__codec = codec_name if codec_name is not None else get_codec(root)
+        self.__batch = get_backend(root).batch()
+        self.__pending = set()
+        self.__parents = {}
+        self.__done = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.abort()
+        return False
+
+    @property
+    def root(self):
+        return self.__root
+
+    def __len__(self):
+        return len(self.__pending)
+
+    @property
+    def written(self):
+        """
+        :return: A dictionary of the hash of every object written by this transaction to the hash of the object it
+                 replaces (which may be more recent than the `previousRevision` stored in the object)
+        """
+        return dict(self.__parents)
+
+    def write(self, d, current_hash):
+        """
+        Adds an object to the transaction, returning its sha1 checksum. Like git, objects are keyed by the sha1 hash of
+        their content.
+
+        :param d: The dictionary to serialize
+        :param current_hash: The hash the object had before it was changed
+        :return: the sha1 checksum of the object and the hash of its previous revision
+        """
+        if self.__done:
+            raise StorageException({"message": "The transaction has already been committed or aborted"})
+
+        if 'previousRevision' not in d:
+            d['previousRevision'] = ''
+
+        s = json.dumps(d, sort_keys=True).strip()
+        checksum = sha(s)
+
+        logger.debug("Asked to store {0} (current has was {1}, checksum: {2})".format(s, current_hash, checksum))
+
+        # No need to write duplicate objects
+        if checksum in self.__pending or exists(self.__root, checksum):
+            logger.debug("{0} is already in the object store, skipping".format(checksum))
+            note_reuse(self.__root, checksum)
+            return (checksum, d['previousRevision']) if checksum == current_hash else (checksum, current_hash)
+
+        self.__parents[checksum] = current_hash or ''
+        d['previousRevision'] = current_hash
+
+        self.__batch.put(checksum, codec.encode(s, self.__codec))
+        self.__pending.add(checksum)
+
+        return checksum, current_hash
+
+    def write_project(self, d):
+        """
+        Replaces project.json with the specified dictionary once every object in the transaction is on disk
+        """
+        self.__batch.set_project(codec.encode(json.dumps(d, sort_keys=True)))
+
+    def commit(self):
+        if self.__done:
+            return
+        self.__done = True
+
+        self.__batch.commit()
+        logger.debug("Committed {0} objects to {1}".format(len(self.__pending), self.__root))
+
+    def abort(self):
+        if self.__done:
+            return
+        self.__done = True
+
+        self.__batch.abort()
+        self.__pending.clear()
+        self.__parents.clear()
 
-    logger.debug("Writing {0}".format(object_path))
-    with open(object_path, "w") as f:
-        f.write(s)
-        f.write('\n')
 
-    return checksum, current_hash
\ No newline at end of file
+def write(root, d, current_hash):
+    """
+    Writes a single object to the database in its own transaction, returning its sha1 checksum. Prefer a
+    `Transaction` when writing more than one object.
+
+    :param root: The project root directory
+    :param d: The dictionary to serialize
+    :param current_hash: The hash the object had before it was changed
+    :return: the sha1 checksum of the object and the hash of its previous revision
+    """
+    with Transaction(root) as tx:
+        return tx.write(d, current_hash)
+
+
+class PendingObject(object):
+    """
+    An object that has been serialized (on the main thread) but not yet hashed or written to the object store. Its
+    dictionary may reference other pending objects in place of their hashes, these are written first when the object
+    is resolved.
+
+    :param owner: The object (usually a cue or cue stack) that was serialized. Results are reported back to its
+                  `on_stored(pending)` method when the pending object is applied
+    :param d: The serialized dictionary
+    :param current_hash: The hash of the owner at the time it was serialized
+    :param revision: An opaque marker the owner can use to tell whether it changed after it was serialized
+    :param prepare: Called as `prepare(tx, d)` with the resolved dictionary, on the writing thread, right before the
+                    object is written. May write other objects to the transaction first. Returns the dictionary to
+                    actually write, and whatever the owner needs to know about it once it is stored (kept as
+                    `prepared`). The owner itself must not be touched from the writing thread
+    """
+
+    def __init__(self, owner, d, current_hash, revision=0, prepare=None):
+        self.owner = owner
+        self.d = d
+        self.current_hash = current_hash
+        self.revision = revision
+        self.prepare = prepare
+
+        self.checksum = None
+        self.last_hash = None
+        self.resolved = None
+        self.prepared = None
+
+    def apply(self):
+        """
+        Reports the results of writing this object back to its owner. Must be called from the main thread.
+        """
+        if self.checksum is not None and self.owner is not None:
+            self.owner.on_stored(self)
+
+
+def resolve(tx, value, results):
+    """
+    Writes every pending object in the specified value to a transaction (dependencies first), returning a copy of
+    the value with the pending objects replaced by their hashes. Safe to call from a worker thread as long as the
+    pending objects are not touched by anything else until they have been applied.
+
+    :param tx: The `Transaction` to write to
+    :param value: A `PendingObject`, hash, or a (possibly nested) dictionary or list of them
+    :param results: A list the written pending objects are appended to, in the order they were written
+    :return: the value with all pending objects resolved to their hashes
+    """
+    if isinstance(value, PendingObject):
+        if value.checksum is None:
+            d = resolve(tx, value.d, results)
+            value.resolved = d
+            if callable(value.prepare):
+                d, value.prepared = value.prepare(tx, dict(d))
+            value.checksum, value.last_hash = tx.write(d, value.current_hash)
+            results.append(value)
+        return value.checksum
+    elif isinstance(value, dict):
+        return {k: resolve(tx, v, results) for k, v in value.items()}
+    elif isinstance(value, list):
+        return [resolve(tx, v, results) for v in value]
+    return value
+
+
+def repack(root):
+    """
+    Folds all loose objects into the project's packfile, for projects stored with the loose backend. Loose objects are
+    only removed once the pack and its index have been written to disk. Corrupt loose objects are left where they are.
+
+    :param root: The project root directory
+    :return: the number of objects that were added to the packfile
+    """
+    return get_backend(root).repack(check=__intact)
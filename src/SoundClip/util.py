@@ -12,41 +12,9 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import hashlib
-import datetime
 import os
-from gi.repository import GLib, Gtk, GObject
-
-
-class Timer(GObject.Object):
-
-    __gsignals__ = {
-        'expired': (GObject.SIGNAL_RUN_FIRST, None, ()),
-        'update': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_LONG,))
-    }
-
-    def __init__(self, duration, resolution=50):
-        super().__init__()
-
-        self.__duration = duration
-        self.__resolution = resolution
-        self.__start_time = -1
-
-    def fire(self):
-        self.__start_time = now()
-        GLib.timeout_add(self.__resolution, self.tick)
-
-    def tick(self):
-        current_time = now()
-
-        more = current_time < self.__start_time + self.__duration
-
-        if more:
-            self.emit('update', current_time-self.__start_time)
-        else:
-            self.emit('expired')
-
-        return more
-GObject.type_register(Timer)
+import time
+from gi.repository import Gtk
 
 
 def timepart(ms):
@@ -69,8 +37,11 @@ def get_gtk_version():
 
 
 def now():
-    t = datetime.datetime.now()
-    return (t.day * 24 * 60 * 60 + t.second) * 1000 + t.microsecond / 1000.0
+    """
+    :return: The time in milliseconds on a monotonic clock, for measuring durations and scheduling (see
+             `SoundClip.scheduler`). Unaffected by changes to the wall clock, but has no meaning on its own
+    """
+    return time.monotonic() * 1000.0
 
 
 def pick(d, key, default):
@@ -0,0 +1,125 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Background checksum verification for the deferred `VerifyPolicy`
+
+Objects are returned to the caller as soon as they are read, and verified afterwards on a worker thread. Objects that
+fail verification are dropped from the object cache, and reported on the main thread through the `checksum-mismatch`
+signal, so the user can be warned that the show on disk is damaged.
+"""
+
+import queue
+import threading
+
+import logging
+logger = logging.getLogger('SoundClip')
+
+from gi.repository import GLib, GObject
+
+from SoundClip import storage
+
+
+class Verifier(GObject.GObject):
+    """
+    Verifies objects read from a project on a background thread
+
+    :param root: The project root directory
+    """
+
+    __gsignals__ = {
+        'checksum-mismatch': (GObject.SIGNAL_RUN_FIRST, None, (GObject.TYPE_PYOBJECT, )),
+        'idle': (GObject.SIGNAL_RUN_FIRST, None, ())
+    }
+
+    def __init__(self, root):
+        GObject.GObject.__init__(self)
+
+        self.__root = root
+        self.__queue = queue.Queue()
+        self.__thread = None
+        self.__lock = threading.Lock()
+        self.__verified = 0
+        self.__mismatches = []
+
+    @property
+    def pending(self):
+        return self.__queue.qsize()
+
+    @property
+    def verified(self):
+        return self.__verified
+
+    @property
+    def mismatches(self):
+        """
+        :return: Every `ChecksumMismatchException` found so far
+        """
+        return list(self.__mismatches)
+
+    def submit(self, key, content, stamp):
+        """
+        Queues an object for verification. Safe to call from any thread
+
+        :param key: The key the object was read as
+        :param content: The decoded (json) content of the object
+        :param stamp: Where the object was read from (see `storage.VerifiedSet`)
+        """
+        self.__queue.put((key, content, stamp))
+        with self.__lock:
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, name="SoundClip Verifier", daemon=True)
+                self.__thread.start()
+
+    def wait(self):
+        """
+        Blocks until every queued object has been verified
+        """
+        self.__queue.join()
+
+    def __run(self):
+        while True:
+            try:
+                key, content, stamp = self.__queue.get(timeout=1)
+            except queue.Empty:
+                with self.__lock:
+                    if self.__queue.empty():
+                        self.__thread = None
+                        return
+                continue
+
+            try:
+                storage.verify(key, content)
+                storage.get_verified(self.__root).add(key, stamp)
+                self.__verified += 1
+            except storage.ChecksumMismatchException as ex:
+                logger.error("Object {0} in {1} is corrupt: {2}".format(key, self.__root, ex))
+                storage.get_cache().discard(self.__root, key)
+                storage.get_verified(self.__root).discard(key)
+                self.__mismatches.append(ex)
+                GLib.idle_add(self.__report, ex)
+            finally:
+                self.__queue.task_done()
+
+            if self.__queue.empty():
+                storage.get_verified(self.__root).flush()
+                GLib.idle_add(self.__idle)
+
+    def __report(self, ex):
+        self.emit('checksum-mismatch', ex)
+        return False
+
+    def __idle(self):
+        if self.__queue.empty():
+            self.emit('idle')
+        return False
@@ -0,0 +1,107 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import types
+
+import pytest
+
+# Run the tests against the SoundClip package in this tree
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def root(tmp_path):
+    """
+    A project directory, whose storage and history are forgotten once the test is done
+    """
+    from SoundClip import history, storage
+    r = str(tmp_path)
+    yield r
+    storage.forget(r)
+    history.forget(r)
+
+
+class FakeLoop(object):
+    """
+    A manually advanced clock, and the GLib timeouts the scheduler arms against it
+    """
+
+    def __init__(self):
+        self.time = 1000.0
+        self.sources = {}
+        self.__next = 0
+
+    def clock(self):
+        return self.time
+
+    def timeout_add(self, delay, callback):
+        self.__next += 1
+        self.sources[self.__next] = (self.time + delay, callback)
+        return self.__next
+
+    def source_remove(self, source):
+        del self.sources[source]
+
+    def advance(self, ms):
+        end = self.time + ms
+        while True:
+            due = [(t, s) for s, (t, callback) in self.sources.items() if t <= end]
+            if not due:
+                break
+            t, s = min(due)
+            self.time = max(self.time, t)
+            callback = self.sources.pop(s)[1]
+            if callback():
+                self.sources[s] = (self.time, callback)
+        self.time = end
+
+
+@pytest.fixture
+def loop(monkeypatch):
+    """
+    Arms the timeouts of `SoundClip.scheduler` against a `FakeLoop` instead of the GLib main loop
+    """
+    from SoundClip import scheduler
+    loop = FakeLoop()
+    monkeypatch.setattr(scheduler, 'GLib', types.SimpleNamespace(timeout_add=loop.timeout_add,
+                                                                 source_remove=loop.source_remove))
+    return loop
+
+
+class FakeClock(object):
+    """
+    The shared clock, in nanoseconds, running along with a `FakeLoop`
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def get_time(self):
+        from gi.repository import Gst
+        return int(self.loop.time * Gst.MSECOND)
+
+
+@pytest.fixture
+def clock(loop, monkeypatch):
+    """
+    Runs the default scheduler and the clock shared by the playback pipelines (see `pipeline.get_clock`) on `loop`
+    """
+    from SoundClip import pipeline, scheduler
+    clock = FakeClock(loop)
+    s = scheduler.Scheduler(clock=loop.clock)
+    monkeypatch.setattr(scheduler, 'get_scheduler', lambda: s)
+    monkeypatch.setattr(pipeline, 'get_clock', lambda: clock)
+    return clock
@@ -0,0 +1,253 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import Gst
+
+from SoundClip import audio
+
+
+class FakeController(object):
+    """
+    A playback controller that prerolls once it is told to
+    """
+
+    def __init__(self, playing=False):
+        self.playing = playing
+        self.prerolled = False
+        self.played_at = None
+        self.__callbacks = []
+
+    def preroll(self, callback=None):
+        if self.prerolled:
+            callback()
+        else:
+            self.__callbacks.append(callback)
+
+    def finish_preroll(self):
+        self.prerolled = True
+        callbacks, self.__callbacks = self.__callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def play(self, volume=1.0, fade=0, at=None):
+        self.played_at = at
+
+    def get_start_time(self):
+        return self.played_at
+
+
+class FakePipeline(object):
+    """
+    A pipeline that changes state once the test posts it on its bus, and fails the test if anything waits on it
+    """
+
+    def __init__(self, owner):
+        self.owner = owner
+        self.busy = False
+        self.volume = 1.0
+        self.pan = 0.0
+        self.position = None
+        self.current = Gst.State.NULL
+        self.target = Gst.State.NULL
+
+    @property
+    def state(self):
+        return self.current, self.target if self.target != self.current else Gst.State.VOID_PENDING
+
+    @property
+    def prerolled(self):
+        return self.current == Gst.State.PAUSED and self.target == Gst.State.PAUSED
+
+    def set_state(self, state):
+        self.target = state
+
+    def get_state(self, timeout=None):
+        pytest.fail("Waited on the pipeline")
+
+    def seek(self, ms):
+        self.position = ms
+
+    def query_duration(self):
+        return 4000
+
+    def post_state_changed(self):
+        self.current = self.target
+        self.owner.on_state_changed()
+
+
+class FakeEngine(object):
+
+    def __init__(self):
+        self.pipelines = []
+
+    def checkout(self, owner, uri):
+        self.pipelines.append(FakePipeline(owner))
+        return self.pipelines[-1]
+
+    def touch(self, p):
+        pass
+
+    def checkin(self, p):
+        p.owner = None
+
+
+class FakeError(object):
+
+    def parse_error(self):
+        return "Not prerolled"
+
+
+@pytest.fixture
+def engine(monkeypatch):
+    monkeypatch.setattr(audio.mediainfo, 'discover', lambda uri: None)
+    monkeypatch.setattr(audio.discovery, 'cancel', lambda uri, callback: None)
+    return FakeEngine()
+
+
+def test_state_is_read_from_the_bus(engine):
+    c = audio.PlaybackController('file:///a.wav', engine=engine)
+    states = []
+    c.connect('playback-state-changed', lambda o, state: states.append(state))
+    prerolled = []
+    c.preroll(lambda: prerolled.append(c.get_duration()))
+
+    # Still prerolling, the callback waits for the bus
+    assert c.paused and not c.prerolled
+    assert states == [audio.PlaybackState.PAUSED]
+    assert prerolled == []
+
+    engine.pipelines[0].post_state_changed()
+    assert c.prerolled
+    assert prerolled == [4000]
+    c.preroll(lambda: prerolled.append('ready'))
+    assert prerolled == [4000, 'ready']
+
+    c.play()
+    assert c.playing and not c.paused
+    assert states == [audio.PlaybackState.PAUSED, audio.PlaybackState.PLAYING]
+
+    c.reset()
+    assert c.stopped
+    assert states[-1] == audio.PlaybackState.STOPPED
+
+
+def test_seeks_wait_for_the_preroll(engine):
+    c = audio.PlaybackController('file:///a.wav', engine=engine)
+    c.seek(1000)
+    p = engine.pipelines[0]
+    assert p.position is None
+    p.post_state_changed()
+    assert p.position == 1000
+
+
+def test_returned_pipelines_drop_preroll_callbacks(engine):
+    c = audio.PlaybackController('file:///a.wav', engine=engine)
+    prerolled = []
+    c.preroll(lambda: prerolled.append('first'))
+    c.reset()
+
+    c.preroll(lambda: prerolled.append('second'))
+    engine.pipelines[1].post_state_changed()
+    assert prerolled == ['second']
+
+
+def test_errors_stop_the_wait_for_a_preroll(engine):
+    c = audio.PlaybackController('file:///a.wav', engine=engine)
+    prerolled = []
+    c.preroll(lambda: prerolled.append(c.prerolled))
+    c.on_error(None, FakeError())
+    assert prerolled == [False]
+
+
+def test_group_starts_once_every_member_prerolled(loop, clock):
+    a, b = FakeController(), FakeController()
+    group = audio.GroupStart(lead=50)
+    group.add(a)
+    group.add(b)
+    group.start()
+    assert group.start_time is None
+    assert group.waiting == [a, b]
+
+    loop.advance(20)
+    a.finish_preroll()
+    assert group.start_time is None
+    loop.advance(20)
+    b.finish_preroll()
+
+    at = clock.get_time() + 50 * Gst.MSECOND
+    assert group.start_time == at
+    assert a.played_at == at and b.played_at == at
+    # The deadline was cancelled
+    loop.advance(audio.PREROLL_TIMEOUT)
+    assert group.start_time == at
+
+
+def test_group_starts_without_members_that_miss_the_deadline(loop, clock):
+    a, slow = FakeController(), FakeController()
+    group = audio.GroupStart(lead=50)
+    group.add(a)
+    group.add(slow)
+    started = []
+    group.connect('started', lambda g, t: started.append(t))
+    group.start()
+    a.finish_preroll()
+
+    loop.advance(audio.PREROLL_TIMEOUT - 1)
+    assert started == []
+    loop.advance(1)
+    at = clock.get_time() + 50 * Gst.MSECOND
+    assert started == [at]
+    # The slow member is still asked to play at the same moment, and starts whenever it is ready
+    assert slow.played_at == at
+    assert group.waiting == []
+
+    slow.finish_preroll()
+    assert started == [at]
+
+
+def test_group_leaves_playing_members_alone(loop, clock):
+    playing, armed = FakeController(playing=True), FakeController()
+    armed.prerolled = True
+    group = audio.GroupStart(lead=50)
+    group.add(playing)
+    group.add(armed)
+    ran = []
+    group.add_callback(lambda: ran.append(clock.get_time()))
+    group.start()
+
+    at = clock.get_time() + 50 * Gst.MSECOND
+    assert group.start_time == at
+    assert playing.played_at is None
+    assert armed.played_at == at
+    with pytest.raises(ValueError):
+        group.add(FakeController())
+
+    loop.advance(50)
+    assert ran == [at]
+
+
+def test_late_group_starts_lead_from_when_it_is_ready(loop, clock):
+    a = FakeController()
+    group = audio.GroupStart(lead=50)
+    group.add(a)
+    at = clock.get_time() + 100 * Gst.MSECOND
+    group.start(at)
+
+    loop.advance(200)
+    a.finish_preroll()
+    assert group.start_time == clock.get_time() + 50 * Gst.MSECOND
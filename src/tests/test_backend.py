@@ -0,0 +1,174 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import os
+
+import pytest
+
+from SoundClip import backend
+
+
+@pytest.fixture(params=['loose', 'memory', 'sqlite'])
+def store(request, tmp_path):
+    b = backend.create(request.param, str(tmp_path))
+    yield b
+    b.close()
+
+
+def obj(content):
+    return hashlib.sha1(content).hexdigest(), content
+
+
+def test_commit(store):
+    a, b = obj(b'a'), obj(b'b')
+    batch = store.batch()
+    batch.put(*a)
+    batch.put(*b)
+    batch.set_project(b'{"name": "Show"}')
+    batch.commit()
+
+    assert store.exists(a[0])
+    assert store.read(a[0])[0] == b'a'
+    assert store.read(a[0])[1] is not None
+    assert sorted(store.keys()) == sorted([a[0], b[0]])
+    assert store.read_project() == '{"name": "Show"}'
+    assert store.object_time(a[0]) is not None
+
+
+def test_abort(store):
+    key, content = obj(b'a')
+    batch = store.batch()
+    batch.put(key, content)
+    batch.set_project(b'{}')
+    batch.abort()
+
+    assert not store.exists(key)
+    assert store.read(key) == (None, None)
+    assert store.read_project() is None
+    assert list(store.keys()) == []
+
+
+def test_remove(store):
+    a, b = obj(b'a'), obj(b'b')
+    batch = store.batch()
+    batch.put(*a)
+    batch.put(*b)
+    batch.commit()
+
+    assert store.remove([a[0], obj(b'missing')[0]]) == 1
+    assert not store.exists(a[0])
+    assert store.exists(b[0])
+    assert store.object_time(a[0]) is None
+
+
+def test_logs(store):
+    assert store.read_log(backend.HISTORY_LOG) == []
+    store.append_log(backend.HISTORY_LOG, ['one\n', 'two\n'])
+    store.append_log(backend.HISTORY_LOG, ['three\n'])
+    store.append_log(backend.JOURNAL_LOG, ['other\n'])
+    assert store.read_log(backend.HISTORY_LOG) == ['one\n', 'two\n', 'three\n']
+
+    store.write_log(backend.HISTORY_LOG, ['rewritten\n'])
+    assert store.read_log(backend.HISTORY_LOG) == ['rewritten\n']
+
+    store.remove_log(backend.HISTORY_LOG)
+    assert store.read_log(backend.HISTORY_LOG) == []
+    assert store.read_log(backend.JOURNAL_LOG) == ['other\n']
+
+
+def test_memory_backend_writes_nothing(tmp_path):
+    b = backend.create('memory', str(tmp_path))
+    batch = b.batch()
+    batch.put(*obj(b'a'))
+    batch.set_project(b'{}')
+    batch.commit()
+    b.append_log(backend.JOURNAL_LOG, ['line\n'])
+
+    assert os.listdir(str(tmp_path)) == []
+    assert backend.detect(str(tmp_path)) is None
+
+
+def test_sqlite_persists(tmp_path):
+    key, content = obj(b'a')
+    b = backend.create('sqlite', str(tmp_path))
+    batch = b.batch()
+    batch.put(key, content)
+    batch.set_project(b'{}')
+    batch.commit()
+    b.append_log(backend.HISTORY_LOG, ['line\n'])
+    b.close()
+
+    assert backend.detect(str(tmp_path)) == 'sqlite'
+    b = backend.create('sqlite', str(tmp_path))
+    assert b.read(key)[0] == content
+    assert b.read_project() == '{}'
+    assert b.read_log(backend.HISTORY_LOG) == ['line\n']
+    b.close()
+
+
+def test_loose_repack_and_compact(tmp_path):
+    b = backend.create('loose', str(tmp_path))
+    a, c = obj(b'a'), obj(b'c')
+    batch = b.batch()
+    batch.put(*a)
+    batch.put(*c)
+    batch.set_project(b'{}')
+    batch.commit()
+
+    assert b.repack() == 2
+    assert list(b.loose_objects()) == []
+    assert b.read(a[0])[0] == b'a'
+
+    assert b.compact({c[0]}) == (1, 0)
+    assert not b.exists(a[0])
+    assert b.read(c[0])[0] == b'c'
+    b.close()
+
+
+def test_detect_and_create(tmp_path):
+    assert backend.detect(str(tmp_path)) is None
+    assert set(backend.available()) >= {'loose', 'memory', 'sqlite'}
+    with pytest.raises(backend.BackendException):
+        backend.create('nope', str(tmp_path))
+
+    b = backend.create('loose', str(tmp_path))
+    batch = b.batch()
+    batch.set_project(b'{}')
+    batch.commit()
+    assert backend.detect(str(tmp_path)) == 'loose'
+
+
+def test_migrate(tmp_path):
+    pytest.importorskip('gi')
+    from SoundClip import history, storage
+
+    root = str(tmp_path)
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    with storage.Transaction(root) as tx:
+        tx.write_project({'name': 'Show'})
+    history.get(root).record({key: ''})
+
+    try:
+        assert storage.migrate(root, 'sqlite') == 1
+        assert storage.get_backend(root).name == 'sqlite'
+        assert storage.read(root, key, force_reload=True)['name'] == 'Cue'
+        d = os.path.join(root, '.soundclip')
+        for name in (backend.PROJECT_NAME, backend.HISTORY_LOG):
+            assert not os.path.exists(os.path.join(d, name))
+        assert list(backend.LooseBackend(root).loose_objects()) == []
+        assert storage.get_backend(root).read_log(backend.HISTORY_LOG) == ["o {0}\n".format(key)]
+    finally:
+        storage.forget(root)
+        history.forget(root)
@@ -0,0 +1,76 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+
+import pytest
+
+from SoundClip import codec
+
+CONTENT = json.dumps({'name': 'Cue', 'notes': 'x' * 500, 'previousRevision': ''}, sort_keys=True)
+
+
+def test_plain_round_trip():
+    raw = codec.encode(CONTENT)
+    assert raw == CONTENT.encode('utf-8') + b'\n'
+    assert codec.decode(raw) == CONTENT
+
+
+def test_zlib_round_trip():
+    raw = codec.encode(CONTENT, 'zlib')
+    assert raw.startswith(b'\0zlib\0')
+    assert len(raw) < len(CONTENT)
+    assert codec.decode(raw) == CONTENT
+
+
+def test_non_ascii_content():
+    content = json.dumps({'name': 'Überture – Act 1'}, ensure_ascii=False)
+    assert codec.decode(codec.encode(content)) == content
+    assert codec.decode(codec.encode(content, 'zlib')) == content
+
+
+def test_unknown_codec():
+    with pytest.raises(codec.CodecException):
+        codec.encode(CONTENT, 'nope')
+    with pytest.raises(codec.CodecException):
+        codec.decode(b'\0nope\0data')
+
+
+@pytest.mark.parametrize('raw', [
+    b'\0zlib',
+    b'\0\0data',
+    b'\0zlib\0not zlib',
+    b'\xff\xfe',
+])
+def test_corrupt_objects_raise_codec_exceptions(raw):
+    with pytest.raises(codec.CodecException):
+        codec.decode(raw)
+
+
+def test_register():
+    class Reverse(codec.Codec):
+        name = 'reverse'
+
+        def encode(self, data):
+            return data[::-1]
+
+        def decode(self, data):
+            return data[::-1]
+
+    codec.register(Reverse())
+    assert 'reverse' in codec.available()
+    assert codec.decode(codec.encode(CONTENT, 'reverse')) == CONTENT
+
+    with pytest.raises(ValueError):
+        codec.register(codec.Codec())
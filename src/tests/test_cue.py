@@ -0,0 +1,63 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import Gst
+
+from SoundClip import pipeline
+from SoundClip.cue import AUTO_CONTINUE, Cue
+from SoundClip.project import Project
+
+
+class RecordingCue(Cue):
+    """
+    Records when it was armed and started, on the shared clock
+    """
+
+    def __init__(self, project, log, **properties):
+        super().__init__(project, **properties)
+        self.log = log
+
+    def arm(self):
+        self.log.append(('arm', self.name, pipeline.get_clock().get_time()))
+
+    def action(self, group=None):
+        super().action(group)
+        self.log.append(('action', self.name, pipeline.get_clock().get_time()))
+
+
+def test_auto_continue_starts_the_next_cue_on_time(root, loop, clock):
+    p = Project(root=root)
+    log = []
+    first = RecordingCue(p, log, name="First", number=1)
+    first.continue_mode = AUTO_CONTINUE
+    first.post_wait = 100
+    p.cue_stacks[0] += first
+    p.cue_stacks[0] += RecordingCue(p, log, name="Second", number=2)
+
+    start = clock.get_time()
+    first.go()
+    # The next cue is armed on the main loop, not while the first one is started
+    assert log == [('action', "First", start)]
+    loop.advance(0)
+    assert log[1:] == [('arm', "Second", start)]
+
+    loop.advance(99)
+    assert len(log) == 2
+    loop.advance(1)
+    assert log[2:] == [('action', "Second", start + 100 * Gst.MSECOND)]
+    p.close()
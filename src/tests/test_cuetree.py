@@ -0,0 +1,101 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import cuetree, history, storage
+from SoundClip.cue import Cue
+from SoundClip.project import Project
+from SoundClip.util import sha
+
+
+def cue_keys(n, salt=''):
+    return [sha("cue {0}{1}".format(i, salt)) for i in range(n)]
+
+
+def build(root, cues, chunks=None):
+    with storage.Transaction(root) as tx:
+        tree, used = cuetree.build(tx, cues, [{'number': i} for i in range(len(cues))], chunks or {})
+        return tree, used, len(tx)
+
+
+def test_round_trip(root):
+    cues = cue_keys(1000)
+    tree, used, written = build(root, cues)
+
+    assert written == len(used) > 1
+    loaded, index, chunks = cuetree.load(root, tree)
+    assert loaded == cues
+    assert index == [{'number': i} for i in range(len(cues))]
+    assert chunks == used
+
+
+def test_empty_stack(root):
+    tree, used, written = build(root, [])
+    assert tree is None
+    assert written == 0
+    assert cuetree.load(root, tree) == ([], [], {})
+
+
+def test_editing_a_cue_only_writes_its_path(root):
+    cues = cue_keys(1000)
+    tree, used, _ = build(root, cues)
+
+    cues[500] = sha("edited")
+    edited, reused, written = build(root, cues, used)
+
+    assert edited != tree
+    assert cuetree.load(root, edited)[0] == cues
+    # The chunk holding the cue and the nodes above it
+    assert written <= 4
+    assert len(set(reused.values()) - set(used.values())) == written
+
+
+def test_prefetch_reads_every_node(root):
+    cues = cue_keys(2000)
+    tree, used, _ = build(root, cues)
+
+    objects = {}
+    cuetree.prefetch(root, [tree], objects)
+    assert set(objects.keys()) == set(used.values())
+    assert cuetree.load(root, tree, objects)[0] == cues
+
+
+def test_failed_save_followed_by_a_good_save(root, monkeypatch):
+    p = Project(root=root)
+    stack = p.cue_stacks[0]
+    for i in range(200):
+        stack += Cue(p, name="Cue {0}".format(i), number=i)
+    p.store()
+
+    stack[100].name = "Edited"
+
+    def fail(tx):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as m:
+        m.setattr(storage.Transaction, 'commit', fail)
+        with pytest.raises(OSError):
+            p.store()
+    p.store()
+    p.close()
+
+    storage.forget(root)
+    history.forget(root)
+    q = Project.load(root)
+    assert [c.name for c in q.cue_stacks[0]][99:102] == ["Cue 99", "Edited", "Cue 101"]
+    assert len(q.cue_stacks[0]) == 200
+    q.close()
@@ -0,0 +1,152 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import types
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import GLib
+
+from SoundClip import discovery, mediainfo
+from SoundClip.mediainfo import MediaInfo, MediaInfoCache
+
+
+class FakeDiscoverer(object):
+    """
+    Stands in for `GstPbutils.Discoverer`, files are only discovered once the test finishes them
+    """
+
+    started = []
+
+    def __init__(self):
+        self.handler = None
+        self.stopped = False
+
+    @staticmethod
+    def new(timeout):
+        return FakeDiscoverer()
+
+    def connect(self, signal, handler):
+        self.handler = handler
+
+    def start(self):
+        pass
+
+    def stop(self):
+        self.stopped = True
+
+    def discover_uri_async(self, uri):
+        FakeDiscoverer.started.append((self, mediainfo.to_path(uri)))
+        return True
+
+
+def finish(path):
+    for i, (d, p) in enumerate(FakeDiscoverer.started):
+        if p == path:
+            del FakeDiscoverer.started[i]
+            d.handler(d, None, None)
+            return
+    raise AssertionError("{0} is not being discovered".format(path))
+
+
+def iterate():
+    ctx = GLib.MainContext.default()
+    while ctx.pending():
+        ctx.iteration(False)
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    FakeDiscoverer.started = []
+    monkeypatch.setattr(discovery, 'GstPbutils', types.SimpleNamespace(Discoverer=FakeDiscoverer))
+    return discovery.DiscoveryService(cache=MediaInfoCache(str(tmp_path / 'mediainfo')), concurrency=2)
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for i in range(5):
+        path = tmp_path / "{0}.wav".format(i)
+        path.write_bytes(b'audio' * (i + 1))
+        paths.append(str(path))
+    return paths
+
+
+def test_cached_files_are_reported_on_the_next_iteration(service, files):
+    st = os.stat(files[0])
+    service.cache.put(MediaInfo(files[0], st.st_size, st.st_mtime_ns, st.st_ino, duration=1000))
+    results = []
+    service.submit(files[0], results.append)
+    service.submit(files[0] + '.missing', results.append)
+    assert results == []
+
+    iterate()
+    assert [m.duration if m is not None else None for m in results] == [1000, None]
+    assert FakeDiscoverer.started == []
+
+
+def test_concurrency_and_priority(service, files):
+    results = []
+    service.submit_batch(files[0:4], lambda m: results.append(m.path))
+    service.prioritize(files[3])
+    iterate()
+
+    assert [p for d, p in FakeDiscoverer.started] == [files[3], files[0]]
+    assert service.pending == 4
+
+    finish(files[0])
+    iterate()
+    assert results == [files[0]]
+    assert [p for d, p in FakeDiscoverer.started] == [files[3], files[1]]
+    assert service.progress == (1, 4)
+
+    for path in (files[3], files[1], files[2]):
+        finish(path)
+        iterate()
+    assert results == [files[0], files[3], files[1], files[2]]
+    assert service.pending == 0
+    assert service.progress == (0, 0)
+    assert all(service.cache.lookup(path) is not None for path in files[0:4])
+
+
+def test_requests_for_the_same_file_share_a_discovery(service, files):
+    first, second = [], []
+    service.submit(files[0], first.append)
+    service.submit(files[0], second.append)
+    iterate()
+    assert len(FakeDiscoverer.started) == 1
+
+    finish(files[0])
+    iterate()
+    assert first == second
+    assert len(first) == 1
+
+
+def test_cancelled_files_are_not_discovered(service, files):
+    idle = []
+    service.connect('idle', lambda s: idle.append(True))
+    callback = lambda m: None
+    service.submit_batch(files[0:3], callback)
+    service.cancel(files[2], callback)
+    iterate()
+
+    for path in files[0:2]:
+        finish(path)
+        iterate()
+    assert FakeDiscoverer.started == []
+    assert service.cache.lookup(files[2]) is None
+    assert idle == [True]
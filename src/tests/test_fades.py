@@ -0,0 +1,138 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import math
+import types
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import Gst
+
+from SoundClip import fades
+
+
+@pytest.mark.parametrize('shape', fades.SHAPES)
+@pytest.mark.parametrize('start,target', [(0.0, 1.0), (1.0, 0.0), (0.2, 0.7)])
+def test_shapes_run_from_start_to_target(shape, start, target):
+    assert fades.shape_value(shape, start, target, 0.0) == pytest.approx(start)
+    assert fades.shape_value(shape, start, target, 1.0) == pytest.approx(target)
+    values = [fades.shape_value(shape, start, target, i / 100) for i in range(101)]
+    # Never overshoots, and never turns back
+    assert all((b - a) * (target - start) >= -1e-12 for a, b in zip(values, values[1:]))
+
+
+def test_shape_values():
+    assert fades.shape_value(fades.LINEAR, 0.0, 1.0, 0.25) == pytest.approx(0.25)
+    assert fades.shape_value(fades.EQUAL_POWER, 1.0, 0.0, 0.5) == pytest.approx(math.cos(math.pi / 4))
+    assert fades.shape_value(fades.S_CURVE, 0.0, 1.0, 0.5) == pytest.approx(0.5)
+    # Halfway down an exponential fade is about 20dB down
+    assert fades.shape_value(fades.EXPONENTIAL, 1.0, 0.0, 0.5) == pytest.approx(0.1, abs=0.01)
+    # Out of range positions are clamped, unknown shapes fade linearly
+    assert fades.shape_value(fades.LINEAR, 0.0, 1.0, 2.0) == 1.0
+    assert fades.shape_value('unknown', 0.0, 1.0, 0.5) == pytest.approx(0.5)
+
+
+def test_fades_down_mirror_fades_up():
+    for shape in fades.SHAPES:
+        for i in range(11):
+            up = fades.shape_value(shape, 0.0, 1.0, i / 10)
+            down = fades.shape_value(shape, 1.0, 0.0, 1.0 - i / 10)
+            assert up == pytest.approx(down)
+
+
+def test_linear_fades_have_two_control_points():
+    points = fades.control_points(fades.LINEAR, 0.0, 1.0, 5, 1000 * Gst.MSECOND)
+    assert points == [(5, 0.0), (5 + 1000 * Gst.MSECOND, 1.0)]
+
+
+def test_curves_are_sampled_every_curve_resolution():
+    position = 2000 * Gst.MSECOND
+    points = fades.control_points(fades.S_CURVE, 1.0, 0.0, position, 1000 * Gst.MSECOND)
+    assert len(points) == 1000 // fades.CURVE_RESOLUTION + 1
+    assert points[0] == (position, 1.0)
+    assert points[-1] == (position + 1000 * Gst.MSECOND, 0.0)
+    assert all(b[0] - a[0] == fades.CURVE_RESOLUTION * Gst.MSECOND for a, b in zip(points, points[1:]))
+
+    # Fades shorter than the resolution still have their start and end
+    assert len(fades.control_points(fades.EXPONENTIAL, 0.0, 1.0, 0, Gst.MSECOND)) == 2
+
+
+class FakeSegment(object):
+
+    def parse_segment(self):
+        # Stream time and running time are the same
+        return types.SimpleNamespace(to_stream_time=lambda fmt, t: t)
+
+
+class FakePad(object):
+    """
+    The src pad of a volume element, which buffers and events are pushed through by hand
+    """
+
+    def __init__(self):
+        self.probes = {}
+        self.segment = FakeSegment()
+        self.__next = 0
+
+    def add_probe(self, mask, callback, *args):
+        self.__next += 1
+        self.probes[self.__next] = (callback, args)
+        return self.__next
+
+    def remove_probe(self, probe):
+        del self.probes[probe]
+
+    def get_sticky_event(self, event_type, index):
+        return self.segment
+
+    def __push(self, info):
+        for probe, (callback, args) in list(self.probes.items()):
+            if callback(self, info, *args) == Gst.PadProbeReturn.REMOVE:
+                del self.probes[probe]
+
+    def push_buffer(self, pts, duration):
+        buf = types.SimpleNamespace(pts=pts, duration=duration)
+        self.__push(types.SimpleNamespace(type=Gst.PadProbeType.BUFFER, get_buffer=lambda: buf))
+
+    def push_event(self, event_type):
+        event = types.SimpleNamespace(type=event_type)
+        self.__push(types.SimpleNamespace(type=Gst.PadProbeType.EVENT_DOWNSTREAM, get_event=lambda: event))
+
+
+class FakeVolume(object):
+
+    def __init__(self):
+        self.pad = FakePad()
+
+    def get_static_pad(self, name):
+        return self.pad
+
+
+def test_position_follows_the_buffers_leaving_the_volume_element():
+    volume = FakeVolume()
+    fader = fades.Fader(volume)
+    assert fader.position is None
+
+    volume.pad.push_buffer(0, 20 * Gst.MSECOND)
+    volume.pad.push_buffer(20 * Gst.MSECOND, 20 * Gst.MSECOND)
+    assert fader.position == 40 * Gst.MSECOND
+
+    # A seek starts a new segment, the position is unknown until its first buffer
+    volume.pad.push_event(Gst.EventType.FLUSH_STOP)
+    assert fader.position is None
+    volume.pad.push_event(Gst.EventType.SEGMENT)
+    volume.pad.push_buffer(5000 * Gst.MSECOND, 20 * Gst.MSECOND)
+    assert fader.position == 5020 * Gst.MSECOND
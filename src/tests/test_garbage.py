@@ -0,0 +1,158 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import time
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import garbage, history, storage
+from SoundClip.cue import Cue
+from SoundClip.project import Project
+
+
+def saved_revisions(root, count):
+    p = Project(root=root)
+    p.cue_stacks[0] += Cue(p, name="Cue", number=1)
+    revisions = []
+    for i in range(count):
+        p.cue_stacks[0][0].name = "Revision {0}".format(i)
+        p.store()
+        revisions.append(p.cue_stacks[0][0].current_hash)
+    # Objects written after a collection started are always kept
+    time.sleep(0.05)
+    return p, revisions
+
+
+def test_keeps_history_depth_revisions(root):
+    p, revisions = saved_revisions(root, 6)
+
+    stats = garbage.collect(root, history_depth=2, pack=False)
+
+    assert stats['pruned'] > 0
+    assert [storage.exists(root, key) for key in revisions] == [False] * 3 + [True] * 3
+    p.close()
+
+
+def test_history_depth_zero_keeps_only_the_current_revision(root):
+    p, revisions = saved_revisions(root, 3)
+
+    garbage.collect(root, history_depth=0, pack=False)
+
+    assert [storage.exists(root, key) for key in revisions] == [False, False, True]
+    p.close()
+
+
+def test_removes_unreachable_objects_and_packs(root):
+    p, revisions = saved_revisions(root, 2)
+    unreachable, _ = storage.write(root, {'name': 'Unreachable'}, None)
+    time.sleep(0.05)
+
+    stats = garbage.collect(root, history_depth=10)
+
+    assert not storage.exists(root, unreachable)
+    assert stats['packed'] > 0
+    assert all(storage.exists(root, key) for key in revisions)
+    p.close()
+
+    storage.forget(root)
+    history.forget(root)
+    assert Project.load(root).cue_stacks[0][0].name == "Revision 1"
+
+
+def test_compacts_the_verified_log(root):
+    p, revisions = saved_revisions(root, 1)
+    storage.set_verify_policy(root, storage.VerifyPolicy.TRUSTED)
+    unreachable, _ = storage.write(root, {'name': 'Unreachable'}, None)
+    storage.read(root, unreachable)
+    storage.read(root, revisions[0], force_reload=True)
+    storage.get_verified(root).flush()
+    time.sleep(0.05)
+
+    garbage.collect(root, history_depth=10, pack=False)
+
+    verified = [line.split()[0] for line in storage.get_backend(root).read_log(storage.VERIFIED_NAME)]
+    assert revisions[0] in verified
+    assert unreachable not in verified
+    p.close()
+
+
+def test_keeps_objects_reused_during_collection(root):
+    p, revisions = saved_revisions(root, 2)
+    old = revisions[0]
+    d = json.loads(storage.codec.decode(storage.read_raw(root, old)))
+
+    def on_progress(gc, phase, done, total):
+        if phase is garbage.GCPhase.MARK:
+            # A save that brings the old revision back only references the existing object
+            with storage.Transaction(root) as tx:
+                assert tx.write(dict(d), '')[0] == old
+
+    gc = garbage.GarbageCollector(root, history_depth=0)
+    gc.connect('progress', on_progress)
+    gc.run()
+
+    assert storage.exists(root, old)
+    assert not storage.reused(root)
+    p.close()
+
+
+def test_restarts_when_the_project_is_saved(root):
+    p, revisions = saved_revisions(root, 2)
+    saves = []
+
+    def on_progress(gc, phase, done, total):
+        if phase is garbage.GCPhase.SWEEP and not saves:
+            p.cue_stacks[0][0].name = "Saved during collection"
+            p.store()
+            saves.append(p.cue_stacks[0][0].current_hash)
+            time.sleep(0.05)
+
+    gc = garbage.GarbageCollector(root, project=p, history_depth=0, batch_size=1)
+    gc.connect('progress', on_progress)
+    stats = gc.run()
+
+    assert stats['restarts'] == 1
+    assert storage.exists(root, saves[0])
+    assert not storage.exists(root, revisions[0])
+    p.close()
+
+
+def test_refuses_to_collect_without_a_project(root):
+    with pytest.raises(garbage.GarbageCollectionException):
+        garbage.collect(root)
+
+
+def test_history_depth_follows_the_history_index_after_a_load(root):
+    p, revisions = saved_revisions(root, 2)
+    p.close()
+    storage.forget(root)
+    history.forget(root)
+
+    # The first save after a load links the stored object to the revision before the one that was loaded
+    q = Project.load(root)
+    q.cue_stacks[0][0].name = "After loading"
+    q.store()
+    current = q.cue_stacks[0][0].current_hash
+    assert storage.read(root, current)['previousRevision'] != revisions[1]
+    time.sleep(0.05)
+
+    garbage.collect(root, history_depth=1, pack=False)
+
+    assert storage.exists(root, current)
+    assert storage.exists(root, revisions[1])
+    assert list(history.get(root).log(current)) == [current, revisions[1]]
+    q.close()
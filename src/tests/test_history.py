@@ -0,0 +1,108 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import history, storage
+from SoundClip.cue import Cue
+from SoundClip.project import Project
+from SoundClip.util import sha
+
+
+def keys(*names):
+    return [sha(name) for name in names]
+
+
+def reload(root):
+    history.forget(root)
+    return history.get(root)
+
+
+def test_record_and_reload(root):
+    a, b, c, r1, r2 = keys('a', 'b', 'c', 'r1', 'r2')
+    h = history.get(root)
+    h.record({a: '', b: a, r1: ''}, revision=r1, timestamp=100.0)
+    h.record({c: b, r2: r1}, revision=r2, timestamp=200.0)
+
+    h = reload(root)
+    assert list(h.log(c)) == [c, b, a]
+    assert list(h.log(c, limit=2)) == [c, b]
+    assert h.parent(a) is None
+    assert h.revisions() == [(100.0, r1), (200.0, r2)]
+    assert h.parent(r2) == r1
+
+
+def test_revision_at(root):
+    r1, r2 = keys('r1', 'r2')
+    h = history.get(root)
+    h.record({}, revision=r1, timestamp=100.0)
+    h.record({}, revision=r2, timestamp=200.0)
+
+    assert h.revision_at(50.0) is None
+    assert h.revision_at(100.0) == r1
+    assert h.revision_at(199.0) == r1
+    assert h.revision_at(1000.0) == r2
+
+
+def test_torn_last_line_is_ignored(root):
+    a, b = keys('a', 'b')
+    history.get(root).record({a: ''})
+    with open(os.path.join(root, '.soundclip', history.HISTORY_NAME), 'a') as f:
+        f.write("o {0} {1}".format(b, a)[:30])
+
+    h = reload(root)
+    assert a in h
+    assert len(h) == 1
+
+
+def test_compact(root):
+    a, b, c, r1 = keys('a', 'b', 'c', 'r1')
+    h = history.get(root)
+    h.record({a: '', b: a, c: b, r1: ''}, revision=r1, timestamp=100.0)
+    h.compact({b, c, r1})
+
+    h = reload(root)
+    assert len(h) == 3
+    assert a not in h
+    assert h.revisions() == [(100.0, r1)]
+    assert h.parent(c) == b
+
+
+def test_falls_back_to_the_stored_previous_revision(root):
+    first, _ = storage.write(root, {'name': 'Cue'}, None)
+    second, _ = storage.write(root, {'name': 'Cue', 'previousRevision': first}, None)
+
+    assert list(reload(root).log(second)) == [second, first]
+
+
+def test_load_and_revert_to_earlier_revisions(root):
+    p = Project(root=root)
+    p.cue_stacks[0] += Cue(p, name="First", number=1)
+    p.store()
+    first = p.current_hash
+    p.cue_stacks[0][0].name = "Second"
+    p.cue_stacks[0] += Cue(p, name="Added", number=2)
+    p.store()
+
+    assert [k for t, k in p.revisions()] == [first, p.current_hash]
+    assert [c.name for c in Project.load(root, revision=first).cue_stacks[0]] == ["First"]
+
+    p.revert_to(first)
+    assert p.current_hash == first
+    assert [c.name for c in p.cue_stacks[0]] == ["First"]
+    p.close()
@@ -0,0 +1,173 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import time
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import GLib
+
+from SoundClip import history, journal, storage
+from SoundClip.cue import ControlCue, Cue
+from SoundClip.project import Project
+from SoundClip.util import sha
+
+
+def saved_project(root, count=5):
+    p = Project(root=root)
+    for i in range(count):
+        p.cue_stacks[0] += Cue(p, name="Cue {0}".format(i), number=i)
+    p.store()
+    return p
+
+
+def crash_and_load(root):
+    # Drop everything held in memory without closing the project
+    storage.forget(root)
+    history.forget(root)
+    return Project.load(root)
+
+
+def names(project):
+    return [c.name for c in project.cue_stacks[0]]
+
+
+def test_replay_after_a_crash(root):
+    p = saved_project(root)
+    saved = p.current_hash
+    stack = p.cue_stacks[0]
+    stack[1].name = "Edited"
+    stack.insert(0, Cue(p, name="Inserted", number=0.5))
+    stack.pop(4)
+    stack.rename("Main")
+    p.name = "Renamed show"
+    p.journal.flush()
+
+    q = crash_and_load(root)
+    assert names(q) == ["Inserted", "Cue 0", "Edited", "Cue 2", "Cue 4"]
+    assert q.cue_stacks[0].name == "Main"
+    assert q.name == "Renamed show"
+    assert q.current_hash == saved
+    assert q.cue_stacks[0][0].needs_store()
+
+
+def test_replaced_cues_are_replayed(root):
+    p = saved_project(root)
+    p.cue_stacks[0][2] = Cue(p, name="Replacement", number=2.5)
+    p.cue_stacks[0][-1] = Cue(p, name="Last", number=9)
+    p.journal.flush()
+
+    assert names(crash_and_load(root)) == ["Cue 0", "Cue 1", "Replacement", "Cue 3", "Last"]
+
+
+def test_replay_after_a_torn_tail(root):
+    p = saved_project(root)
+    p.cue_stacks[0][0].name = "Written"
+    p.journal.flush()
+    with open(os.path.join(root, '.soundclip', journal.JOURNAL_NAME), 'a') as f:
+        f.write('{"seq": 2, "op": "set", "stack": 0, "ind')
+
+    q = crash_and_load(root)
+    assert names(q)[0:2] == ["Written", "Cue 1"]
+
+    # Edits recorded after recovering from the torn tail survive the next crash as well
+    q.cue_stacks[0][1].name = "After recovery"
+    q.journal.flush()
+    assert names(crash_and_load(root))[0:2] == ["Written", "After recovery"]
+
+
+def test_saving_restarts_the_journal(root):
+    p = saved_project(root)
+    p.cue_stacks[0][0].name = "Saved"
+    p.journal.flush()
+    p.store()
+
+    header, records = journal.read(root)
+    assert header['base'] == p.current_hash
+    assert records == []
+    assert names(crash_and_load(root))[0] == "Saved"
+
+
+def test_closing_discards_the_journal(root):
+    p = saved_project(root)
+    p.cue_stacks[0][0].name = "Unsaved"
+    p.journal.flush()
+    p.close()
+
+    assert journal.read(root) == (None, [])
+    assert names(crash_and_load(root))[0] == "Cue 0"
+
+
+def wait_for_save(project):
+    ctx = GLib.MainContext.default()
+    while project.saving or ctx.pending():
+        ctx.iteration(False)
+        time.sleep(0.001)
+
+
+def test_saving_a_checkpoint_records_the_revision(root):
+    p = saved_project(root)
+    p.cue_stacks[0][0].name = "Checkpointed"
+    p.journal.flush()
+    p.store_async(checkpoint=True)
+    wait_for_save(p)
+    checkpoint = p.current_hash
+    assert [k for t, k in history.get(root).revisions()][-1] != checkpoint
+
+    p.store()
+    assert p.current_hash == checkpoint
+    assert sha(storage.read_project(root).strip()) == checkpoint
+    history.forget(root)
+    assert [k for t, k in history.get(root).revisions()][-1] == checkpoint
+
+
+def test_control_cue_targets_are_replayed(root):
+    p = saved_project(root)
+    stack = p.cue_stacks[0]
+    target = Cue(p, name="Target", number=0.5)
+    stack.insert(0, target)
+    control = ControlCue(p, None, 0.5, 1000, name="Fade target")
+    control.set_target(target)
+    stack += control
+    # Moves the target after the control cue was recorded
+    stack.insert(0, Cue(p, name="First", number=0.1))
+    stack[2].name = "Edited"
+    p.journal.flush()
+
+    q = crash_and_load(root)
+    replayed = q.cue_stacks[0][-1]
+    assert replayed.name == "Fade target"
+    assert replayed.target.resolve(q) is q.cue_stacks[0][1]
+    assert q.cue_stacks[0][1].name == "Target"
+
+
+def test_readding_a_lazy_stack_keeps_its_cues_unloaded(root):
+    saved_project(root).close()
+    p = Project.load(root, lazy=True)
+    stack = p.cue_stacks[0]
+    p.remove_cuelist(stack)
+    p.insert_cuelist(0, stack)
+    p.journal.flush()
+    p.snapshot()
+    assert stack.loaded() == []
+    assert [r['op'] for r in journal.read(root)[1]] == ['remove-stack', 'add-stack']
+
+    storage.forget(root)
+    history.forget(root)
+    q = Project.load(root, lazy=True)
+    assert q.cue_stacks[0].loaded() == []
+    assert names(q) == ["Cue {0}".format(i) for i in range(5)]
@@ -0,0 +1,104 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import mediainfo
+from SoundClip.mediainfo import MediaInfo, MediaInfoCache
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'mediainfo')
+
+
+def info_for(path, **kwargs):
+    st = os.stat(path)
+    return MediaInfo(path, st.st_size, st.st_mtime_ns, st.st_ino, **kwargs)
+
+
+def lines(path):
+    with open(path, 'rt') as f:
+        return f.readlines()
+
+
+def test_entries_survive_a_reload(path, tmp_path):
+    media = tmp_path / 'a.wav'
+    media.write_bytes(b'audio')
+    cache = MediaInfoCache(path)
+    cache.put(info_for(str(media), duration=1500, supported=True))
+
+    m = MediaInfoCache(path).lookup('file://' + str(media))
+    assert m.duration == 1500
+    assert m.supported
+
+
+def test_changed_files_are_not_looked_up(path, tmp_path):
+    media = tmp_path / 'a.wav'
+    media.write_bytes(b'audio')
+    cache = MediaInfoCache(path)
+    cache.put(info_for(str(media), duration=1500))
+
+    media.write_bytes(b'longer audio')
+    assert cache.lookup(str(media)) is None
+    assert cache.lookup(str(tmp_path / 'missing.wav')) is None
+
+
+def test_torn_last_line(path):
+    with open(path, 'wt') as f:
+        f.write(json.dumps(MediaInfo('/a', 1, 2, 3).as_dict()) + '\n')
+        f.write('{"path": "/b", "si')
+
+    cache = MediaInfoCache(path)
+    assert len(cache) == 1
+    cache.put(MediaInfo('/c', 1, 2, 3))
+
+    assert len(lines(path)) == 2
+    assert len(MediaInfoCache(path)) == 2
+
+
+def test_stale_lines_are_compacted(path):
+    cache = MediaInfoCache(path)
+    for i in range(50):
+        cache.put(MediaInfo('/a', i, 2, 3))
+    assert len(lines(path)) == 50
+
+    MediaInfoCache(path)
+    assert [json.loads(line)['size'] for line in lines(path)] == [49]
+
+
+def test_failed_compaction_is_not_fatal(path, monkeypatch):
+    with open(path, 'wt') as f:
+        for i in range(50):
+            f.write(json.dumps(MediaInfo('/a', i, 2, 3).as_dict()) + '\n')
+
+    def fail(self):
+        raise OSError("read-only file system")
+
+    monkeypatch.setattr(MediaInfoCache, 'compact', fail)
+    assert len(MediaInfoCache(path)) == 1
+
+
+def test_shared_cache(path):
+    cache = MediaInfoCache(path)
+    mediainfo.set_cache(cache)
+    try:
+        assert mediainfo.get_cache() is cache
+    finally:
+        mediainfo.set_cache(None)
@@ -0,0 +1,92 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import mixer
+
+
+class FakeBranch(object):
+    """
+    Stands in for a `mixer.MixerBranch`, without building any elements
+    """
+
+    def __init__(self, mixer):
+        self.mixer = mixer
+        self.owner = None
+        self.busy = False
+        self.uri = None
+        self.resets = 0
+
+    def point_at(self, uri):
+        self.uri = uri
+
+    def reset(self):
+        self.owner = None
+        self.busy = False
+        self.resets += 1
+
+
+@pytest.fixture
+def mix(monkeypatch):
+    monkeypatch.setattr(mixer, 'MixerBranch', FakeBranch)
+    return mixer.Mixer(size=1)
+
+
+def test_checked_in_branches_are_reused(mix):
+    owner = object()
+    b = mix.checkout(owner, 'file:///a.wav')
+    assert b.mixer is mix and b.owner is owner and b.uri == 'file:///a.wav'
+    assert (mix.checked_out, mix.idle) == (1, 0)
+
+    mix.checkin(b)
+    assert (mix.checked_out, mix.idle) == (0, 1)
+    assert b.owner is None and b.resets == 1
+
+    assert mix.checkout(object(), 'file:///b.wav') is b
+    assert b.uri == 'file:///b.wav' and mix.idle == 0
+
+
+def test_checking_in_twice_is_ignored(mix):
+    b = mix.checkout(object(), 'file:///a.wav')
+    mix.checkin(b)
+    mix.checkin(b)
+    assert b.resets == 1
+    assert (mix.checked_out, mix.idle) == (0, 1)
+
+
+def test_only_size_branches_are_kept(mix):
+    branches = [mix.checkout(object(), 'file:///a.wav') for i in range(3)]
+    assert len(set(branches)) == 3 and mix.checked_out == 3
+
+    for b in branches:
+        mix.checkin(b)
+    assert (mix.checked_out, mix.idle) == (0, 1)
+
+    mix.size = 0
+    assert mix.idle == 0
+    mix.size = -1
+    assert mix.size == 0
+
+
+def test_shutdown_takes_every_branch_out_of_the_mix(mix):
+    used = mix.checkout(object(), 'file:///a.wav')
+    mix.checkin(mix.checkout(object(), 'file:///b.wav'))
+
+    mix.shutdown()
+    assert used.resets == 1 and used.owner is None
+    assert (mix.checked_out, mix.idle) == (0, 0)
+    assert mix.pipeline is None
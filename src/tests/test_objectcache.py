@@ -0,0 +1,109 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from SoundClip.objectcache import ObjectCache
+
+
+def test_get_and_put():
+    c = ObjectCache()
+    assert c.get('a', 'k') is None
+    c.put('a', 'k', {'x': 1}, size=10)
+    assert c.get('a', 'k') == {'x': 1}
+    assert c.get('b', 'k') is None
+    assert ('a', 'k') in c
+
+    s = c.stats('a')
+    assert (s.hits, s.misses, s.entries, s.bytes) == (1, 1, 1, 10)
+
+
+def test_put_replaces_an_entry():
+    c = ObjectCache()
+    c.put('a', 'k', 1, size=10)
+    c.put('a', 'k', 2, size=4)
+    assert len(c) == 1
+    assert c.get('a', 'k') == 2
+    assert c.stats().bytes == 4
+
+
+def test_evicts_least_recently_used_by_count():
+    c = ObjectCache(max_entries=2)
+    c.put('a', 1, 'one')
+    c.put('a', 2, 'two')
+    c.get('a', 1)
+    c.put('a', 3, 'three')
+
+    assert c.get('a', 2) is None
+    assert c.get('a', 1) == 'one'
+    assert c.get('a', 3) == 'three'
+    assert c.stats('a').evictions == 1
+
+
+def test_evicts_least_recently_used_by_bytes():
+    c = ObjectCache(max_bytes=100)
+    c.put('a', 1, 'one', size=40)
+    c.put('b', 2, 'two', size=40)
+    c.get('a', 1)
+    c.put('a', 3, 'three', size=40)
+
+    # Eviction ignores namespaces, the entry of `b` was used least recently
+    assert c.get('b', 2) is None
+    assert len(c) == 2
+    assert c.stats().bytes == 80
+    assert c.stats('b').evictions == 1
+    assert c.stats('b').bytes == 0
+
+    c.put('a', 4, 'large', size=90)
+    assert len(c) == 1
+    assert c.get('a', 4) == 'large'
+
+
+def test_entry_over_budget_is_not_kept():
+    c = ObjectCache(max_bytes=10)
+    c.put('a', 1, 'huge', size=11)
+    assert len(c) == 0
+    assert c.stats().bytes == 0
+
+
+def test_configure_evicts_immediately():
+    c = ObjectCache()
+    for i in range(10):
+        c.put('a', i, i, size=1)
+    c.configure(max_entries=3)
+    assert len(c) == 3
+    assert [c.get('a', i) for i in (7, 8, 9)] == [7, 8, 9]
+    assert c.stats('a').evictions == 7
+
+
+def test_clear_a_namespace():
+    c = ObjectCache()
+    c.put('a', 1, 'one', size=5)
+    c.put('b', 1, 'one', size=7)
+    c.clear('a')
+
+    assert c.get('a', 1) is None
+    assert c.get('b', 1) == 'one'
+    assert c.stats().bytes == 7
+
+    c.clear()
+    assert len(c) == 0
+    assert c.stats().bytes == 0
+
+
+def test_discard():
+    c = ObjectCache()
+    c.put('a', 1, 'one', size=5)
+    c.discard('a', 1)
+    c.discard('a', 2)
+    assert len(c) == 0
+    assert c.stats('a').bytes == 0
@@ -0,0 +1,158 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import hashlib
+import os
+import shutil
+
+import pytest
+
+from SoundClip import pack
+
+
+def obj(content):
+    return hashlib.sha1(content).hexdigest(), content
+
+
+def test_append_and_read_back(tmp_path):
+    root = str(tmp_path)
+    objects = [obj("object {0}".format(i).encode()) for i in range(50)]
+
+    assert pack.append(root, objects) == 50
+
+    p = pack.PackFile(root)
+    try:
+        assert len(p) == 50
+        for key, content in objects:
+            assert key in p
+            assert p.get(key) == content
+        assert sorted(p.keys()) == sorted(key for key, _ in objects)
+        assert p.get(hashlib.sha1(b'missing').hexdigest()) is None
+        assert p.get('not hex') is None
+    finally:
+        p.close()
+
+
+def test_append_skips_objects_already_packed(tmp_path):
+    root = str(tmp_path)
+    first = [obj(b'a'), obj(b'b')]
+    pack.append(root, first)
+
+    p = pack.PackFile(root)
+    try:
+        assert pack.append(root, first + [obj(b'c')], existing=p) == 1
+    finally:
+        p.close()
+
+    p = pack.PackFile(root)
+    try:
+        assert len(p) == 3
+        assert p.get(obj(b'a')[0]) == b'a'
+        assert p.get(obj(b'c')[0]) == b'c'
+    finally:
+        p.close()
+
+
+def test_missing_pack_is_empty(tmp_path):
+    p = pack.PackFile(str(tmp_path))
+    assert len(p) == 0
+    assert obj(b'a')[0] not in p
+
+
+def test_rewrite_keeps_only_the_given_objects(tmp_path):
+    root = str(tmp_path)
+    keep = [obj(b'keep 1'), obj(b'keep 2')]
+    pack.append(root, keep + [obj(b'drop 1'), obj(b'drop 2')])
+    size = os.path.getsize(os.path.join(pack.pack_path(root), pack.PACK_NAME))
+
+    assert pack.rewrite(root, keep) == 2
+
+    assert os.path.getsize(os.path.join(pack.pack_path(root), pack.PACK_NAME)) < size
+    assert sorted(os.listdir(pack.pack_path(root))) == [pack.INDEX_NAME, pack.PACK_NAME]
+    p = pack.PackFile(root)
+    try:
+        assert len(p) == 2
+        for key, content in keep:
+            assert p.get(key) == content
+        assert obj(b'drop 1')[0] not in p
+    finally:
+        p.close()
+
+
+def test_stamp_changes_when_the_pack_is_rewritten(tmp_path):
+    root = str(tmp_path)
+    key, content = obj(b'content')
+    pack.append(root, [obj(b'other'), (key, content)])
+    p = pack.PackFile(root)
+    before = p.stamp(key)
+    p.close()
+
+    pack.rewrite(root, [(key, content)])
+    p = pack.PackFile(root)
+    try:
+        assert p.stamp(key) is not None
+        assert p.stamp(key) != before
+        assert p.stamp(obj(b'other')[0]) is None
+    finally:
+        p.close()
+
+
+def test_recover_finishes_a_committed_rewrite(tmp_path):
+    root = str(tmp_path)
+    path = pack.pack_path(root)
+    pack.append(root, [obj(b'old')])
+    for name in (pack.PACK_NAME, pack.INDEX_NAME):
+        shutil.copy(os.path.join(path, name), os.path.join(str(tmp_path), name))
+
+    # Simulate a crash right after the commit point of a rewrite: the new index is objects.idx.swap, the new pack
+    # is objects.pack.new and the old files are still in place
+    pack.rewrite(root, [obj(b'new')])
+    os.replace(os.path.join(path, pack.INDEX_NAME), os.path.join(path, pack.INDEX_NAME + '.swap'))
+    os.replace(os.path.join(path, pack.PACK_NAME), os.path.join(path, pack.PACK_NAME + '.new'))
+    for name in (pack.PACK_NAME, pack.INDEX_NAME):
+        shutil.copy(os.path.join(str(tmp_path), name), os.path.join(path, name))
+
+    p = pack.PackFile(root)
+    try:
+        assert p.get(obj(b'new')[0]) == b'new'
+        assert obj(b'old')[0] not in p
+    finally:
+        p.close()
+    assert sorted(os.listdir(path)) == [pack.INDEX_NAME, pack.PACK_NAME]
+
+
+def test_recover_discards_an_uncommitted_rewrite(tmp_path):
+    root = str(tmp_path)
+    path = pack.pack_path(root)
+    pack.append(root, [obj(b'old')])
+    with open(os.path.join(path, pack.PACK_NAME + '.new'), 'wb') as f:
+        f.write(b'half written')
+
+    p = pack.PackFile(root)
+    try:
+        assert p.get(obj(b'old')[0]) == b'old'
+    finally:
+        p.close()
+    assert sorted(os.listdir(path)) == [pack.INDEX_NAME, pack.PACK_NAME]
+
+
+def test_truncated_index_is_rejected(tmp_path):
+    root = str(tmp_path)
+    pack.append(root, [obj(b'a'), obj(b'b')])
+    index = os.path.join(pack.pack_path(root), pack.INDEX_NAME)
+    with open(index, 'r+b') as f:
+        f.truncate(os.path.getsize(index) - 10)
+
+    with pytest.raises(pack.PackException):
+        pack.PackFile(root)
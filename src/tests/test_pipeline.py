@@ -0,0 +1,121 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import pipeline
+
+
+class FakePipeline(object):
+    """
+    Stands in for a `pipeline.PlaybackPipeline`, without building any elements
+    """
+
+    built = []
+
+    def __init__(self):
+        self.owner = None
+        self.busy = False
+        self.uri = None
+        self.destroyed = False
+        FakePipeline.built.append(self)
+
+    def point_at(self, uri):
+        self.uri = uri
+
+    def reset(self):
+        self.owner = None
+        self.busy = False
+
+    def destroy(self):
+        self.reset()
+        self.destroyed = True
+
+
+class FakeOwner(object):
+
+    def __init__(self):
+        self.reclaimed = False
+
+    def on_pipeline_reclaimed(self):
+        self.reclaimed = True
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakePipeline.built = []
+    monkeypatch.setattr(pipeline, 'PlaybackPipeline', FakePipeline)
+    return pipeline.PipelinePool(size=2)
+
+
+def test_checked_in_pipelines_are_reused(pool):
+    owner = FakeOwner()
+    p = pool.checkout(owner, 'file:///a.wav')
+    assert p.owner is owner and p.uri == 'file:///a.wav'
+    assert (pool.checked_out, pool.idle) == (1, 0)
+
+    pool.checkin(p)
+    assert (pool.checked_out, pool.idle) == (0, 1)
+    assert p.owner is None
+
+    assert pool.checkout(FakeOwner(), 'file:///b.wav') is p
+    assert len(FakePipeline.built) == 1
+
+    # Pipelines that are not checked out are ignored
+    pool.checkin(FakePipeline())
+    assert (pool.checked_out, pool.idle) == (1, 0)
+
+
+def test_exhausted_pool_reclaims_the_oldest_idle_pipeline(pool):
+    first, second, third = FakeOwner(), FakeOwner(), FakeOwner()
+    a = pool.checkout(first, 'file:///a.wav')
+    b = pool.checkout(second, 'file:///b.wav')
+    # Touched pipelines are the last to be taken back
+    pool.touch(a)
+
+    c = pool.checkout(third, 'file:///c.wav')
+    assert c is b
+    assert second.reclaimed and not first.reclaimed
+    assert c.owner is third and c.uri == 'file:///c.wav'
+    assert pool.checked_out == 2
+
+
+def test_busy_pipelines_are_never_reclaimed(pool):
+    owners = [FakeOwner() for i in range(3)]
+    for owner in owners[:2]:
+        pool.checkout(owner, 'file:///a.wav').busy = True
+
+    extra = pool.checkout(owners[2], 'file:///b.wav')
+    assert not any(owner.reclaimed for owner in owners)
+    assert len(FakePipeline.built) == 3 and pool.checked_out == 3
+
+    # There is no room to keep the extra pipeline once it is returned
+    pool.checkin(extra)
+    assert extra.destroyed and pool.idle == 0
+
+
+def test_shrinking_the_pool_destroys_idle_pipelines(pool):
+    pipelines = [pool.checkout(FakeOwner(), 'file:///a.wav') for i in range(2)]
+    for p in pipelines:
+        pool.checkin(p)
+    assert pool.idle == 2
+
+    pool.size = 1
+    assert pool.idle == 1
+    assert [p.destroyed for p in pipelines] == [False, True]
+
+    pool.clear()
+    assert pool.idle == 0 and pipelines[0].destroyed
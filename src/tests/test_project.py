@@ -0,0 +1,48 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+
+import pytest
+
+pytest.importorskip('gi')
+
+from gi.repository import GLib
+
+from SoundClip import storage
+from SoundClip.cue import Cue
+from SoundClip.project import Project
+
+
+def wait_for_saves(project):
+    ctx = GLib.MainContext.default()
+    while project.saving or ctx.pending():
+        ctx.iteration(False)
+        time.sleep(0.001)
+
+
+def test_saves_queued_behind_a_running_save_call_every_callback(root):
+    p = Project(root=root)
+    p.cue_stacks[0] += Cue(p, name="Cue", number=1)
+    calls = []
+
+    p.store_async(lambda project, stacks, error: calls.append(('first', error)))
+    p.cue_stacks[0][0].name = "Edited"
+    p.store_async(lambda project, stacks, error: calls.append(('second', error)))
+    p.store_async(lambda project, stacks, error: calls.append(('third', error)))
+    wait_for_saves(p)
+
+    assert calls == [('first', None), ('second', None), ('third', None)]
+    assert storage.read(root, p.cue_stacks[0][0].current_hash, force_reload=True)['name'] == "Edited"
+    p.close()
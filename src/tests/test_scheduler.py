@@ -0,0 +1,129 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip.scheduler import Scheduler, Timer
+
+
+@pytest.fixture
+def s(loop):
+    return Scheduler(clock=loop.clock)
+
+
+def test_tasks_run_in_deadline_order(loop, s):
+    ran = []
+    s.call_later(30, ran.append, 'c')
+    s.call_later(10, ran.append, 'a')
+    s.call_at(loop.time + 20, ran.append, 'b')
+    assert len(s) == 3
+    assert len(loop.sources) == 1
+
+    loop.advance(15)
+    assert ran == ['a']
+    loop.advance(100)
+    assert ran == ['a', 'b', 'c']
+    assert len(s) == 0
+    assert loop.sources == {}
+
+
+def test_cancelled_tasks_do_not_run(loop, s):
+    ran = []
+    first = s.call_later(10, ran.append, 'first')
+    s.call_later(20, ran.append, 'second')
+    first.cancel()
+    first.cancel()
+    assert not first.active
+    assert len(s) == 1
+
+    loop.advance(100)
+    assert ran == ['second']
+
+    task = s.call_later(10, ran.append, 'third')
+    task.cancel()
+    assert loop.sources == {}
+
+
+def test_periodic_tasks(loop, s):
+    runs = []
+
+    def tick():
+        runs.append(loop.time)
+        return len(runs) < 3
+
+    task = s.call_every(10, tick)
+    loop.advance(100)
+    assert runs == [1010, 1020, 1030]
+    assert not task.active
+    with pytest.raises(ValueError):
+        s.call_every(0, tick)
+
+
+def test_periodic_tasks_skip_missed_runs(loop, s):
+    runs = []
+    s.call_every(10, lambda: runs.append(loop.time))
+
+    # The main loop was blocked for a while
+    loop.time += 35
+    loop.advance(0)
+    loop.advance(10)
+    assert runs == [1035, 1045]
+
+
+def test_failing_tasks_do_not_stop_the_others(loop, s):
+    ran = []
+
+    def fail():
+        raise RuntimeError()
+
+    failing = s.call_every(10, fail)
+    s.call_later(10, ran.append, 'other')
+    loop.advance(50)
+    assert ran == ['other']
+    assert not failing.active
+
+
+def test_many_cancellations(loop, s):
+    tasks = [s.call_later(i, lambda: None) for i in range(100)]
+    for task in tasks[:80]:
+        task.cancel()
+    assert len(s) == 20
+    loop.advance(200)
+    assert len(s) == 0
+
+
+def test_timer(loop, s):
+    updates = []
+    expired = []
+    timer = Timer(100, resolution=25, scheduler=s)
+    timer.connect('update', lambda t, elapsed: updates.append(elapsed))
+    timer.connect('expired', lambda t: expired.append(loop.time))
+    timer.fire()
+
+    loop.advance(200)
+    assert updates == [25, 50, 75]
+    assert expired == [1100]
+
+
+def test_cancelled_timer_does_not_expire(loop, s):
+    expired = []
+    timer = Timer(100, resolution=25, scheduler=s)
+    timer.connect('expired', lambda t: expired.append(True))
+    timer.fire()
+    loop.advance(30)
+    timer.cancel()
+    loop.advance(200)
+    assert expired == []
@@ -0,0 +1,125 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import storage
+from SoundClip.util import sha
+
+
+def test_commit_writes_objects_and_project(root):
+    with storage.Transaction(root) as tx:
+        key, previous = tx.write({'name': 'Cue 1'}, None)
+        tx.write_project({'name': 'Show', 'stacks': [key]})
+        assert not storage.exists(root, key)
+        assert storage.read_project(root) is None
+
+    assert previous is None
+    assert key == sha(json.dumps({'name': 'Cue 1', 'previousRevision': ''}, sort_keys=True))
+    assert storage.read(root, key)['name'] == 'Cue 1'
+    assert json.loads(storage.read_project(root))['stacks'] == [key]
+
+
+def test_abort_writes_nothing(root):
+    with pytest.raises(RuntimeError):
+        with storage.Transaction(root) as tx:
+            key, _ = tx.write({'name': 'Cue 1'}, None)
+            tx.write_project({'name': 'Show'})
+            raise RuntimeError()
+
+    assert not storage.exists(root, key)
+    assert storage.read_project(root) is None
+    assert list(storage.keys(root)) == []
+    assert os.listdir(os.path.join(root, '.soundclip', 'tmp')) == []
+
+
+def test_duplicates_are_written_once(root):
+    with storage.Transaction(root) as tx:
+        a, _ = tx.write({'name': 'Cue'}, None)
+        b, _ = tx.write({'name': 'Cue'}, None)
+        assert a == b
+        assert len(tx) == 1
+
+    with storage.Transaction(root) as tx:
+        c, previous = tx.write({'name': 'Cue'}, a)
+        assert c == a
+        assert len(tx) == 0
+
+
+def test_write_records_the_previous_revision(root):
+    first, _ = storage.write(root, {'name': 'Cue'}, None)
+    with storage.Transaction(root) as tx:
+        second, previous = tx.write({'name': 'Renamed'}, first)
+        assert tx.written == {second: first}
+
+    assert previous == first
+
+
+def test_committed_transaction_cannot_be_written_to(root):
+    tx = storage.Transaction(root)
+    tx.commit()
+    with pytest.raises(storage.StorageException):
+        tx.write({'name': 'Cue'}, None)
+
+
+def test_cleanup_removes_interrupted_saves(root):
+    tx = storage.Transaction(root)
+    tx.write({'name': 'Cue'}, None)
+    tmp = os.path.join(root, '.soundclip', 'tmp')
+    assert os.listdir(tmp)
+    path = os.path.join(tmp, os.listdir(tmp)[0])
+    with open(path, 'r+b') as f:
+        f.truncate(4)
+
+    storage.cleanup(root)
+    assert os.listdir(tmp) == []
+    assert list(storage.keys(root)) == []
+
+
+def test_cleanup_recovers_objects_whose_rename_was_lost(root):
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    tmp = os.path.join(root, '.soundclip', 'tmp')
+    os.replace(os.path.join(root, '.soundclip', 'objects', key[0:2], key[2:40]),
+               os.path.join(tmp, key + 'x1y2.tmp'))
+    assert not storage.exists(root, key)
+
+    storage.cleanup(root)
+    assert os.listdir(tmp) == []
+    assert storage.read(root, key, force_reload=True)['name'] == 'Cue'
+
+
+def test_compressed_and_plain_objects_share_keys(root):
+    plain, _ = storage.write(root, {'name': 'Plain'}, None)
+    storage.set_codec(root, 'zlib')
+    compressed, _ = storage.write(root, {'name': 'Compressed'}, None)
+
+    assert storage.read_raw(root, compressed).startswith(b'\0zlib\0')
+    assert compressed == sha(json.dumps({'name': 'Compressed', 'previousRevision': ''}, sort_keys=True))
+    assert storage.read(root, plain, force_reload=True)['name'] == 'Plain'
+    assert storage.read(root, compressed, force_reload=True)['name'] == 'Compressed'
+
+
+def test_undecodable_object_is_illegal(root):
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    path = os.path.join(root, '.soundclip', 'objects', key[0:2], key[2:40])
+    with open(path, 'wb') as f:
+        f.write(b'\0\0garbage')
+
+    with pytest.raises(storage.IllegalObjectException):
+        storage.read(root, key, force_reload=True)
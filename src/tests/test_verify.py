@@ -0,0 +1,111 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+
+import pytest
+
+pytest.importorskip('gi')
+
+from SoundClip import storage
+from SoundClip.verify import Verifier
+
+
+def tamper(root, key, d):
+    path = os.path.join(root, '.soundclip', 'objects', key[0:2], key[2:40])
+    with open(path, 'wt') as f:
+        f.write(json.dumps(d, sort_keys=True) + '\n')
+
+
+def count_verifications(monkeypatch):
+    calls = []
+    verify = storage.verify
+
+    def counting(key, content):
+        calls.append(key)
+        verify(key, content)
+
+    monkeypatch.setattr(storage, 'verify', counting)
+    return calls
+
+
+def test_inline_verifies_every_read(root, monkeypatch):
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    calls = count_verifications(monkeypatch)
+    storage.read(root, key)
+    storage.read(root, key, force_reload=True)
+    assert calls == [key, key]
+
+    tamper(root, key, {'name': 'Tampered with'})
+    with pytest.raises(storage.ChecksumMismatchException):
+        storage.read(root, key, force_reload=True)
+
+
+def test_trusted_only_verifies_objects_once(root, monkeypatch):
+    storage.set_verify_policy(root, storage.VerifyPolicy.TRUSTED)
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    calls = count_verifications(monkeypatch)
+    storage.read(root, key)
+    storage.read(root, key, force_reload=True)
+    assert calls == [key]
+
+    # The verified objects survive the project being closed
+    storage.forget(root)
+    storage.set_verify_policy(root, storage.VerifyPolicy.TRUSTED)
+    storage.read(root, key)
+    assert calls == [key]
+
+
+def test_verified_objects_are_kept_in_the_backend_log(root, monkeypatch):
+    storage.set_backend(root, 'sqlite')
+    storage.set_verify_policy(root, storage.VerifyPolicy.TRUSTED)
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    storage.read(root, key)
+    storage.forget(root)
+
+    assert not os.path.exists(os.path.join(root, '.soundclip', storage.VERIFIED_NAME))
+    assert [line.split()[0] for line in storage.get_backend(root).read_log(storage.VERIFIED_NAME)] == [key]
+
+    calls = count_verifications(monkeypatch)
+    storage.set_verify_policy(root, storage.VerifyPolicy.TRUSTED)
+    storage.read(root, key)
+    assert calls == []
+
+
+def test_trusted_verifies_objects_written_again(root):
+    storage.set_verify_policy(root, storage.VerifyPolicy.TRUSTED)
+    key, _ = storage.write(root, {'name': 'Cue'}, None)
+    storage.read(root, key)
+
+    tamper(root, key, {'name': 'Tampered with'})
+    with pytest.raises(storage.ChecksumMismatchException):
+        storage.read(root, key, force_reload=True)
+
+
+def test_deferred_verifies_in_the_background(root):
+    verifier = Verifier(root)
+    storage.set_verify_policy(root, storage.VerifyPolicy.DEFERRED, verifier)
+    good, _ = storage.write(root, {'name': 'Good'}, None)
+    bad, _ = storage.write(root, {'name': 'Bad'}, None)
+    tamper(root, bad, {'name': 'Tampered with'})
+
+    assert storage.read(root, good)['name'] == 'Good'
+    assert storage.read(root, bad)['name'] == 'Tampered with'
+    verifier.wait()
+
+    assert verifier.verified == 1
+    assert [ex.args[0]['key'] for ex in verifier.mismatches] == [bad]
+    assert (root, bad) not in storage.get_cache()
+    assert storage.get_verified(root).check(good, storage.get_backend(root).read(good)[1])